@@ -0,0 +1,80 @@
+"""Compare the per-request cost of the header injection middleware.
+
+Run from the root of the project with:
+
+    uv run python -m benchmarks.bench_header_injection
+"""
+
+import asyncio
+import json
+import time
+
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from proxy.middleware import HeaderInjectionMiddleware
+
+FIXED_HEADERS = {"X-Custom-Header": "Value", "X-Other-Header": "Other"}
+AUTHORIZATION = b"Bearer token"
+
+
+class StaticTokenManager:
+    """Stand-in for TokenManager that always holds a valid token."""
+
+    current = AUTHORIZATION
+
+
+async def endpoint(scope, receive, send):
+    """Answer every request with an empty 200 response."""
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def legacy_mutate_headers(request, call_next):
+    """Reproduce the previous BaseHTTPMiddleware-based header mutation."""
+    mutable_headers = list(request.scope["headers"])
+    for header, value in FIXED_HEADERS.items():
+        mutable_headers.append((header.lower().encode("utf-8"), value.encode("utf-8")))
+    mutable_headers.append((b"authorization", AUTHORIZATION))
+    request.scope["headers"] = mutable_headers
+    return await call_next(request)
+
+
+async def measure(app, iterations: int) -> float:
+    """Return the mean time in microseconds to serve one request through app."""
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": "/pets",
+            "query_string": b"",
+            "headers": [(b"host", b"localhost"), (b"accept", b"*/*")],
+        }
+        await app(scope, receive, send)
+    return (time.perf_counter() - start) / iterations * 1_000_000
+
+
+async def run(iterations: int = 20_000) -> dict:
+    """Measure the baseline, legacy and current middleware."""
+    apps = {
+        "no_middleware": endpoint,
+        "base_http_middleware": BaseHTTPMiddleware(
+            endpoint, dispatch=legacy_mutate_headers
+        ),
+        "header_injection_middleware": HeaderInjectionMiddleware(
+            endpoint, FIXED_HEADERS, token_manager=StaticTokenManager()
+        ),
+    }
+    return {name: await measure(app, iterations) for name, app in apps.items()}
+
+
+if __name__ == "__main__":
+    results = asyncio.run(run())
+    print(json.dumps({f"{name}_us": round(us, 2) for name, us in results.items()}))
@@ -0,0 +1,285 @@
+"""Load-test the proxy against an in-process stand-in origin.
+
+A fake origin, OAuth2 token endpoint and schema host run in a thread of the
+benchmark process, serving synthetic schemas of the requested sizes. For each
+schema size the proxy is started as a separate process, and requests are
+driven through it at each concurrency level. Every run prints one JSON line
+with its throughput, latency percentiles, proxy startup time and memory use,
+so results can be compared between versions.
+
+Run from the root of the project with:
+
+    uv run python -m benchmarks.bench_load
+
+Proxy settings are passed through as environment variables, for example:
+
+    uv run python -m benchmarks.bench_load --operations 5000 --env TRIE_ROUTING=true
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from benchmarks.schemas import sample_paths, synthetic_schema
+
+HOST = "127.0.0.1"
+RESOURCE_BODY = json.dumps({"id": 1, "name": "resource", "tags": ["a", "b"]}).encode()
+
+
+def free_port() -> int:
+    """Return a TCP port that is free on the loopback interface."""
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+class StandInOrigin:
+    """Serve schemas, OAuth2 tokens and origin responses from a thread."""
+
+    def __init__(self):
+        self.port = free_port()
+        self.base_url = f"http://{HOST}:{self.port}"
+        self.token_requests = 0
+        self._schemas: dict[int, bytes] = {}
+        app = Starlette(
+            routes=[
+                Route("/schemas/{operations:int}.json", self.schema),
+                Route("/oauth/token", self.token, methods=["POST"]),
+                Route("/{path:path}", self.resource),
+            ]
+        )
+        config = uvicorn.Config(
+            app, host=HOST, port=self.port, log_level="warning", lifespan="off"
+        )
+        self.server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def schema_url(self, operations: int) -> str:
+        """Return the URL of a synthetic schema with ``operations`` operations."""
+        return f"{self.base_url}/schemas/{operations}.json"
+
+    async def schema(self, request: Request) -> Response:
+        """Serve a synthetic OpenAPI schema."""
+        operations = request.path_params["operations"]
+        if operations not in self._schemas:
+            self._schemas[operations] = json.dumps(
+                synthetic_schema(operations)
+            ).encode()
+        return Response(self._schemas[operations], media_type="application/json")
+
+    async def token(self, request: Request) -> Response:
+        """Issue an OAuth2 access token."""
+        self.token_requests += 1
+        return JSONResponse(
+            {"access_token": f"token-{self.token_requests}", "expires_in": 3600}
+        )
+
+    async def resource(self, request: Request) -> Response:
+        """Answer any other request with a small JSON document."""
+        return Response(RESOURCE_BODY, media_type="application/json")
+
+    def __enter__(self):
+        self._thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.should_exit = True
+        self._thread.join()
+
+
+class ProxyProcess:
+    """Run the proxy in a child process configured against the stand-in."""
+
+    def __init__(self, origin: StandInOrigin, operations: int, env: dict):
+        self.port = free_port()
+        self.base_url = f"http://{HOST}:{self.port}"
+        self.env = {
+            **os.environ,
+            "OPENAPI_SCHEMA_URL": origin.schema_url(operations),
+            "ORIGIN_BASE_URL": origin.base_url,
+            "AUTH_ENDPOINT_URL": f"{origin.base_url}/oauth/token",
+            "CLIENT_ID": "benchmark",
+            "CLIENT_SECRET": "benchmark",
+            "LOG_LEVEL": "WARNING",
+            **env,
+        }
+        self.process: subprocess.Popen | None = None
+        self.startup_seconds = 0.0
+
+    def start(self, timeout: float = 120.0):
+        """Start the proxy and wait until it answers requests."""
+        command = [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "proxy.app:app",
+            "--host",
+            HOST,
+            "--port",
+            str(self.port),
+            "--log-level",
+            "warning",
+            "--no-access-log",
+        ]
+        started_at = time.perf_counter()
+        self.process = subprocess.Popen(command, env=self.env)
+        while time.perf_counter() - started_at < timeout:
+            if self.process.poll() is not None:
+                raise RuntimeError("The proxy exited during startup")
+            try:
+                if httpx.get(f"{self.base_url}/").status_code == 200:
+                    self.startup_seconds = time.perf_counter() - started_at
+                    return
+            except httpx.TransportError:
+                time.sleep(0.02)
+        raise TimeoutError("The proxy did not start in time")
+
+    def rss_bytes(self) -> int | None:
+        """Return the resident memory of the proxy process, where known."""
+        try:
+            with open(f"/proc/{self.process.pid}/status") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
+
+    def stop(self):
+        """Stop the proxy process."""
+        self.process.terminate()
+        self.process.wait()
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Return the value below which ``fraction`` of the sorted values fall."""
+    index = min(int(fraction * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+async def drive(base_url: str, paths: list, concurrency: int) -> dict:
+    """Request ``paths`` through the proxy with ``concurrency`` clients."""
+    latencies = []
+    errors = 0
+    remaining = iter(paths)
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=30.0
+    ) as client:
+
+        async def user():
+            nonlocal errors
+            for path in remaining:
+                started_at = time.perf_counter()
+                try:
+                    response = await client.get(path)
+                    if response.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started_at)
+
+        started_at = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started_at
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+def run(
+    origin: StandInOrigin,
+    operations: int,
+    concurrency_levels: list,
+    requests: int,
+    env: dict,
+):
+    """Benchmark a proxy serving a schema of ``operations`` operations."""
+    proxy = ProxyProcess(origin, operations, env)
+    proxy.start()
+    try:
+        paths = sample_paths(operations, requests)
+        # Warm up connections, the token and any caches before measuring.
+        asyncio.run(drive(proxy.base_url, paths[: min(requests, 200)], 8))
+        for concurrency in concurrency_levels:
+            results = asyncio.run(drive(proxy.base_url, paths, concurrency))
+            print(
+                json.dumps(
+                    {
+                        "operations": operations,
+                        "concurrency": concurrency,
+                        **results,
+                        "startup_s": round(proxy.startup_seconds, 3),
+                        "rss_mb": round((proxy.rss_bytes() or 0) / 2**20, 1),
+                        "env": env,
+                    }
+                ),
+                flush=True,
+            )
+    finally:
+        proxy.stop()
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """Parse the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--operations",
+        default="10,1000,5000",
+        help="comma-separated schema sizes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        default="1,16,64",
+        help="comma-separated concurrency levels (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=2_000,
+        help="requests per run (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--env",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="environment variable for the proxy; may be repeated",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run the benchmark for every schema size."""
+    args = parse_args(argv)
+    env = dict(entry.split("=", 1) for entry in args.env)
+    concurrency_levels = [int(level) for level in args.concurrency.split(",")]
+    with StandInOrigin() as origin:
+        for operations in args.operations.split(","):
+            run(origin, int(operations), concurrency_levels, args.requests, env)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Compare FastAPI's per-operation routes with the trie dispatcher.
+
+Run from the root of the project with:
+
+    uv run python -m benchmarks.bench_router
+"""
+
+import json
+import logging
+import time
+
+from fastapi.routing import APIRouter
+from starlette.routing import Match
+
+from benchmarks.schemas import sample_paths, synthetic_schema
+from proxy.proxy import create_proxy_routes
+
+ORIGIN = "http://origin.invalid"
+
+
+def build_router(schema: dict, trie_routing: bool) -> tuple[APIRouter, float]:
+    """Build a router for ``schema`` and return it with the time it took."""
+    router = APIRouter()
+    start = time.perf_counter()
+    create_proxy_routes(router, schema, ORIGIN, trie_routing=trie_routing)
+    return router, time.perf_counter() - start
+
+
+def resolve(router: APIRouter, path: str):
+    """Resolve ``path`` the way Starlette's router does."""
+    scope = {"type": "http", "method": "GET", "path": path, "root_path": ""}
+    for route in router.routes:
+        match, child_scope = route.matches(scope)
+        if match == Match.FULL:
+            return child_scope
+    raise LookupError(path)
+
+
+def measure(operations: int, lookups: int = 2_000) -> dict:
+    """Measure startup and lookup cost for a schema of ``operations``."""
+    schema = synthetic_schema(operations)
+    paths = sample_paths(operations, lookups)
+    results = {"operations": operations}
+    for name, trie_routing in (("router", False), ("trie", True)):
+        router, startup = build_router(schema, trie_routing)
+        start = time.perf_counter()
+        for path in paths:
+            resolve(router, path)
+        lookup = (time.perf_counter() - start) / lookups
+        results[f"{name}_startup_ms"] = round(startup * 1000, 2)
+        results[f"{name}_lookup_us"] = round(lookup * 1_000_000, 2)
+    return results
+
+
+if __name__ == "__main__":
+    logging.disable(logging.INFO)
+    for operations in (10, 100, 1_000, 5_000):
+        print(json.dumps(measure(operations)))
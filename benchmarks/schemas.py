@@ -0,0 +1,27 @@
+"""Synthetic OpenAPI schemas of arbitrary size for benchmarks."""
+
+
+def synthetic_schema(operations: int) -> dict:
+    """Return a schema with roughly ``operations`` GET operations.
+
+    Half of the paths are collections and half are templated item paths, so
+    routing has to deal with both literal and parameterised segments.
+    """
+    paths = {}
+    for index in range(max(operations // 2, 1)):
+        paths[f"/api/v1/resource{index}"] = {"get": {"summary": "List"}}
+        paths[f"/api/v1/resource{index}/{{itemId}}"] = {"get": {"summary": "Get"}}
+    return {
+        "openapi": "3.0.0",
+        "info": {"title": "Synthetic API", "version": "1.0.0"},
+        "paths": paths,
+    }
+
+
+def sample_paths(operations: int, count: int) -> list:
+    """Return ``count`` concrete request paths spread over the schema."""
+    resources = max(operations // 2, 1)
+    return [
+        f"/api/v1/resource{(index * 7919) % resources}/{index}"
+        for index in range(count)
+    ]
@@ -12,7 +12,11 @@ develop a new k8s charm using the Operator Framework:
 https://juju.is/docs/sdk/create-a-minimal-kubernetes-charm
 """
 
+import json
 import logging
+import secrets
+import shlex
+import urllib.request
 from typing import cast
 
 import ops
@@ -22,18 +26,36 @@ from charms.nginx_ingress_integrator.v0.nginx_route import require_nginx_route
 logger = logging.getLogger(__name__)
 
 VALID_LOG_LEVELS = ["info", "debug", "warning", "error", "critical"]
+VALID_TRACING_EXPORTERS = ["", "otlp", "console"]
 HOST = "0.0.0.0"
 PORT = "8000"
+TOKEN_CACHE_PATH = "/tmp/openapi-rest-proxy-token.json"
+RATE_LIMIT_SHARED_PATH = "/tmp/openapi-rest-proxy-rate-limits"
+# Where the "cache" storage is mounted in the proxy container.
+DISK_CACHE_PATH = "/var/lib/openapi-rest-proxy/cache"
+# Reached through the pod's network namespace, which the charm shares.
+RELOAD_SCHEMA_URL = f"http://localhost:{PORT}/admin/reload-schema"
 
 
 class CharmCharm(ops.CharmBase):
     """Charm the service."""
 
+    _stored = ops.StoredState()
+
     def __init__(self, framework: ops.Framework):
         super().__init__(framework)
+        # Lets the reload-schema action call the proxy when admin-token is unset.
+        self._stored.set_default(admin_token=secrets.token_urlsafe(32))
         self._require_nginx_route()
         framework.observe(self.on["proxy"].pebble_ready, self._on_proxy_pebble_ready)
         framework.observe(self.on.config_changed, self._on_config_changed)
+        framework.observe(self.on.reload_schema_action, self._on_reload_schema_action)
+        framework.observe(
+            self.on["metrics-endpoint"].relation_joined, self._on_metrics_endpoint_relation
+        )
+        framework.observe(
+            self.on["metrics-endpoint"].relation_changed, self._on_metrics_endpoint_relation
+        )
 
     def _on_proxy_pebble_ready(self, event: ops.PebbleReadyEvent):
         """Define and start a workload using the Pebble API.
@@ -66,8 +88,16 @@ class CharmCharm(ops.CharmBase):
         """
         # Fetch the new config value
         log_level = cast(str, self.model.config["log-level"]).lower()
+        sample_rate = cast(float, self.model.config["access-log-sample-rate"])
+        tracing_exporter = cast(str, self.model.config.get("tracing-exporter", ""))
 
-        if log_level in VALID_LOG_LEVELS:
+        if not 0.0 <= sample_rate <= 1.0:
+            self.unit.status = ops.BlockedStatus(
+                f"invalid access log sample rate: '{sample_rate}'"
+            )
+        elif tracing_exporter not in VALID_TRACING_EXPORTERS:
+            self.unit.status = ops.BlockedStatus(f"invalid tracing exporter: '{tracing_exporter}'")
+        elif log_level in VALID_LOG_LEVELS:
             container = self.unit.get_container("proxy")
             try:
                 container.add_layer("proxy", self._pebble_layer, combine=True)
@@ -82,6 +112,79 @@ class CharmCharm(ops.CharmBase):
         else:
             self.unit.status = ops.BlockedStatus(f"invalid log level: '{log_level}'")
 
+    def _on_metrics_endpoint_relation(self, event: ops.RelationEvent):
+        """Publish the scrape job for the proxy's metrics over prometheus_scrape."""
+        if self.unit.is_leader():
+            event.relation.data[self.app].update(
+                {
+                    "scrape_jobs": json.dumps(
+                        [
+                            {
+                                "metrics_path": "/metrics",
+                                "static_configs": [{"targets": [f"*:{PORT}"]}],
+                            }
+                        ]
+                    ),
+                    "scrape_metadata": json.dumps(
+                        {
+                            "model": self.model.name,
+                            "model_uuid": self.model.uuid,
+                            "application": self.app.name,
+                            "unit": self.unit.name,
+                            "charm_name": self.meta.name,
+                        }
+                    ),
+                }
+            )
+        binding = self.model.get_binding(event.relation)
+        address = binding.network.ingress_address if binding else None
+        event.relation.data[self.unit].update(
+            {
+                "prometheus_scrape_unit_address": str(address or ""),
+                "prometheus_scrape_unit_name": self.unit.name,
+            }
+        )
+
+    def _on_reload_schema_action(self, event: ops.ActionEvent):
+        """Ask the proxy to reload the OpenAPI schema in place.
+
+        The proxy's admin endpoint is called rather than signalling the
+        service: with several workers, uvicorn restarts them all on SIGHUP.
+        """
+        request = urllib.request.Request(
+            RELOAD_SCHEMA_URL,
+            method="POST",
+            headers={"Authorization": f"Bearer {self._admin_token}"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                result = json.load(response)
+        except (OSError, ValueError) as exc:
+            event.fail(f"could not reload the schema: {exc}")
+            return
+        event.set_results(
+            {
+                "changed": str(result["changed"]).lower(),
+                "reloads": result["reloads"],
+                "workers-signalled": result["workers_signalled"],
+            }
+        )
+
+    @property
+    def _admin_token(self) -> str:
+        """Return the configured admin token, or else the charm's own."""
+        return self.model.config.get("admin-token") or self._stored.admin_token
+
+    @property
+    def _command(self) -> str:
+        """Return the command running the proxy with uvicorn."""
+        command = f"uv run uvicorn proxy.app:app --host {HOST} --port {PORT} --no-access-log"
+        forwarded_allow_ips = self.model.config.get("forwarded-allow-ips", "")
+        if forwarded_allow_ips:
+            # Otherwise uvicorn only trusts X-Forwarded-For from 127.0.0.1.
+            command += f" --forwarded-allow-ips {shlex.quote(forwarded_allow_ips)}"
+        return f"{command} --workers {self.model.config['workers']}"
+
     @property
     def _pebble_layer(self) -> ops.pebble.LayerDict:
         """Return a dictionary representing a Pebble layer."""
@@ -92,18 +195,105 @@ class CharmCharm(ops.CharmBase):
                 "proxy": {
                     "override": "replace",
                     "summary": "proxy",
-                    "command": f"uv run uvicorn proxy.app:app --host {HOST} --port {PORT}",
+                    "command": self._command,
                     "startup": "enabled",
                     "environment": {
                         "LOG_LEVEL": self.model.config["log-level"],
+                        "ACCESS_LOG": str(self.model.config["access-log"]).lower(),
+                        "ACCESS_LOG_SAMPLE_RATE": str(self.model.config["access-log-sample-rate"]),
+                        "SERVER_TIMING": str(self.model.config["server-timing"]).lower(),
+                        "TRACING_EXPORTER": self.model.config.get("tracing-exporter", ""),
+                        "TRACING_ENDPOINT": self.model.config.get("tracing-endpoint", ""),
                         "OPENAPI_SCHEMA_URL": self.model.config["openapi-schema-url"],
+                        "SCHEMA_SNAPSHOT_PATH": self.model.config.get("schema-snapshot-path", ""),
+                        "SCHEMA_RELOAD_INTERVAL": str(self.model.config["schema-reload-interval"]),
+                        "ADMIN_TOKEN": self._admin_token,
                         "ORIGIN_BASE_URL": self.model.config["origin-base-url"],
+                        "ORIGIN_WEIGHTS": self.model.config.get("origin-weights", ""),
+                        "ORIGIN_HEALTH_CHECK_PATH": self.model.config.get(
+                            "origin-health-check-path", ""
+                        ),
+                        "ORIGIN_HEALTH_CHECK_INTERVAL": str(
+                            self.model.config["origin-health-check-interval"]
+                        ),
+                        "ORIGIN_FAILURE_THRESHOLD": str(
+                            self.model.config["origin-failure-threshold"]
+                        ),
+                        "ORIGIN_EJECTION_TIME": str(self.model.config["origin-ejection-time"]),
                         "FIXED_REQUEST_HEADERS": self.model.config["fixed-request-headers"],
                         "AUTH_ENDPOINT_URL": self.model.config["auth-endpoint-url"],
                         "CLIENT_ID": self.model.config["client-id"],
                         "CLIENT_SECRET": self.model.config["client-secret"],
                         "AUTH_SCOPE": self.model.config["auth-scope"],
+                        "AUTH_REFRESH_SKEW": str(self.model.config["auth-refresh-skew"]),
+                        "AUTH_TOKEN_CACHE_PATH": (
+                            TOKEN_CACHE_PATH if self.model.config["workers"] > 1 else ""
+                        ),
+                        "WORKERS": str(self.model.config["workers"]),
                         "ENDPOINT_ALLOW_LIST": self.model.config.get("endpoint-allow-list", ""),
+                        "STREAM_BODIES": str(self.model.config["stream-bodies"]).lower(),
+                        "TRIE_ROUTING": str(self.model.config["trie-routing"]).lower(),
+                        "CACHE_MAX_BYTES": str(self.model.config["cache-max-bytes"]),
+                        "CACHE_STORE_URL": self.model.config.get("cache-store-url", ""),
+                        "CACHE_DISK_PATH": (
+                            DISK_CACHE_PATH if self.model.config["cache-disk-max-bytes"] else ""
+                        ),
+                        "CACHE_DISK_MAX_BYTES": str(self.model.config["cache-disk-max-bytes"]),
+                        "CACHE_NEAR_TTL": str(self.model.config["cache-near-ttl"]),
+                        "CACHE_TTLS": self.model.config.get("cache-ttls", ""),
+                        "STALE_WHILE_REVALIDATE": str(self.model.config["stale-while-revalidate"]),
+                        "STALE_IF_ERROR": str(self.model.config["stale-if-error"]),
+                        "COALESCE_REQUESTS": str(self.model.config["coalesce-requests"]).lower(),
+                        "COMPRESS_RESPONSES": str(self.model.config["compress-responses"]).lower(),
+                        "COMPRESSION_MIN_SIZE": str(self.model.config["compression-min-size"]),
+                        "RETRY_ATTEMPTS": str(self.model.config["retry-attempts"]),
+                        "RETRY_BUDGET_RATIO": str(self.model.config["retry-budget-ratio"]),
+                        "RETRY_BUDGET_MIN_PER_SECOND": str(
+                            self.model.config["retry-budget-min-per-second"]
+                        ),
+                        "HEDGE_PERCENTILE": str(self.model.config["hedge-percentile"]),
+                        "CIRCUIT_BREAKER_THRESHOLD": str(
+                            self.model.config["circuit-breaker-threshold"]
+                        ),
+                        "CIRCUIT_BREAKER_RECOVERY_TIME": str(
+                            self.model.config["circuit-breaker-recovery-time"]
+                        ),
+                        "CONCURRENCY_LIMIT": str(self.model.config["concurrency-limit"]),
+                        "CONCURRENCY_QUEUE_SIZE": str(self.model.config["concurrency-queue-size"]),
+                        "CONCURRENCY_QUEUE_TIMEOUT": str(
+                            self.model.config["concurrency-queue-timeout"]
+                        ),
+                        "ADAPTIVE_CONCURRENCY": str(
+                            self.model.config["adaptive-concurrency"]
+                        ).lower(),
+                        "RATE_LIMIT": str(self.model.config["rate-limit"]),
+                        "RATE_LIMIT_BURST": str(self.model.config["rate-limit-burst"]),
+                        "RATE_LIMIT_KEY_HEADER": self.model.config.get(
+                            "rate-limit-key-header", ""
+                        ),
+                        "RATE_LIMIT_SHARED_PATH": (
+                            RATE_LIMIT_SHARED_PATH if self.model.config["workers"] > 1 else ""
+                        ),
+                        "UPSTREAM_REQUEST_TIMEOUT": str(
+                            self.model.config["upstream-request-timeout"]
+                        ),
+                        "METRICS_ENABLED": str(self.model.config["metrics-enabled"]).lower(),
+                        "UPSTREAM_MAX_CONNECTIONS": str(
+                            self.model.config["upstream-max-connections"]
+                        ),
+                        "UPSTREAM_MAX_KEEPALIVE_CONNECTIONS": str(
+                            self.model.config["upstream-max-keepalive-connections"]
+                        ),
+                        "UPSTREAM_KEEPALIVE_EXPIRY": str(
+                            self.model.config["upstream-keepalive-expiry"]
+                        ),
+                        "UPSTREAM_HTTP2": str(self.model.config["upstream-http2"]).lower(),
+                        "UPSTREAM_CONNECT_TIMEOUT": str(
+                            self.model.config["upstream-connect-timeout"]
+                        ),
+                        "UPSTREAM_READ_TIMEOUT": str(self.model.config["upstream-read-timeout"]),
+                        "UPSTREAM_WRITE_TIMEOUT": str(self.model.config["upstream-write-timeout"]),
+                        "UPSTREAM_POOL_TIMEOUT": str(self.model.config["upstream-pool-timeout"]),
                     },
                 }
             },
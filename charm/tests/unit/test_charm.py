@@ -3,8 +3,14 @@
 #
 # Learn more about testing at: https://juju.is/docs/sdk/testing
 
+import io
+import json
+import urllib.error
+import urllib.request
+
 import ops
 import ops.pebble
+import pytest
 from ops import testing
 
 from charm import CharmCharm
@@ -64,20 +70,75 @@ def test_config_changed_valid_can_connect():
     assert env["CLIENT_SECRET"] == "example-client-secret"
     assert env["AUTH_SCOPE"] == "example-scope"
     assert env["ENDPOINT_ALLOW_LIST"] == "GET:/api/v2/example/"
+    assert env["UPSTREAM_MAX_CONNECTIONS"] == "100"
+    assert env["UPSTREAM_HTTP2"] == "false"
     assert state_out.unit_status == testing.ActiveStatus()
 
     # Check environment keys against charmcraft.yaml
     env_keys = env.keys()
     expected_keys = {
         "LOG_LEVEL",
+        "ACCESS_LOG",
+        "ACCESS_LOG_SAMPLE_RATE",
+        "SERVER_TIMING",
+        "TRACING_EXPORTER",
+        "TRACING_ENDPOINT",
         "OPENAPI_SCHEMA_URL",
+        "SCHEMA_SNAPSHOT_PATH",
+        "SCHEMA_RELOAD_INTERVAL",
+        "ADMIN_TOKEN",
         "ORIGIN_BASE_URL",
+        "ORIGIN_WEIGHTS",
+        "ORIGIN_HEALTH_CHECK_PATH",
+        "ORIGIN_HEALTH_CHECK_INTERVAL",
+        "ORIGIN_FAILURE_THRESHOLD",
+        "ORIGIN_EJECTION_TIME",
         "FIXED_REQUEST_HEADERS",
         "AUTH_ENDPOINT_URL",
         "CLIENT_ID",
         "CLIENT_SECRET",
         "AUTH_SCOPE",
+        "AUTH_REFRESH_SKEW",
+        "AUTH_TOKEN_CACHE_PATH",
+        "WORKERS",
         "ENDPOINT_ALLOW_LIST",
+        "STREAM_BODIES",
+        "TRIE_ROUTING",
+        "CACHE_MAX_BYTES",
+        "CACHE_STORE_URL",
+        "CACHE_DISK_PATH",
+        "CACHE_DISK_MAX_BYTES",
+        "CACHE_NEAR_TTL",
+        "CACHE_TTLS",
+        "STALE_WHILE_REVALIDATE",
+        "STALE_IF_ERROR",
+        "COALESCE_REQUESTS",
+        "COMPRESS_RESPONSES",
+        "COMPRESSION_MIN_SIZE",
+        "RETRY_ATTEMPTS",
+        "RETRY_BUDGET_RATIO",
+        "RETRY_BUDGET_MIN_PER_SECOND",
+        "HEDGE_PERCENTILE",
+        "CIRCUIT_BREAKER_THRESHOLD",
+        "CIRCUIT_BREAKER_RECOVERY_TIME",
+        "CONCURRENCY_LIMIT",
+        "CONCURRENCY_QUEUE_SIZE",
+        "CONCURRENCY_QUEUE_TIMEOUT",
+        "ADAPTIVE_CONCURRENCY",
+        "RATE_LIMIT",
+        "RATE_LIMIT_BURST",
+        "RATE_LIMIT_KEY_HEADER",
+        "RATE_LIMIT_SHARED_PATH",
+        "UPSTREAM_REQUEST_TIMEOUT",
+        "METRICS_ENABLED",
+        "UPSTREAM_MAX_CONNECTIONS",
+        "UPSTREAM_MAX_KEEPALIVE_CONNECTIONS",
+        "UPSTREAM_KEEPALIVE_EXPIRY",
+        "UPSTREAM_HTTP2",
+        "UPSTREAM_CONNECT_TIMEOUT",
+        "UPSTREAM_READ_TIMEOUT",
+        "UPSTREAM_WRITE_TIMEOUT",
+        "UPSTREAM_POOL_TIMEOUT",
     }
     assert env_keys == expected_keys
 
@@ -116,3 +177,180 @@ def test_config_changed_invalid():
     # Assert:
     assert isinstance(state_out.unit_status, testing.BlockedStatus)
     assert invalid_level in state_out.unit_status.message
+
+
+def test_config_changed_invalid_sample_rate():
+    """Test a config-changed event with an access log sample rate above 1."""
+    # Arrange:
+    ctx = testing.Context(CharmCharm)
+    container = testing.Container("proxy", can_connect=True)
+    config = get_test_config()
+    config["access-log-sample-rate"] = 1.5
+    state_in = testing.State(containers={container}, config=config)
+
+    # Act:
+    state_out = ctx.run(ctx.on.config_changed(), state_in)
+
+    # Assert:
+    assert isinstance(state_out.unit_status, testing.BlockedStatus)
+    assert "sample rate" in state_out.unit_status.message
+
+
+def test_config_changed_invalid_tracing_exporter():
+    """Test a config-changed event with an unknown tracing exporter."""
+    # Arrange:
+    ctx = testing.Context(CharmCharm)
+    container = testing.Container("proxy", can_connect=True)
+    config = get_test_config()
+    config["tracing-exporter"] = "jaeger"
+    state_in = testing.State(containers={container}, config=config)
+
+    # Act:
+    state_out = ctx.run(ctx.on.config_changed(), state_in)
+
+    # Assert:
+    assert isinstance(state_out.unit_status, testing.BlockedStatus)
+    assert "tracing exporter" in state_out.unit_status.message
+
+
+def test_config_changed_metrics_with_several_workers():
+    """Test a config-changed event enabling metrics with several workers."""
+    # Arrange:
+    ctx = testing.Context(CharmCharm)
+    container = testing.Container("proxy", can_connect=True)
+    config = get_test_config()
+    config["workers"] = 2
+    config["metrics-enabled"] = True
+    state_in = testing.State(containers={container}, config=config)
+
+    # Act:
+    state_out = ctx.run(ctx.on.config_changed(), state_in)
+
+    # Assert:
+    env = state_out.get_container(container.name).plan.services["proxy"].environment
+    assert env["METRICS_ENABLED"] == "true"
+    assert env["WORKERS"] == "2"
+    assert state_out.unit_status == testing.ActiveStatus()
+
+
+def test_reload_schema_action_cannot_connect(monkeypatch):
+    """Test the reload-schema action when the proxy cannot be reached."""
+    # Arrange:
+    ctx = testing.Context(CharmCharm)
+    container = testing.Container("proxy", can_connect=False)
+    state_in = testing.State(containers={container}, config=get_test_config())
+
+    def urlopen(request, timeout):
+        raise urllib.error.URLError("connection refused")
+
+    monkeypatch.setattr(urllib.request, "urlopen", urlopen)
+
+    # Act:
+    with pytest.raises(testing.ActionFailed) as exc_info:
+        ctx.run(ctx.on.action("reload-schema"), state_in)
+
+    # Assert:
+    assert "could not reload the schema" in exc_info.value.message
+
+
+def test_reload_schema_action_calls_the_admin_endpoint(monkeypatch):
+    """Test that the reload-schema action reloads through the admin endpoint."""
+    # Arrange:
+    ctx = testing.Context(CharmCharm)
+    container = testing.Container("proxy", can_connect=True)
+    config = {**get_test_config(), "workers": 2}
+    state_in = testing.State(containers={container}, config=config)
+    requests = []
+
+    def urlopen(request, timeout):
+        requests.append(request)
+        body = {"changed": True, "reloads": 1, "workers_signalled": 1}
+        return io.BytesIO(json.dumps(body).encode())
+
+    monkeypatch.setattr(urllib.request, "urlopen", urlopen)
+
+    # Act:
+    state_out = ctx.run(ctx.on.config_changed(), state_in)
+    ctx.run(ctx.on.action("reload-schema"), state_out)
+
+    # Assert:
+    [request] = requests
+    env = state_out.get_container(container.name).plan.services["proxy"].environment
+    assert request.full_url == "http://localhost:8000/admin/reload-schema"
+    assert request.get_header("Authorization") == f"Bearer {env['ADMIN_TOKEN']}"
+    assert ctx.action_results == {"changed": "true", "reloads": 1, "workers-signalled": 1}
+
+
+def test_metrics_endpoint_relation_publishes_scrape_job():
+    """Test that the metrics-endpoint relation advertises the metrics path."""
+    # Arrange:
+    ctx = testing.Context(CharmCharm)
+    relation = testing.Relation("metrics-endpoint")
+    state_in = testing.State(leader=True, relations={relation}, config=get_test_config())
+
+    # Act:
+    state_out = ctx.run(ctx.on.relation_joined(relation), state_in)
+
+    # Assert:
+    relation_out = state_out.get_relation(relation.id)
+    scrape_jobs = json.loads(relation_out.local_app_data["scrape_jobs"])
+    assert scrape_jobs[0]["metrics_path"] == "/metrics"
+    assert scrape_jobs[0]["static_configs"] == [{"targets": ["*:8000"]}]
+    assert relation_out.local_unit_data["prometheus_scrape_unit_name"] == "openapi-rest-proxy/0"
+
+
+def test_workers_share_token_and_rate_limits():
+    """Test that several workers share the OAuth2 token and rate limits."""
+    # Arrange:
+    ctx = testing.Context(CharmCharm)
+    container = testing.Container("proxy", can_connect=True)
+    config = {
+        **get_test_config(),
+        "workers": 4,
+    }
+    state_in = testing.State(containers={container}, config=config)
+
+    # Act:
+    state_out = ctx.run(ctx.on.config_changed(), state_in)
+
+    # Assert:
+    plan = state_out.get_container(container.name).plan
+    service = plan.services["proxy"]
+    assert service.command.endswith("--no-access-log --workers 4")
+    assert service.environment["AUTH_TOKEN_CACHE_PATH"]
+    assert service.environment["RATE_LIMIT_SHARED_PATH"]
+    assert state_out.unit_status == testing.ActiveStatus()
+
+
+def test_disk_cache_is_kept_on_the_cache_storage():
+    """Test that the disk cache lives on the storage mounted in the container."""
+    # Arrange:
+    ctx = testing.Context(CharmCharm)
+    container = testing.Container("proxy", can_connect=True)
+    config = {**get_test_config(), "cache-disk-max-bytes": 2**30}
+    state_in = testing.State(containers={container}, config=config)
+
+    # Act:
+    state_out = ctx.run(ctx.on.config_changed(), state_in)
+
+    # Assert:
+    [mount] = ctx.charm_spec.meta["containers"]["proxy"]["mounts"]
+    assert mount["storage"] in ctx.charm_spec.meta["storage"]
+    env = state_out.get_container(container.name).plan.services["proxy"].environment
+    assert env["CACHE_DISK_PATH"] == mount["location"]
+
+
+def test_forwarded_addresses_are_only_trusted_from_configured_proxies():
+    """Test that X-Forwarded-For is only trusted from the configured networks."""
+    # Arrange:
+    ctx = testing.Context(CharmCharm)
+    container = testing.Container("proxy", can_connect=True)
+    config = {**get_test_config(), "forwarded-allow-ips": "10.1.0.0/16"}
+    state_in = testing.State(containers={container}, config=config)
+
+    # Act:
+    state_out = ctx.run(ctx.on.config_changed(), state_in)
+
+    # Assert:
+    service = state_out.get_container(container.name).plan.services["proxy"]
+    assert "--forwarded-allow-ips 10.1.0.0/16 " in service.command
@@ -0,0 +1,110 @@
+import json
+import logging
+import queue
+import random
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+from fastapi import Request, Response
+
+from .metrics import RequestTimings
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Queue records as they are, leaving all formatting to the listener.
+
+    The standard QueueHandler formats each record before queueing it, which
+    is the work the queue is meant to take off the event loop.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Return ``record`` unchanged."""
+        return record
+
+
+class JSONFormatter(logging.Formatter):
+    """Format records whose message is a dict as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        """Return the record as JSON."""
+        fields = record.msg if isinstance(record.msg, dict) else {}
+        return json.dumps(
+            {"time": round(record.created, 3), **fields}, separators=(",", ":")
+        )
+
+
+class AccessLog:
+    """Log one structured record per proxied request from a background thread.
+
+    Building a record on the event loop is a dict of values already at hand;
+    serialising it to JSON and writing it to ``stream`` happen in the
+    listener thread, so a slow log sink never blocks request handling.
+    Responses with a 2xx status are logged at the ``sample_rate``, which is
+    included in their records; all other responses are always logged.
+    """
+
+    def __init__(
+        self, sample_rate: float = 1.0, stream=None, name: str = "proxy.access"
+    ):
+        self.sample_rate = sample_rate
+        self.logger = logging.getLogger(name)
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        handler = logging.StreamHandler(stream or sys.stderr)
+        handler.setFormatter(JSONFormatter())
+        self.listener = QueueListener(self.queue, handler)
+        self._handler = DeferredQueueHandler(self.queue)
+
+    def start(self):
+        """Start writing records in the background."""
+        if self._handler not in self.logger.handlers:
+            self.logger.addHandler(self._handler)
+            self.listener.start()
+
+    def stop(self):
+        """Write out the queued records and stop the background thread."""
+        if self._handler in self.logger.handlers:
+            self.logger.removeHandler(self._handler)
+            self.listener.stop()
+
+    def record(
+        self,
+        request: Request,
+        operation: str,
+        status_code: int,
+        response: Response | None,
+        started_at: float,
+        timings: RequestTimings | None = None,
+    ):
+        """Log the request for ``operation``, unless it is sampled out."""
+        duration = time.perf_counter() - started_at
+        sampled = 200 <= status_code < 300 and self.sample_rate < 1.0
+        if sampled and random.random() >= self.sample_rate:
+            return
+        fields = {
+            "operation": operation,
+            "path": request.scope["path"],
+            "status": status_code,
+            "bytes": response_size(response),
+            "duration_ms": round(duration * 1000, 3),
+        }
+        if timings is not None:
+            fields["upstream_ms"] = round(timings.upstream * 1000, 3)
+        if request.client:
+            fields["client"] = request.client.host
+        if sampled:
+            fields["sample_rate"] = self.sample_rate
+        self.logger.info(fields)
+
+
+def response_size(response: Response | None) -> int | None:
+    """Return the size of the response body, if it is known up front."""
+    if response is None:
+        return None
+    body = getattr(response, "body", None)
+    if body is not None:
+        return len(body)
+    content_length = response.headers.get("content-length")
+    return int(content_length) if content_length else None
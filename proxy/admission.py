@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import math
+from collections import deque
+from dataclasses import dataclass, replace
+
+# Adaptive limits shrink by this factor when latency rises...
+DECREASE_FACTOR = 0.9
+# ...which it is considered to do above this multiple of the baseline latency.
+LATENCY_TOLERANCE = 2.0
+# How quickly the baseline latency follows latencies above it.
+BASELINE_DRIFT = 0.01
+
+
+@dataclass(frozen=True)
+class AdmissionPolicy:
+    """How many requests for one operation the proxy handles at once.
+
+    Up to ``limit`` requests are sent to the origin concurrently, and up to
+    ``queue_size`` more wait at most ``queue_timeout`` seconds for a turn.
+    Anything beyond that is shed at once. With ``adaptive``, the limit moves
+    between ``min_limit`` and ``limit`` as the origin's latency changes.
+    """
+
+    limit: int = 0
+    queue_size: int = 0
+    queue_timeout: float = 1.0
+    adaptive: bool = False
+    min_limit: int = 1
+
+    def for_operation(self, operation: dict) -> "AdmissionPolicy":
+        """Apply the operation's ``x-proxy-*`` schema extensions."""
+        return replace(
+            self,
+            limit=int(operation.get("x-proxy-concurrency-limit", self.limit)),
+            queue_size=int(operation.get("x-proxy-queue-size", self.queue_size)),
+        )
+
+
+class AdmissionLimiter:
+    """Admit, queue or shed the requests of one operation.
+
+    The bulkhead keeps a slow operation from taking every connection and
+    event loop turn away from the others. When adaptive, the limit grows by
+    one per limit's worth of requests answered near the baseline latency
+    (the lowest seen, slowly drifting up) and shrinks by a tenth when
+    latency climbs well above it (AIMD).
+    """
+
+    def __init__(self, policy: AdmissionPolicy):
+        self.max_limit = policy.limit
+        self.min_limit = min(policy.min_limit, policy.limit)
+        self.limit = float(policy.limit)
+        self.queue_size = policy.queue_size
+        self.queue_timeout = policy.queue_timeout
+        self.adaptive = policy.adaptive
+        self.in_flight = 0
+        self.shed = 0
+        self.baseline: float | None = None
+        self._waiters: deque = deque()
+
+    @property
+    def retry_after(self) -> int:
+        """Return the seconds a shed client is asked to wait."""
+        return max(math.ceil(self.queue_timeout), 1)
+
+    async def acquire(self) -> bool:
+        """Wait for a turn, returning False if the request is shed."""
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return True
+        if len(self._waiters) >= self.queue_size:
+            self.shed += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._forget(waiter)
+            self.shed += 1
+            return False
+        except BaseException:
+            self._forget(waiter)
+            raise
+        return True
+
+    def release(self, latency: float | None = None):
+        """End a request's turn and pass it on, adapting to its ``latency``."""
+        if self.adaptive and latency:
+            self._adapt(latency)
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def _forget(self, waiter: asyncio.Future):
+        if waiter.done() and not waiter.cancelled():
+            # The turn was handed over just as the wait ended: pass it on.
+            self.release()
+        elif waiter in self._waiters:
+            self._waiters.remove(waiter)
+
+    def _adapt(self, latency: float):
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+        else:
+            self.baseline += (latency - self.baseline) * BASELINE_DRIFT
+        if latency > self.baseline * LATENCY_TOLERANCE:
+            limit = max(self.limit * DECREASE_FACTOR, self.min_limit)
+            if int(limit) < int(self.limit):
+                logging.debug("Lowering concurrency limit to %s", int(limit))
+        else:
+            limit = min(self.limit + 1 / self.limit, self.max_limit)
+        self.limit = limit
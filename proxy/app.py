@@ -1,15 +1,132 @@
-import base64
+import asyncio
 import logging
 import os
-import time
+import secrets
+import signal
+import tempfile
+from contextlib import asynccontextmanager
 
 import httpx
-import yaml
-from fastapi import FastAPI, Request
+from fastapi import APIRouter, FastAPI, HTTPException, Request, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from .accesslog import AccessLog
+from .admission import AdmissionPolicy
+from .auth import TokenManager
+from .cache import MemoryStore, ResponseCache, StalePolicy
+from .coalesce import RequestCoalescer
+from .compression import Compressor
+from .disk import DiskStore
+from .metrics import ProxyMetrics, SharedMetrics
+from .middleware import HeaderInjectionMiddleware
+from .proxy import create_proxy_routes
+from .ratelimit import BucketStore, RateLimitPolicy, SharedBucketStore
+from .resilience import ResiliencePolicy, RetryBudget
+from .resp import RespPool
+from .schema import SchemaReloader, load_openapi_schema
+from .store import NEAR_MAX_BYTES, RedisStore, TieredStore
+from .tracing import Tracing, create_exporter
+from .upstream import OriginPool, create_upstream_client
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Share one pooled upstream client and keep the OAuth2 token fresh."""
+    async with create_upstream_client(
+        max_connections=upstream_max_connections,
+        max_keepalive_connections=upstream_max_keepalive_connections,
+        keepalive_expiry=upstream_keepalive_expiry,
+        http2=upstream_http2,
+        connect_timeout=upstream_connect_timeout,
+        read_timeout=upstream_read_timeout,
+        write_timeout=upstream_write_timeout,
+        pool_timeout=upstream_pool_timeout,
+        origin_pool=origin_pool,
+    ) as client:
+        app.state.upstream_client = client
+        if proxy_metrics:
+            proxy_metrics.upstream_client = client
+        if origin_pool:
+            origin_pool.start(client)
+        if token_manager:
+            token_manager.start(client)
+        start_telemetry()
+        schema_reloader.start()
+        watch_reload_signal()
+        yield
+        await schema_reloader.stop()
+        if origin_pool:
+            await origin_pool.stop()
+        if token_manager:
+            await token_manager.stop()
+        await stop_telemetry()
+        await close_cache_stores()
+
+
+def start_telemetry():
+    """Start writing the access log and sharing metrics with other workers."""
+    if access_log:
+        access_log.start()
+    if shared_metrics:
+        shared_metrics.start()
+
+
+async def stop_telemetry():
+    """Flush the access log and spans, and stop sharing metrics."""
+    if access_log:
+        access_log.stop()
+    if shared_metrics:
+        await shared_metrics.stop()
+    if tracing:
+        tracing.shutdown()
+
+
+async def close_cache_stores():
+    """Close the connections to the shared cache store and disk cache index."""
+    if cache_store_pool:
+        await cache_store_pool.close()
+    if disk_store:
+        disk_store.close()
+
+
+def signal_other_workers(signum: int) -> int:
+    """Send ``signum`` to this server's other worker processes, returning how many.
+
+    Worker processes are the children of the process uvicorn supervises them
+    from, found through ``/proc``; with a single worker there are none.
+    """
+    if workers <= 1:
+        return 0
+    parent, own = os.getppid(), os.getpid()
+    signalled = 0
+    for entry in os.scandir("/proc"):
+        if not entry.name.isdigit() or int(entry.name) == own:
+            continue
+        try:
+            with open(f"/proc/{entry.name}/stat") as stat:
+                # The parent id follows the state, after the parenthesised name.
+                fields = stat.read().rpartition(")")[2].split()
+            if int(fields[1]) == parent:
+                os.kill(int(entry.name), signum)
+                signalled += 1
+        except (OSError, ValueError, IndexError):
+            # The process exited meanwhile, or is not ours to inspect.
+            continue
+    return signalled
+
+
+def watch_reload_signal():
+    """Reload the OpenAPI schema when the process receives SIGHUP."""
+    try:
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGHUP, schema_reloader.trigger
+        )
+    except (NotImplementedError, RuntimeError, ValueError):
+        # Not the main thread, as under the test client, or not a Unix loop.
+        logging.debug("Reloading the OpenAPI schema on SIGHUP is unavailable.")
 
-from .proxy import create_proxy_routes, filter_endpoints
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 logger = logging.getLogger()
 logger.name = "openapi-rest-proxy"
@@ -18,92 +135,267 @@ log_level = os.getenv("LOG_LEVEL", logging.getLevelName(logging.INFO)).upper()
 logging.basicConfig(level=log_level)
 
 
-def load_openapi_schema(url: str):
-    """Load OpenAPI schema from URL."""
-    logging.debug(f"Loading OpenAPI schema from {url}")
-    response = httpx.get(url)
-    response.raise_for_status()
-    schema = yaml.safe_load(response.text)
-    logging.debug(f"Loaded OpenAPI schema from {url}.")
-    return schema
-
-
 openapi_schema_url = os.getenv("OPENAPI_SCHEMA_URL")
+schema_snapshot_path = os.getenv("SCHEMA_SNAPSHOT_PATH")
+schema_reload_interval = float(os.getenv("SCHEMA_RELOAD_INTERVAL", 0.0))
+admin_token = os.getenv("ADMIN_TOKEN")
 origin_base_url = os.getenv("ORIGIN_BASE_URL")
 fixed_request_headers = os.getenv("FIXED_REQUEST_HEADERS", "")
 port = int(os.getenv("PORT", 8000))
 host = os.getenv("HOST", "0.0.0.0")
+workers = int(os.getenv("WORKERS", 1))
 auth_endpoint_url = os.getenv("AUTH_ENDPOINT_URL")
 client_id = os.getenv("CLIENT_ID")
 client_secret = os.getenv("CLIENT_SECRET")
 auth_scope = os.getenv("AUTH_SCOPE")
-
-token_info = {"access_token": None, "expires_at": 0, "refresh_token": None}
-
-
-def get_access_token():
-    """Get OAuth2 access token for authentication."""
-    if not auth_endpoint_url or not client_id or not client_secret:
-        return None
-
-    if token_info["access_token"] and token_info["expires_at"] > time.time():
-        return token_info["access_token"]
-
-    if token_info["refresh_token"]:
-        response = httpx.post(
-            auth_endpoint_url,
-            data={
-                "grant_type": "refresh_token",
-                "refresh_token": token_info["refresh_token"],
-                "client_id": client_id,
-                "client_secret": client_secret,
-            },
-            headers={
-                "Cache-Control": "no-cache",
-                "Content-Type": "application/x-www-form-urlencoded",
-            },
+auth_refresh_skew = float(os.getenv("AUTH_REFRESH_SKEW", 60.0))
+auth_token_cache_path = os.getenv("AUTH_TOKEN_CACHE_PATH")
+upstream_max_connections = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", 100))
+upstream_max_keepalive_connections = int(
+    os.getenv("UPSTREAM_MAX_KEEPALIVE_CONNECTIONS", 20)
+)
+upstream_keepalive_expiry = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", 5.0))
+upstream_http2 = os.getenv("UPSTREAM_HTTP2", "false").lower() == "true"
+upstream_connect_timeout = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", 5.0))
+upstream_read_timeout = float(os.getenv("UPSTREAM_READ_TIMEOUT", 5.0))
+upstream_write_timeout = float(os.getenv("UPSTREAM_WRITE_TIMEOUT", 5.0))
+upstream_pool_timeout = float(os.getenv("UPSTREAM_POOL_TIMEOUT", 5.0))
+origin_weights = [
+    float(weight) for weight in os.getenv("ORIGIN_WEIGHTS", "").split("|") if weight
+]
+origin_health_check_path = os.getenv("ORIGIN_HEALTH_CHECK_PATH")
+origin_health_check_interval = float(os.getenv("ORIGIN_HEALTH_CHECK_INTERVAL", 10.0))
+origin_failure_threshold = int(os.getenv("ORIGIN_FAILURE_THRESHOLD", 3))
+origin_ejection_time = float(os.getenv("ORIGIN_EJECTION_TIME", 30.0))
+stream_bodies = os.getenv("STREAM_BODIES", "false").lower() == "true"
+cache_max_bytes = int(os.getenv("CACHE_MAX_BYTES", 0))
+cache_store_url = os.getenv("CACHE_STORE_URL")
+cache_store_pool_size = int(os.getenv("CACHE_STORE_POOL_SIZE", 4))
+cache_store_timeout = float(os.getenv("CACHE_STORE_TIMEOUT", 0.25))
+cache_near_ttl = float(os.getenv("CACHE_NEAR_TTL", 1.0))
+cache_disk_path = os.getenv("CACHE_DISK_PATH")
+cache_disk_max_bytes = int(os.getenv("CACHE_DISK_MAX_BYTES", 1 << 30))
+stale_while_revalidate = float(os.getenv("STALE_WHILE_REVALIDATE", 0.0))
+stale_if_error = float(os.getenv("STALE_IF_ERROR", 0.0))
+trie_routing = os.getenv("TRIE_ROUTING", "false").lower() == "true"
+coalesce_requests = os.getenv("COALESCE_REQUESTS", "false").lower() == "true"
+retry_attempts = int(os.getenv("RETRY_ATTEMPTS", 0))
+retry_budget_ratio = float(os.getenv("RETRY_BUDGET_RATIO", 0.2))
+retry_budget_min_per_second = float(os.getenv("RETRY_BUDGET_MIN_PER_SECOND", 10.0))
+hedge_percentile = float(os.getenv("HEDGE_PERCENTILE", 0.0))
+circuit_breaker_threshold = int(os.getenv("CIRCUIT_BREAKER_THRESHOLD", 0))
+circuit_breaker_recovery_time = float(os.getenv("CIRCUIT_BREAKER_RECOVERY_TIME", 30.0))
+upstream_request_timeout = os.getenv("UPSTREAM_REQUEST_TIMEOUT")
+concurrency_limit = int(os.getenv("CONCURRENCY_LIMIT", 0))
+concurrency_queue_size = int(os.getenv("CONCURRENCY_QUEUE_SIZE", 0))
+concurrency_queue_timeout = float(os.getenv("CONCURRENCY_QUEUE_TIMEOUT", 1.0))
+adaptive_concurrency = os.getenv("ADAPTIVE_CONCURRENCY", "false").lower() == "true"
+compress_responses = os.getenv("COMPRESS_RESPONSES", "false").lower() == "true"
+compression_min_size = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+rate_limit = float(os.getenv("RATE_LIMIT", 0.0))
+rate_limit_burst = float(os.getenv("RATE_LIMIT_BURST", 0.0))
+rate_limit_key_header = os.getenv("RATE_LIMIT_KEY_HEADER")
+rate_limit_max_clients = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", 100_000))
+rate_limit_shared_path = os.getenv("RATE_LIMIT_SHARED_PATH")
+access_log_enabled = os.getenv("ACCESS_LOG", "true").lower() == "true"
+access_log_sample_rate = float(os.getenv("ACCESS_LOG_SAMPLE_RATE", 1.0))
+server_timing = os.getenv("SERVER_TIMING", "false").lower() == "true"
+tracing_exporter = os.getenv("TRACING_EXPORTER")
+tracing_endpoint = os.getenv("TRACING_ENDPOINT")
+tracing_service_name = os.getenv("OTEL_SERVICE_NAME", "openapi-rest-proxy")
+metrics_enabled = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# Example: CACHE_TTLS="GET:/pets=60|GET:/pets/{petId}=300"
+cache_ttls = {
+    operation: float(ttl)
+    for operation, _, ttl in (
+        entry.rpartition("=") for entry in os.getenv("CACHE_TTLS", "").split("|")
+    )
+    if operation
+}
+
+if auth_endpoint_url and client_id and client_secret:
+    token_manager = TokenManager(
+        auth_endpoint_url,
+        client_id,
+        client_secret,
+        scope=auth_scope,
+        refresh_skew=auth_refresh_skew,
+        token_file=auth_token_cache_path,
+    )
+else:
+    token_manager = None
+
+disk_store = None
+# Entries of a shared or disk store are kept near even without CACHE_MAX_BYTES,
+# so that hits do not all go to the store.
+near_cache_max_bytes = cache_max_bytes or NEAR_MAX_BYTES
+if cache_store_url:
+    # Shared by all workers and units, with recently used entries kept near.
+    cache_store_pool = RespPool(
+        cache_store_url, size=cache_store_pool_size, timeout=cache_store_timeout
+    )
+    response_cache = ResponseCache(
+        store=TieredStore(
+            MemoryStore(near_cache_max_bytes),
+            RedisStore(cache_store_pool),
+            near_ttl=cache_near_ttl,
         )
-    else:
-        auth = f"{client_id}:{client_secret}"
-        auth_base64 = base64.b64encode(auth.encode("utf-8")).decode("utf-8")
-        response = httpx.post(
-            auth_endpoint_url,
-            data={
-                "grant_type": "client_credentials",
-                "scope": auth_scope,
-            },
-            headers={
-                "Authorization": f"Basic {auth_base64}",
-                "Cache-Control": "no-cache",
-                "Content-Type": "application/x-www-form-urlencoded",
-            },
+    )
+elif cache_disk_path:
+    # Shared by the workers on this host and kept across restarts.
+    cache_store_pool = None
+    disk_store = DiskStore(cache_disk_path, cache_disk_max_bytes)
+    response_cache = ResponseCache(
+        store=TieredStore(
+            MemoryStore(near_cache_max_bytes), disk_store, near_ttl=cache_near_ttl
         )
-
-    response.raise_for_status()
-    token_data = response.json()
-    token_info["access_token"] = token_data["access_token"]
-    token_info["expires_at"] = time.time() + token_data["expires_in"]
-    token_info["refresh_token"] = token_data.get("refresh_token")
-    return token_info["access_token"]
-
+    )
+elif cache_max_bytes > 0:
+    cache_store_pool = None
+    response_cache = ResponseCache(cache_max_bytes)
+else:
+    cache_store_pool = None
+    response_cache = None
+request_coalescer = RequestCoalescer() if coalesce_requests else None
+access_log = AccessLog(access_log_sample_rate) if access_log_enabled else None
+compressor = Compressor(compression_min_size) if compress_responses else None
+if tracing_exporter:
+    tracing = Tracing(
+        create_exporter(tracing_exporter, tracing_endpoint or None),
+        service_name=tracing_service_name,
+    )
+else:
+    tracing = None
+resilience_policy = ResiliencePolicy(
+    retries=retry_attempts,
+    hedge_percentile=hedge_percentile,
+    breaker_threshold=circuit_breaker_threshold,
+    breaker_recovery_time=circuit_breaker_recovery_time,
+    timeout=float(upstream_request_timeout) if upstream_request_timeout else None,
+)
+retry_budget = RetryBudget(
+    ratio=retry_budget_ratio, min_per_second=retry_budget_min_per_second
+)
+admission_policy = AdmissionPolicy(
+    limit=concurrency_limit,
+    queue_size=concurrency_queue_size,
+    queue_timeout=concurrency_queue_timeout,
+    adaptive=adaptive_concurrency,
+)
+rate_limit_policy = RateLimitPolicy(rate=rate_limit, burst=rate_limit_burst)
+stale_policy = StalePolicy(
+    while_revalidate=stale_while_revalidate, if_error=stale_if_error
+)
+if rate_limit_shared_path:
+    rate_limit_store = SharedBucketStore(rate_limit_shared_path)
+else:
+    rate_limit_store = BucketStore(rate_limit_max_clients)
 
 if not openapi_schema_url or not origin_base_url:
     raise ValueError(
         "Environment variables OPENAPI_SCHEMA_URL and ORIGIN_BASE_URL must be set"
     )
 
-openapi_schema = load_openapi_schema(openapi_schema_url)
-
-# Example: ALLOW_LIST="GET:/pets|GET:/pets/{petId}"
-allow_list = os.getenv("ENDPOINT_ALLOW_LIST", "").split("|")
-
-if allow_list != [""]:
-    logging.info(f"Filtering API to allow list: {allow_list}")
-    openapi_schema = filter_endpoints(openapi_schema, allow_list)
+# Example: ORIGIN_BASE_URL="http://origin-0:8000|http://origin-1:8000"
+origin_base_urls = origin_base_url.split("|")
+if len(origin_base_urls) > 1 or origin_health_check_path:
+    origin_pool = OriginPool(
+        origin_base_urls,
+        weights=origin_weights,
+        failure_threshold=origin_failure_threshold,
+        ejection_time=origin_ejection_time,
+        health_check_path=origin_health_check_path,
+        health_check_interval=origin_health_check_interval,
+    )
+    upstream_base_url = origin_pool.base_url
 else:
-    logging.info("No allow list provided. Proxying all endpoints.")
+    origin_pool = None
+    upstream_base_url = origin_base_url
+
+if metrics_enabled:
+    proxy_metrics = ProxyMetrics(
+        token_manager=token_manager,
+        cache=response_cache,
+        coalescer=request_coalescer,
+        origin_pool=origin_pool,
+        compressor=compressor,
+    )
+else:
+    proxy_metrics = None
+if proxy_metrics and workers > 1:
+    # Each scrape is answered by one worker, which serves those of its
+    # siblings, the workers started by the same uvicorn process, as well.
+    shared_metrics = SharedMetrics(
+        proxy_metrics.registry,
+        os.path.join(
+            tempfile.gettempdir(), f"openapi-rest-proxy-metrics-{os.getppid()}"
+        ),
+    )
+else:
+    shared_metrics = None
 
-create_proxy_routes(app.router, openapi_schema, origin_base_url=origin_base_url)
+# Example: ALLOW_LIST="GET:/pets|GET:/pets/{petId}"
+allow_list = [
+    entry for entry in os.getenv("ENDPOINT_ALLOW_LIST", "").split("|") if entry
+]
+
+openapi_schema, schema_validators = load_openapi_schema(
+    openapi_schema_url, allow_list, snapshot_path=schema_snapshot_path
+)
+proxy_routes = []
+
+
+def install_proxy_routes(schema: dict):
+    """Replace the proxied routes with those for ``schema`` in one assignment.
+
+    Requests already routed keep running on the old routes, and new requests
+    are matched against the new ones. Proxied routes always come after the
+    proxy's own, so a templated path such as ``/{name}`` never shadows them.
+    """
+    global proxy_routes
+    router = APIRouter()
+    create_proxy_routes(
+        router,
+        schema,
+        origin_base_url=upstream_base_url,
+        streaming=stream_bodies,
+        cache=response_cache,
+        cache_ttls=cache_ttls,
+        coalescer=request_coalescer,
+        compressor=compressor,
+        trie_routing=trie_routing,
+        metrics=proxy_metrics,
+        resilience=resilience_policy,
+        retry_budget=retry_budget,
+        admission=admission_policy,
+        rate_limit=rate_limit_policy,
+        rate_limit_store=rate_limit_store,
+        rate_limit_key_header=rate_limit_key_header,
+        access_log=access_log,
+        server_timing=server_timing,
+        tracing=tracing,
+        stale=stale_policy,
+    )
+    replaced = {id(route) for route in proxy_routes}
+    app.router.routes = [
+        *(route for route in app.router.routes if id(route) not in replaced),
+        *router.routes,
+    ]
+    proxy_routes = router.routes
+    app.openapi_schema = None
+
+
+schema_reloader = SchemaReloader(
+    openapi_schema_url,
+    allow_list,
+    openapi_schema,
+    on_change=install_proxy_routes,
+    validators=schema_validators,
+    snapshot_path=schema_snapshot_path,
+    interval=schema_reload_interval,
+)
+if proxy_metrics:
+    proxy_metrics.schema_reloader = schema_reloader
 
 if fixed_request_headers:
     fixed_headers = dict(
@@ -113,34 +405,76 @@ else:
     fixed_headers = {}
 
 
-@app.middleware("http")
-async def mutate_headers(request: Request, call_next):
-    """Add fixed headers and authorization to requests."""
-    mutable_headers = list(request.scope["headers"])
-
-    for header, value in fixed_headers.items():
-        logging.debug(f"Adding fixed header with key '{header}'")
-        mutable_headers.append((header.lower().encode("utf-8"), value.encode("utf-8")))
-
-    access_token = get_access_token()
-    if access_token:
-        mutable_headers.append(
-            (b"authorization", f"Bearer {access_token}".encode("utf-8"))
-        )
-
-    request.scope["headers"] = mutable_headers
-
-    response = await call_next(request)
-    return response
+app.add_middleware(
+    HeaderInjectionMiddleware,
+    fixed_headers=fixed_headers,
+    token_manager=token_manager,
+    timed=server_timing or tracing is not None,
+    skip_paths={
+        "/",
+        "/admin/reload-schema",
+        "/metrics",
+        app.docs_url,
+        app.redoc_url,
+        app.openapi_url,
+    },
+)
 
 
 @app.get("/")
 def read_root():
     """Return proxy configuration information."""
-    return {"origin": origin_base_url, "schema": openapi_schema_url}
+    info = {"origin": origin_base_url, "schema": openapi_schema_url}
+    if response_cache is not None:
+        info["cache"] = response_cache.stats()
+    return info
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Return proxy metrics in the Prometheus text format."""
+    if proxy_metrics is None:
+        raise HTTPException(status_code=404)
+    if shared_metrics:
+        # Reads the files of the other workers.
+        data = await asyncio.to_thread(generate_latest, shared_metrics)
+    else:
+        data = generate_latest(proxy_metrics.registry)
+    return Response(data, media_type=CONTENT_TYPE_LATEST)
+
+
+@app.post("/admin/reload-schema")
+async def reload_schema(request: Request):
+    """Reload the OpenAPI schema now, if an admin token is configured."""
+    if not admin_token:
+        raise HTTPException(status_code=404)
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not secrets.compare_digest(
+        token.encode(), admin_token.encode()
+    ):
+        raise HTTPException(status_code=401, headers={"WWW-Authenticate": "Bearer"})
+    try:
+        changed = await schema_reloader.reload()
+    except httpx.HTTPError as exc:
+        raise HTTPException(status_code=502, detail=str(exc)) from exc
+    # The other workers reload on SIGHUP, each fetching the schema itself.
+    signalled = signal_other_workers(signal.SIGHUP)
+    return {
+        "changed": changed,
+        "reloads": schema_reloader.reloads,
+        "workers_signalled": signalled,
+    }
+
+
+# Installed once the proxy's own routes are, as on every reload.
+install_proxy_routes(openapi_schema)
 
 
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host=host, port=port)
+    # Workers import the app by name; uvloop and httptools are used if installed.
+    # Proxied requests are logged by the proxy's own access log.
+    uvicorn.run(
+        "proxy.app:app", host=host, port=port, workers=workers, access_log=False
+    )
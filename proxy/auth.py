@@ -0,0 +1,266 @@
+import asyncio
+import base64
+import fcntl
+import json
+import logging
+import os
+import random
+import time
+
+from httpx import AsyncClient, HTTPStatusError
+
+from .tasks import consume_exception
+
+
+class TokenRefreshError(Exception):
+    """Raised while backing off after failing to refresh the token."""
+
+
+class SharedTokenFile:
+    """Share an OAuth2 token between worker processes through a locked file.
+
+    The worker holding the lock either finds a token another worker already
+    refreshed or fetches one itself and writes it for the others.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock_path = f"{path}.lock"
+
+    def acquire(self) -> int:
+        """Block until this process holds the lock, returning its descriptor."""
+        descriptor = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(descriptor, fcntl.LOCK_EX)
+        return descriptor
+
+    def release(self, descriptor: int):
+        """Release a lock taken with ``acquire``."""
+        fcntl.flock(descriptor, fcntl.LOCK_UN)
+        os.close(descriptor)
+
+    def load(self) -> dict | None:
+        """Return the shared token, if one has been written."""
+        try:
+            with open(self.path) as token_file:
+                return json.load(token_file)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, token: dict):
+        """Replace the shared token, readable by the owner only."""
+        temporary_path = f"{self.path}.tmp"
+        descriptor = os.open(
+            temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600
+        )
+        with os.fdopen(descriptor, "w") as token_file:
+            json.dump(token, token_file)
+        os.replace(temporary_path, self.path)
+
+
+class TokenManager:
+    """Keep an OAuth2 access token fresh without blocking the event loop.
+
+    The token is refreshed by a background task ahead of its expiry. Callers
+    read the cached ``Authorization`` header value and only wait when no valid
+    token is available, in which case they all share the same in-flight
+    refresh.
+    """
+
+    def __init__(
+        self,
+        auth_endpoint_url: str,
+        client_id: str,
+        client_secret: str,
+        scope: str | None = None,
+        refresh_skew: float = 60.0,
+        min_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        token_file: str | None = None,
+    ):
+        self.auth_endpoint_url = auth_endpoint_url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.scope = scope
+        self.refresh_skew = refresh_skew
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.shared = SharedTokenFile(token_file) if token_file else None
+
+        self.authorization: bytes | None = None
+        self.expires_at = 0.0
+        self.refresh_count = 0
+        self._refresh_token: str | None = None
+        self._client: AsyncClient | None = None
+        self._inflight: asyncio.Future | None = None
+        self._task: asyncio.Task | None = None
+        self._failures = 0
+        self._retry_at = 0.0
+        self._last_error: Exception | None = None
+
+    @property
+    def current(self) -> bytes | None:
+        """Return the cached header value if the token has not expired."""
+        if self.expires_at > time.time():
+            return self.authorization
+        return None
+
+    async def get_authorization(self) -> bytes | None:
+        """Return a valid ``Authorization`` header value, refreshing if needed."""
+        authorization = self.current
+        if authorization:
+            return authorization
+        return await self.refresh()
+
+    async def refresh(self) -> bytes:
+        """Refresh the token, joining a refresh that is already in flight."""
+        if self._inflight is None:
+            if self._last_error and time.time() < self._retry_at:
+                # Fail fast while backing off instead of hammering the endpoint.
+                raise TokenRefreshError(
+                    "Backing off after failing to refresh the OAuth2 access token"
+                ) from self._last_error
+            self._inflight = asyncio.ensure_future(self._fetch())
+            self._inflight.add_done_callback(consume_exception)
+            self._inflight.add_done_callback(self._clear_inflight)
+        return await asyncio.shield(self._inflight)
+
+    def start(self, client: AsyncClient):
+        """Start refreshing the token in the background using ``client``."""
+        self._client = client
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        """Stop the background refresh task."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                logging.exception("Failed to refresh OAuth2 access token")
+                # Never retry sooner than the minimum backoff, whatever failed.
+                delay = max(
+                    self._retry_at - time.time(),
+                    random.uniform(self.min_backoff / 2, self.min_backoff),
+                )
+            else:
+                # Refresh ahead of expiry, but never sooner than halfway there.
+                now = time.time()
+                refresh_at = max(
+                    self.expires_at - self.refresh_skew, (now + self.expires_at) / 2
+                )
+                delay = refresh_at - now
+            await asyncio.sleep(max(delay, 0.0))
+
+    def _clear_inflight(self, future: asyncio.Future):
+        self._inflight = None
+
+    async def _fetch(self) -> bytes:
+        if self.shared is None:
+            return await self._fetch_token()
+
+        try:
+            descriptor = await asyncio.to_thread(self.shared.acquire)
+        except OSError as error:
+            self._back_off(error)
+            raise
+        try:
+            token = self.shared.load()
+            if token and token["expires_at"] - self.refresh_skew > time.time():
+                # Another worker refreshed the token while this one waited.
+                self.authorization = token["authorization"].encode("utf-8")
+                self.expires_at = token["expires_at"]
+                self._refresh_token = token.get("refresh_token")
+                logging.debug("Using OAuth2 access token shared by another worker")
+                return self.authorization
+
+            if token and not self._refresh_token:
+                self._refresh_token = token.get("refresh_token")
+            authorization = await self._fetch_token()
+            try:
+                self.shared.save(
+                    {
+                        "authorization": authorization.decode("utf-8"),
+                        "expires_at": self.expires_at,
+                        "refresh_token": self._refresh_token,
+                    }
+                )
+            except OSError:
+                logging.exception("Could not share the token at %s", self.shared.path)
+            return authorization
+        finally:
+            self.shared.release(descriptor)
+
+    async def _fetch_token(self) -> bytes:
+        try:
+            token_data = await self._request_token()
+            authorization = f"Bearer {token_data['access_token']}".encode("utf-8")
+            expires_at = time.time() + float(token_data["expires_in"])
+        except Exception as error:
+            self._back_off(error)
+            raise
+
+        self._failures = 0
+        self._last_error = None
+        self.refresh_count += 1
+        self.authorization = authorization
+        self.expires_at = expires_at
+        self._refresh_token = token_data.get("refresh_token")
+        logging.debug("Refreshed OAuth2 access token")
+        return self.authorization
+
+    def _back_off(self, error: Exception):
+        """Hold off refreshing after ``error``, exponentially with jitter."""
+        self._failures += 1
+        self._last_error = error
+        backoff = min(self.max_backoff, self.min_backoff * 2**self._failures)
+        self._retry_at = time.time() + random.uniform(self.min_backoff, backoff)
+
+    async def _request_token(self) -> dict:
+        if self._client is None:
+            raise RuntimeError("TokenManager.start() must be called first")
+
+        client = self._client
+        headers = {
+            "Cache-Control": "no-cache",
+            "Content-Type": "application/x-www-form-urlencoded",
+        }
+
+        if self._refresh_token:
+            response = await client.post(
+                self.auth_endpoint_url,
+                data={
+                    "grant_type": "refresh_token",
+                    "refresh_token": self._refresh_token,
+                    "client_id": self.client_id,
+                    "client_secret": self.client_secret,
+                },
+                headers=headers,
+            )
+            try:
+                response.raise_for_status()
+                return response.json()
+            except HTTPStatusError:
+                # Fall back to the client credentials grant on the next attempt.
+                self._refresh_token = None
+                raise
+
+        auth = f"{self.client_id}:{self.client_secret}"
+        auth_base64 = base64.b64encode(auth.encode("utf-8")).decode("utf-8")
+        response = await client.post(
+            self.auth_endpoint_url,
+            data={
+                "grant_type": "client_credentials",
+                "scope": self.scope,
+            },
+            headers={"Authorization": f"Basic {auth_base64}", **headers},
+        )
+        response.raise_for_status()
+        return response.json()
@@ -0,0 +1,488 @@
+import asyncio
+import hashlib
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+
+CACHEABLE_METHODS = frozenset(["GET", "HEAD"])
+CACHEABLE_STATUS_CODES = frozenset([200, 203, 300, 301, 404, 410])
+
+# Rough per-entry bookkeeping cost, so many tiny entries still count.
+ENTRY_OVERHEAD = 256
+# Request headers identifying the client to the origin: responses to requests
+# with different credentials are cached apart.
+CREDENTIAL_HEADERS = ("authorization", "cookie")
+# Response directives that forbid serving the response once stale.
+REVALIDATE_DIRECTIVES = frozenset(["must-revalidate", "proxy-revalidate", "no-cache"])
+
+
+@dataclass(frozen=True)
+class StalePolicy:
+    """For how long one operation's cached responses may be served stale.
+
+    For ``while_revalidate`` seconds after a response expires, it is served
+    while one request in the background refreshes it, and for ``if_error``
+    seconds, it is served when the origin fails or answers with a 5xx error.
+    Windows left at 0 are taken from the origin's ``stale-while-revalidate``
+    and ``stale-if-error`` directives instead.
+    """
+
+    while_revalidate: float = 0.0
+    if_error: float = 0.0
+
+    def for_operation(self, operation: dict) -> "StalePolicy":
+        """Apply the operation's ``x-proxy-*`` schema extensions."""
+        return StalePolicy(
+            while_revalidate=float(
+                operation.get("x-proxy-stale-while-revalidate", self.while_revalidate)
+            ),
+            if_error=float(operation.get("x-proxy-stale-if-error", self.if_error)),
+        )
+
+
+@dataclass
+class CachedResponse:
+    """An origin response held in memory, with its freshness information."""
+
+    status_code: int
+    headers: list
+    # A view of a mapped file for entries read from a DiskStore.
+    body: bytes | memoryview
+    stored_at: float = 0.0
+    expires_at: float = 0.0
+    vary: dict = field(default_factory=dict)
+    # Compressed copies of the response, by content encoding.
+    variants: dict = field(default_factory=dict)
+    # Seconds after expiry the response may still be served, see StalePolicy.
+    stale_while_revalidate: float = 0.0
+    stale_if_error: float = 0.0
+
+    @property
+    def size(self) -> int:
+        """Return the approximate number of bytes the entry occupies."""
+        return (
+            len(self.body)
+            + sum(len(name) + len(value) for name, value in self.headers)
+            + ENTRY_OVERHEAD
+            + sum(variant.size for variant in self.variants.values())
+        )
+
+    def is_fresh(self, now: float | None = None) -> bool:
+        """Return whether the entry can be served without asking the origin."""
+        return (now or time.time()) < self.expires_at
+
+    def is_stale_within(self, window: float, now: float | None = None) -> bool:
+        """Return whether the entry expired less than ``window`` seconds ago."""
+        return (now or time.time()) < self.expires_at + window
+
+    def header(self, name: bytes) -> bytes | None:
+        """Return the first value of header ``name``, if present."""
+        for header_name, value in self.headers:
+            if header_name == name:
+                return value
+        return None
+
+    @property
+    def validators(self) -> dict:
+        """Return the conditional request headers that revalidate the entry."""
+        validators = {}
+        etag = self.header(b"etag")
+        if etag:
+            validators["if-none-match"] = etag.decode("latin-1")
+        last_modified = self.header(b"last-modified")
+        if last_modified:
+            validators["if-modified-since"] = last_modified.decode("latin-1")
+        return validators
+
+
+def cache_key(method: str, target: str, request_headers) -> str:
+    """Return the key under which the response to a request is cached.
+
+    Requests sent with credentials get a digest of them in their key, so a
+    response is only ever served to requests with the same credentials,
+    without storing the credentials themselves.
+    """
+    credentials = [request_headers.get(name) for name in CREDENTIAL_HEADERS]
+    if not any(credentials):
+        return f"{method} {target}"
+    digest = hashlib.blake2b(repr(credentials).encode(), digest_size=16)
+    return f"{method} {target} {digest.hexdigest()}"
+
+
+def parse_cache_control(value: str | None) -> dict:
+    """Parse a ``Cache-Control`` header into a dict of lower-cased directives."""
+    directives = {}
+    if not value:
+        return directives
+    for directive in value.split(","):
+        name, _, argument = directive.strip().partition("=")
+        if name:
+            directives[name.lower()] = argument.strip('"') or None
+    return directives
+
+
+def freshness_lifetime(response: CachedResponse, ttl: float | None = None):
+    """Return for how many seconds ``response`` may be served from the cache.
+
+    The origin's ``Cache-Control`` and ``Expires`` headers are honoured, and
+    ``ttl``, if set, caps the lifetime or supplies one when the origin gave
+    none. ``None`` means the response must not be stored; responses with
+    validators but no freshness get a lifetime of 0, so they are stored but
+    revalidated with the origin before every use. Responses setting cookies
+    are never stored, as the cookies are meant for one client.
+    """
+    if response.status_code not in CACHEABLE_STATUS_CODES:
+        return None
+    if response.header(b"set-cookie") is not None:
+        return None
+
+    cache_control = response.header(b"cache-control")
+    directives = parse_cache_control(cache_control and cache_control.decode())
+    if directives.keys() & {"no-store", "private"}:
+        return None
+    vary = response.header(b"vary")
+    if vary and vary.strip() == b"*":
+        return None
+    if "no-cache" in directives:
+        return 0.0 if response.validators else None
+
+    lifetime = origin_lifetime(response, directives)
+    if lifetime is None:
+        return ttl if ttl is not None or not response.validators else 0.0
+    if ttl is not None:
+        return min(lifetime, ttl)
+    return lifetime
+
+
+def stale_windows(
+    response: CachedResponse, policy: StalePolicy | None = None
+) -> tuple[float, float]:
+    """Return for how long ``response`` may be served stale, see StalePolicy."""
+    cache_control = response.header(b"cache-control")
+    directives = parse_cache_control(cache_control and cache_control.decode())
+    if directives.keys() & REVALIDATE_DIRECTIVES:
+        return 0.0, 0.0
+    policy = policy or StalePolicy()
+    return (
+        policy.while_revalidate
+        or directive_seconds(directives, "stale-while-revalidate"),
+        policy.if_error or directive_seconds(directives, "stale-if-error"),
+    )
+
+
+def directive_seconds(directives: dict, name: str) -> float:
+    """Return the number of seconds given by a directive, or 0."""
+    try:
+        return max(float(directives.get(name) or 0), 0.0)
+    except ValueError:
+        return 0.0
+
+
+def origin_lifetime(response: CachedResponse, directives: dict) -> float | None:
+    """Return the lifetime the origin gave ``response``, if any."""
+    for directive in ("s-maxage", "max-age"):
+        if directives.get(directive):
+            try:
+                return float(directives[directive])
+            except ValueError:
+                # Invalid lifetimes mean the response is already stale.
+                return 0.0
+    return expires_lifetime(response)
+
+
+def expires_lifetime(response: CachedResponse) -> float | None:
+    """Return the lifetime given by the ``Expires`` header, if any."""
+    expires = response.header(b"expires")
+    if not expires:
+        return None
+    try:
+        expires_at = parsedate_to_datetime(expires.decode()).timestamp()
+    except (TypeError, ValueError):
+        # Invalid dates, such as "0", mean the response is already expired.
+        return 0.0
+    date = response.header(b"date")
+    try:
+        now = parsedate_to_datetime(date.decode()).timestamp() if date else None
+    except (TypeError, ValueError):
+        now = None
+    return expires_at - (now or time.time())
+
+
+def not_modified(entry: CachedResponse, request_headers) -> bool:
+    """Return whether the client's conditional headers match ``entry``."""
+    if entry.status_code != 200:
+        return False
+
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        etag = entry.header(b"etag")
+        if etag is None:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        # Weak comparison, as required for GET and HEAD.
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return etag.decode("latin-1").removeprefix("W/") in tags
+
+    if_modified_since = request_headers.get("if-modified-since")
+    last_modified = entry.header(b"last-modified")
+    if not if_modified_since or not last_modified:
+        return False
+    try:
+        return parsedate_to_datetime(
+            last_modified.decode("latin-1")
+        ) <= parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+
+
+def vary_values(vary: bytes | None, request_headers) -> dict:
+    """Return the request header values the response varies on."""
+    if not vary:
+        return {}
+    names = [name.strip().lower() for name in vary.decode().split(",")]
+    return {name: request_headers.get(name) for name in names if name}
+
+
+class CacheStore(ABC):
+    """Where a ResponseCache keeps its entries.
+
+    Stores only hold entries; deciding what to cache and for how long is
+    left to the ResponseCache. ``ttl`` is how many seconds a store should
+    keep an entry at most, including the time it may still be revalidated
+    after it expired.
+    """
+
+    @abstractmethod
+    async def get(self, key: str) -> CachedResponse | None:
+        """Return the entry stored under ``key``, if any."""
+
+    @abstractmethod
+    async def set(self, key: str, entry: CachedResponse, ttl: float):
+        """Store ``entry`` under ``key``, replacing any entry there."""
+
+    @abstractmethod
+    async def update(self, key: str, entry: CachedResponse, ttl: float):
+        """Store ``entry``, changed in place since it was got, if still there."""
+
+    @abstractmethod
+    async def delete(self, key: str):
+        """Remove the entry stored under ``key``, if any."""
+
+    def stats(self) -> dict:
+        """Return counters about the store."""
+        return {}
+
+
+class MemoryStore(CacheStore):
+    """Keep entries in process memory, bounded by bytes with LRU eviction."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        # Each entry with its accounted size and the time to drop it at.
+        self._entries: OrderedDict[str, tuple] = OrderedDict()
+
+    async def get(self, key: str) -> CachedResponse | None:
+        """Return the entry stored under ``key``, if any."""
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        if item[2] <= time.time():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return item[0]
+
+    async def set(self, key: str, entry: CachedResponse, ttl: float):
+        """Store ``entry`` under ``key``, unless it is larger than the store."""
+        if key in self._entries:
+            self._remove(key)
+        size = entry.size
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (entry, size, time.time() + ttl)
+        self.size += size
+        self._evict()
+
+    async def update(self, key: str, entry: CachedResponse, ttl: float):
+        """Account for ``entry`` having grown, if it is still stored."""
+        item = self._entries.get(key)
+        if item is None or item[0] is not entry:
+            return
+        size = entry.size
+        self._entries[key] = (entry, size, item[2])
+        self.size += size - item[1]
+        self._evict()
+
+    async def delete(self, key: str):
+        """Remove the entry stored under ``key``, if any."""
+        if key in self._entries:
+            self._remove(key)
+
+    def stats(self) -> dict:
+        """Return the number and size of entries, and evictions so far."""
+        return {
+            "entries": len(self._entries),
+            "size": self.size,
+            "max_size": self.max_bytes,
+            "evictions": self.evictions,
+        }
+
+    def _evict(self):
+        while self.size > self.max_bytes:
+            evicted_key, (_, size, _) = self._entries.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+            logging.debug("Evicted %s from the response cache", evicted_key)
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self.size -= size
+
+
+class ResponseCache:
+    """Cache of origin responses, kept in a CacheStore.
+
+    The cache decides which responses may be stored, for how long and for
+    which requests, and the ``store`` holds them: by default a MemoryStore
+    of ``max_bytes``. Expired entries with validators are kept for
+    ``stale_retention`` seconds, to be revalidated with the origin, and
+    others for as long as they may be served stale.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 0,
+        store: CacheStore | None = None,
+        stale_retention: float = 3600.0,
+    ):
+        self.store = store or MemoryStore(max_bytes)
+        self.stale_retention = stale_retention
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.stale = 0
+        self._refreshes: dict[str, asyncio.Task] = {}
+
+    async def get(
+        self, key: str, request_headers, stale: bool = False
+    ) -> CachedResponse | None:
+        """Return an entry matching the request, or None on a miss.
+
+        With ``stale``, expired entries that carry validators or may still be
+        served stale are returned as well, so they can be revalidated with the
+        origin or served anyway.
+        """
+        entry = await self.store.get(key)
+        if entry is None or entry.vary != vary_values(
+            entry.header(b"vary"), request_headers
+        ):
+            self.misses += 1
+            return None
+        if not entry.is_fresh():
+            self.misses += 1
+            window = max(entry.stale_while_revalidate, entry.stale_if_error)
+            if not entry.validators and not entry.is_stale_within(window):
+                await self.store.delete(key)
+                return None
+            return entry if stale else None
+
+        self.hits += 1
+        return entry
+
+    async def set(
+        self,
+        key: str,
+        response: CachedResponse,
+        request_headers,
+        ttl: float | None = None,
+        stale: StalePolicy | None = None,
+    ) -> bool:
+        """Store ``response`` if it is cacheable, returning whether it was.
+
+        ``stale`` is the operation's StalePolicy, if it has one.
+        """
+        lifetime = freshness_lifetime(response, ttl)
+        if lifetime is None:
+            await self.store.delete(key)
+            return False
+        windows = stale_windows(response, stale)
+        if lifetime <= 0 and not response.validators and not any(windows):
+            return False
+
+        response.stored_at = time.time()
+        response.expires_at = response.stored_at + lifetime
+        response.vary = vary_values(response.header(b"vary"), request_headers)
+        response.stale_while_revalidate, response.stale_if_error = windows
+        await self.store.set(key, response, self._retention(response))
+        return True
+
+    async def add_variant(
+        self, key: str, entry: CachedResponse, encoding: str, variant: CachedResponse
+    ):
+        """Keep ``variant``, ``entry`` in another encoding, if ``entry`` is cached."""
+        entry.variants[encoding] = variant
+        await self.store.update(key, entry, self._retention(entry))
+
+    async def revalidate(
+        self,
+        key: str,
+        entry: CachedResponse,
+        headers: list,
+        request_headers,
+        ttl: float | None = None,
+        stale: StalePolicy | None = None,
+    ) -> CachedResponse:
+        """Refresh ``entry`` with the headers of a 304 response from the origin."""
+        self.revalidations += 1
+        updated = {name for name, _ in headers} - {b"content-length"}
+        refreshed = CachedResponse(
+            status_code=entry.status_code,
+            headers=[
+                *(header for header in entry.headers if header[0] not in updated),
+                *(header for header in headers if header[0] in updated),
+            ],
+            body=entry.body,
+        )
+        await self.set(key, refreshed, request_headers, ttl=ttl, stale=stale)
+        return refreshed
+
+    def refresh(self, key: str, fetch: Callable[[], Awaitable]):
+        """Run ``fetch`` in the background, unless ``key`` is being refreshed."""
+        if key in self._refreshes:
+            return
+        task = asyncio.ensure_future(fetch())
+        self._refreshes[key] = task
+        task.add_done_callback(lambda task: self._refreshed(key, task))
+
+    def _refreshed(self, key: str, task: asyncio.Task):
+        del self._refreshes[key]
+        if not task.cancelled() and task.exception() is not None:
+            logging.warning(
+                "Refreshing %s in the background failed: %r", key, task.exception()
+            )
+
+    def stats(self) -> dict:
+        """Return counters useful for sizing the cache."""
+        return {
+            **self.store.stats(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "stale": self.stale,
+        }
+
+    def _retention(self, entry: CachedResponse) -> float:
+        """Return for how many seconds the store should keep ``entry``."""
+        retention = max(
+            self.stale_retention if entry.validators else 0.0,
+            entry.stale_while_revalidate,
+            entry.stale_if_error,
+        )
+        return max(entry.expires_at - time.time(), 0.0) + retention
@@ -0,0 +1,59 @@
+import asyncio
+from collections.abc import Awaitable, Callable
+from urllib.parse import parse_qsl, urlencode
+
+from .cache import CachedResponse
+from .tasks import consume_exception
+
+# Request headers that can change what the origin answers, so requests that
+# differ in them are never merged.
+COALESCE_KEY_HEADERS = (
+    "authorization",
+    "cookie",
+    "accept",
+    "accept-encoding",
+    "accept-language",
+)
+
+
+def coalesce_key(method: str, url: str, query: str, request_headers) -> tuple:
+    """Return the key under which identical requests are merged."""
+    sorted_query = urlencode(sorted(parse_qsl(query, keep_blank_values=True)))
+    return (
+        method,
+        url,
+        sorted_query,
+        tuple(request_headers.get(name) for name in COALESCE_KEY_HEADERS),
+    )
+
+
+class RequestCoalescer:
+    """Send one upstream request for identical concurrent requests.
+
+    The first request for a key runs the fetch; requests arriving while it is
+    in flight wait for and share its result.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._inflight: dict[tuple, asyncio.Future] = {}
+
+    async def run(
+        self, key: tuple, fetch: Callable[[], Awaitable[CachedResponse]]
+    ) -> CachedResponse:
+        """Return the result of ``fetch``, sharing it with concurrent callers."""
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fetch())
+            self._inflight[key] = future
+            future.add_done_callback(consume_exception)
+            future.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.coalesced += 1
+
+        # Shielded, so one waiter disconnecting does not cancel the others.
+        return await asyncio.shield(future)
+
+    def _forget(self, key: tuple, future: asyncio.Future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
@@ -0,0 +1,151 @@
+import asyncio
+import gzip
+from dataclasses import replace
+
+import brotli
+import zstandard
+
+from .cache import CachedResponse, parse_cache_control
+
+# Encodings in order of preference when the client accepts several equally.
+ENCODERS = {
+    "zstd": lambda body: zstandard.ZstdCompressor(level=3).compress(body),
+    "br": lambda body: brotli.compress(body, quality=5),
+    "gzip": lambda body: gzip.compress(body, compresslevel=6, mtime=0),
+}
+
+# Media types worth compressing, besides text/* and +json/+xml suffixes.
+COMPRESSIBLE_TYPES = frozenset(
+    [
+        "application/javascript",
+        "application/json",
+        "application/x-ndjson",
+        "application/xml",
+        "application/yaml",
+        "image/svg+xml",
+    ]
+)
+
+# Status codes whose body is not the requested representation.
+UNCOMPRESSED_STATUS_CODES = frozenset([204, 206, 304])
+
+
+def parse_accept_encoding(value: str | None) -> dict:
+    """Parse an ``Accept-Encoding`` header into a dict of encoding weights."""
+    weights = {}
+    if not value:
+        return weights
+    for item in value.split(","):
+        coding, _, parameters = item.partition(";")
+        weight = 1.0
+        name, _, argument = parameters.strip().partition("=")
+        if name.strip().lower() == "q":
+            try:
+                weight = float(argument)
+            except ValueError:
+                weight = 0.0
+        coding = coding.strip().lower()
+        if coding:
+            weights[coding] = weight
+    return weights
+
+
+class Compressor:
+    """Compress buffered responses for clients that accept it.
+
+    Bodies smaller than ``min_size`` are sent as they are, and bodies of at
+    least ``thread_min_size`` bytes are compressed in a worker thread so that
+    other requests are not held up meanwhile.
+    """
+
+    def __init__(self, min_size: int = 1024, thread_min_size: int = 65_536):
+        self.min_size = min_size
+        self.thread_min_size = thread_min_size
+        self.compressed = 0
+
+    def negotiate(self, entry: CachedResponse, accept_encoding: str | None):
+        """Return the encoding to send ``entry`` in, or None to send it as is."""
+        if not accept_encoding or not self.compressible(entry):
+            return None
+        weights = parse_accept_encoding(accept_encoding)
+        wildcard = weights.get("*", 0.0)
+        best, best_weight = None, 0.0
+        for encoding in ENCODERS:
+            weight = weights.get(encoding, wildcard)
+            if weight > best_weight:
+                best, best_weight = encoding, weight
+        return best
+
+    def compressible(self, entry: CachedResponse) -> bool:
+        """Return whether ``entry`` is worth compressing and may be."""
+        if (
+            entry.status_code in UNCOMPRESSED_STATUS_CODES
+            or len(entry.body) < self.min_size
+        ):
+            return False
+        content_encoding = entry.header(b"content-encoding")
+        if content_encoding and content_encoding.strip().lower() != b"identity":
+            return False
+        content_type = entry.header(b"content-type") or b""
+        media_type = content_type.split(b";")[0].strip().lower().decode("latin-1")
+        if not (
+            media_type in COMPRESSIBLE_TYPES
+            or media_type.startswith("text/")
+            or media_type.endswith(("+json", "+xml"))
+        ):
+            return False
+        cache_control = entry.header(b"cache-control")
+        directives = parse_cache_control(cache_control and cache_control.decode())
+        return "no-transform" not in directives
+
+    async def compress(self, entry: CachedResponse, encoding: str) -> CachedResponse:
+        """Return ``entry`` compressed with ``encoding``."""
+        encode = ENCODERS[encoding]
+        if len(entry.body) >= self.thread_min_size:
+            body = await asyncio.to_thread(encode, entry.body)
+        else:
+            body = encode(entry.body)
+        self.compressed += 1
+
+        headers = []
+        for name, value in vary_on_encoding(entry.headers):
+            if name in (b"content-length", b"content-encoding"):
+                continue
+            if name == b"etag" and not value.startswith(b"W/"):
+                # The compressed bytes differ, so the tag can only be weak.
+                value = b"W/" + value
+            headers.append((name, value))
+        headers += [
+            (b"content-encoding", encoding.encode("latin-1")),
+            (b"content-length", str(len(body)).encode("latin-1")),
+        ]
+        return replace(entry, headers=headers, body=body, variants={})
+
+    @staticmethod
+    def uncompressed(entry: CachedResponse) -> CachedResponse:
+        """Return ``entry`` to send as it is, marked as varying by encoding.
+
+        Caches downstream must not serve it to clients asking for another
+        encoding, whether or not it could be compressed.
+        """
+        vary = entry.header(b"vary")
+        if vary and b"accept-encoding" in vary.lower():
+            return entry
+        return replace(entry, headers=vary_on_encoding(entry.headers))
+
+
+def vary_on_encoding(headers: list) -> list:
+    """Return ``headers`` with ``Accept-Encoding`` added to their ``Vary``."""
+    vary = None
+    varied = []
+    for name, value in headers:
+        if name == b"vary":
+            vary = value
+        else:
+            varied.append((name, value))
+    if not vary:
+        vary = b"Accept-Encoding"
+    elif b"accept-encoding" not in vary.lower():
+        vary += b", Accept-Encoding"
+    varied.append((b"vary", vary))
+    return varied
@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from .cache import CachedResponse, CacheStore
+from .store import dumps_entry, loads_entry
+
+INDEX_NAME = "index.sqlite"
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    file TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_used_at ON entries (used_at);
+CREATE TABLE IF NOT EXISTS totals (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    entries INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS entries_inserted AFTER INSERT ON entries BEGIN
+    UPDATE totals SET entries = entries + 1, size = size + NEW.size;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_deleted AFTER DELETE ON entries BEGIN
+    UPDATE totals SET entries = entries - 1, size = size - OLD.size;
+END;
+INSERT OR IGNORE INTO totals
+    SELECT 0, COUNT(*), COALESCE(SUM(size), 0) FROM entries;
+"""
+# Seconds between recording uses of an entry, sparing a write on most hits.
+USE_RESOLUTION = 1.0
+# Seconds after which a file missing from the index is taken to be left over
+# by a crash, rather than being stored by another worker.
+ORPHAN_AGE = 60.0
+# Entries evicted per index query while the store is over its size.
+EVICTION_BATCH = 64
+
+
+class DiskStore(CacheStore):
+    """Keep entries in files under ``path``, bounded by bytes with LRU eviction.
+
+    Each entry is written by dumps_entry to a file of its own, indexed in a
+    SQLite database next to the files, so that all worker processes share the
+    store and it is still warm after a restart. Entries are read back by
+    mapping their files into memory: their bodies are served as views of the
+    mapping, from the page cache, rather than copied onto the Python heap.
+    Failing to read or write the store counts as a miss and is logged.
+
+    The number and size of entries are kept up to date in the index by
+    triggers, and read back on each write: ``stats`` reports them as of this
+    worker's last write.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.entries = 0
+        self.size = 0
+        self.evictions = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        self.index = sqlite3.connect(
+            os.path.join(path, INDEX_NAME),
+            timeout=5.0,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        # Readers do not block writers, and commits do not wait for fsync.
+        self.index.execute("PRAGMA journal_mode=WAL")
+        self.index.execute("PRAGMA synchronous=NORMAL")
+        self.index.executescript(INDEX_SCHEMA)
+        self._read_totals()
+        self._remove_orphans()
+
+    async def get(self, key: str) -> CachedResponse | None:
+        """Return the entry stored under ``key``, if any."""
+        return await self._run(self._get, key)
+
+    async def set(self, key: str, entry: CachedResponse, ttl: float):
+        """Store ``entry`` under ``key``, unless it is larger than the store."""
+        await self._run(self._set, key, entry, ttl)
+
+    async def update(self, key: str, entry: CachedResponse, ttl: float):
+        """Store ``entry`` under ``key``, unless the key was removed meanwhile."""
+        await self._run(self._set, key, entry, ttl, True)
+
+    async def delete(self, key: str):
+        """Remove the entry stored under ``key``, if any."""
+        await self._run(self._delete, key)
+
+    def stats(self) -> dict:
+        """Return the number and size of entries on disk, and evictions."""
+        return {
+            "disk_entries": self.entries,
+            "disk_size": self.size,
+            "disk_max_size": self.max_bytes,
+            "disk_evictions": self.evictions,
+            "store_errors": self.errors,
+        }
+
+    def close(self):
+        """Close the index; mapped entries stay readable."""
+        with self._lock:
+            self.index.close()
+
+    async def _run(self, function, *args):
+        try:
+            return await asyncio.to_thread(function, *args)
+        except (OSError, sqlite3.Error, ValueError, struct.error) as exc:
+            self.errors += 1
+            logging.warning(
+                "Disk cache request failed: %s", str(exc) or type(exc).__name__
+            )
+            return None
+
+    def _get(self, key: str) -> CachedResponse | None:
+        now = time.time()
+        with self._lock:
+            row = self.index.execute(
+                "SELECT file, expires_at, used_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            name, expires_at, used_at = row
+            if expires_at <= now:
+                with self._transaction():
+                    removed = self._remove(key)
+                self._unlink(removed)
+                return None
+            if now - used_at >= USE_RESOLUTION:
+                with self._transaction():
+                    self.index.execute(
+                        "UPDATE entries SET used_at = ? WHERE key = ?", (now, key)
+                    )
+        try:
+            with open(os.path.join(self.path, name), "rb") as file:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            # Replaced or evicted by another worker since the lookup.
+            return None
+        return loads_entry(data, copy=False)
+
+    def _set(self, key: str, entry: CachedResponse, ttl: float, update=False):
+        data = dumps_entry(entry)
+        if len(data) > self.max_bytes:
+            self._delete(key)
+            return
+        name = uuid.uuid4().hex
+        with open(os.path.join(self.path, name), "wb") as file:
+            file.write(data)
+        now = time.time()
+        with self._lock, self._transaction():
+            removed = self._remove(key)
+            if update and not removed:
+                removed = [name]
+            else:
+                self.index.execute(
+                    "INSERT INTO entries VALUES (?, ?, ?, ?, ?)",
+                    (key, name, len(data), now + ttl, now),
+                )
+                removed += self._evict()
+        self._unlink(removed)
+
+    def _delete(self, key: str):
+        with self._lock, self._transaction():
+            removed = self._remove(key)
+        self._unlink(removed)
+
+    @contextmanager
+    def _transaction(self):
+        # Taking the write lock up front keeps concurrent workers from
+        # deadlocking when they both upgrade a read to a write.
+        self.index.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+            self._read_totals()
+        except BaseException:
+            self.index.execute("ROLLBACK")
+            raise
+        self.index.execute("COMMIT")
+
+    def _read_totals(self):
+        self.entries, self.size = self.index.execute(
+            "SELECT entries, size FROM totals"
+        ).fetchone()
+
+    def _remove(self, key: str) -> list[str]:
+        """Remove ``key`` from the index, returning its file to unlink."""
+        row = self.index.execute(
+            "DELETE FROM entries WHERE key = ? RETURNING file", (key,)
+        ).fetchone()
+        return [row[0]] if row else []
+
+    def _evict(self) -> list[str]:
+        """Evict least recently used entries down to max_bytes."""
+        (size,) = self.index.execute("SELECT size FROM totals").fetchone()
+        removed = []
+        while size > self.max_bytes:
+            rows = self.index.execute(
+                "SELECT key, file, size FROM entries ORDER BY used_at LIMIT ?",
+                (EVICTION_BATCH,),
+            ).fetchall()
+            if not rows:
+                break
+            for key, name, entry_size in rows:
+                if size <= self.max_bytes:
+                    break
+                self.index.execute("DELETE FROM entries WHERE key = ?", (key,))
+                removed.append(name)
+                size -= entry_size
+                self.evictions += 1
+        return removed
+
+    def _unlink(self, names: list[str]):
+        # Readers that mapped a file keep it until they drop their entry.
+        for name in names:
+            try:
+                os.unlink(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+
+    def _remove_orphans(self):
+        """Remove files left over by a crash between writing and indexing them."""
+        indexed = {row[0] for row in self.index.execute("SELECT file FROM entries")}
+        cutoff = time.time() - ORPHAN_AGE
+        for item in os.scandir(self.path):
+            if (
+                item.name.startswith(INDEX_NAME)
+                or item.name in indexed
+                or item.stat().st_mtime > cutoff
+            ):
+                continue
+            self._unlink([item.name])
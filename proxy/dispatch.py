@@ -0,0 +1,158 @@
+import re
+
+from starlette.responses import PlainTextResponse
+from starlette.routing import BaseRoute, Match, get_route_path
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+PARAM_PATTERN = re.compile(r"{([^{}]+)}")
+
+
+class TrieNode:
+    """A path segment in a RouteTrie."""
+
+    __slots__ = ("static", "param_child", "patterns", "endpoints")
+
+    def __init__(self):
+        self.static: dict[str, TrieNode] = {}
+        # Whole-segment parameters, whatever their names in each template.
+        self.param_child: TrieNode | None = None
+        # Segments mixing literals and parameters, such as "{name}.{ext}".
+        self.patterns: list[tuple[re.Pattern, TrieNode]] = []
+        # Each endpoint with the names of its whole-segment parameters.
+        self.endpoints: dict[str, tuple[ASGIApp, tuple[str, ...]]] = {}
+
+
+class RouteTrie:
+    """Index OpenAPI path templates by segment for near-constant-time lookups.
+
+    Literal segments take precedence over templated ones, as in OpenAPI, and
+    the lookup cost depends on the depth of the path rather than on the number
+    of operations. Templates may name the parameter in the same position
+    differently, such as ``/users/{id}`` and ``/users/{userId}/posts``.
+    """
+
+    def __init__(self):
+        self.root = TrieNode()
+
+    def add(self, path: str, method: str, endpoint: ASGIApp):
+        """Register ``endpoint`` for ``method`` on the path template ``path``."""
+        node = self.root
+        names = []
+        for segment in path.strip("/").split("/"):
+            param = PARAM_PATTERN.fullmatch(segment)
+            if param:
+                names.append(param.group(1))
+            node = self._child(node, segment, param is not None)
+        node.endpoints[method] = (endpoint, tuple(names))
+
+    def match(self, path: str, method: str) -> tuple | None:
+        """Return the endpoint for ``method`` on ``path``, if any, and its details.
+
+        The result is the endpoint, the path parameters and the methods
+        allowed on the path. When templates match ``path`` but none of them
+        has an endpoint for ``method``, the endpoint is None.
+        """
+        segments = path.strip("/").split("/")
+        fallback = None
+        for node, values, params in self._candidates(self.root, segments, 0, (), {}):
+            route = node.endpoints.get(method)
+            if route is not None:
+                endpoint, names = route
+                params = {**params, **dict(zip(names, values))}
+                return endpoint, params, node.endpoints.keys()
+            if fallback is None:
+                fallback = (None, params, node.endpoints.keys())
+        return fallback
+
+    def _child(self, node: TrieNode, segment: str, is_param: bool) -> TrieNode:
+        if is_param:
+            if node.param_child is None:
+                node.param_child = TrieNode()
+            return node.param_child
+
+        if PARAM_PATTERN.search(segment):
+            pattern = re.compile(
+                "".join(
+                    f"(?P<{part}>[^/]+?)" if index % 2 else re.escape(part)
+                    for index, part in enumerate(PARAM_PATTERN.split(segment))
+                )
+            )
+            for existing, child in node.patterns:
+                if existing.pattern == pattern.pattern:
+                    return child
+            child = TrieNode()
+            node.patterns.append((pattern, child))
+            return child
+
+        return node.static.setdefault(segment, TrieNode())
+
+    def _candidates(
+        self, node: TrieNode, segments: list, index: int, values: tuple, params: dict
+    ):
+        """Yield the nodes matching ``segments``, in order of precedence."""
+        if index == len(segments):
+            if node.endpoints:
+                yield node, values, params
+            return
+
+        segment = segments[index]
+        child = node.static.get(segment)
+        if child is not None:
+            yield from self._candidates(child, segments, index + 1, values, params)
+
+        for pattern, child in node.patterns:
+            segment_match = pattern.fullmatch(segment)
+            if segment_match:
+                yield from self._candidates(
+                    child,
+                    segments,
+                    index + 1,
+                    values,
+                    {**params, **segment_match.groupdict()},
+                )
+
+        if node.param_child is not None and segment:
+            yield from self._candidates(
+                node.param_child, segments, index + 1, (*values, segment), params
+            )
+
+
+class TrieDispatcher(BaseRoute):
+    """A single Starlette route that dispatches every proxied operation."""
+
+    def __init__(self, trie: RouteTrie):
+        self.trie = trie
+
+    def matches(self, scope: Scope) -> tuple[Match, Scope]:
+        """Match the request path against the trie."""
+        if scope["type"] != "http":
+            return Match.NONE, {}
+        found = self.trie.match(get_route_path(scope), scope["method"])
+        if found is None:
+            return Match.NONE, {}
+
+        endpoint, params, allowed_methods = found
+        child_scope = {
+            "endpoint": endpoint,
+            "path_params": {**scope.get("path_params", {}), **params},
+            "allowed_methods": allowed_methods,
+        }
+        if child_scope["endpoint"] is None:
+            return Match.PARTIAL, child_scope
+        return Match.FULL, child_scope
+
+    async def handle(self, scope: Scope, receive: Receive, send: Send):
+        """Call the matched endpoint, or answer 405 for other methods."""
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            response = PlainTextResponse(
+                "Method Not Allowed",
+                status_code=405,
+                headers={"Allow": ", ".join(scope["allowed_methods"])},
+            )
+            await response(scope, receive, send)
+            return
+        await endpoint(scope, receive, send)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}()"
@@ -0,0 +1,480 @@
+import asyncio
+import logging
+import os
+import time
+from bisect import bisect_left
+from collections.abc import Awaitable
+from contextlib import suppress
+from itertools import accumulate
+
+from prometheus_client import CollectorRegistry, ProcessCollector, generate_latest
+from prometheus_client.core import (
+    CounterMetricFamily,
+    GaugeMetricFamily,
+    HistogramMetricFamily,
+)
+from prometheus_client.parser import text_string_to_metric_families
+
+DURATION_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+STATUS_CLASSES = ("1xx", "2xx", "3xx", "4xx", "5xx")
+# Seconds between each worker writing its metrics for the others to serve.
+SHARE_INTERVAL = 5.0
+
+
+class Histogram:
+    """A label-free histogram cheap enough to update on every request."""
+
+    __slots__ = ("buckets", "sum")
+
+    def __init__(self):
+        # One count per bucket, plus one for values above the largest bucket.
+        self.buckets = [0] * (len(DURATION_BUCKETS) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        """Record one observation of ``value`` seconds."""
+        self.buckets[bisect_left(DURATION_BUCKETS, value)] += 1
+        self.sum += value
+
+    def cumulative(self) -> list:
+        """Return ``(le, count)`` pairs in the Prometheus exposition format."""
+        bounds = [*map(str, DURATION_BUCKETS), "+Inf"]
+        return list(zip(bounds, accumulate(self.buckets)))
+
+
+# httpcore trace events, without their ".started" or ".complete" suffix, and
+# the RequestTimings phase each one counts towards.
+TRACED_PHASES = {
+    "connection.connect_tcp": "connect",
+    "connection.connect_unix_socket": "connect",
+    "connection.start_tls": "connect",
+    "http11.send_request_headers": "send",
+    "http11.send_request_body": "send",
+    "http2.send_request_headers": "send",
+    "http2.send_request_body": "send",
+}
+SERVER_TIMING_PHASES = ("middleware", "token", "routing", "connect", "send", "upstream")
+# The ASGI scope key under which the middleware hands RequestTimings on.
+TIMINGS_SCOPE_KEY = "proxy.timings"
+
+
+class RequestTimings:
+    """Time spent on one request, filled in as it is proxied.
+
+    ``started_at`` is when the proxy took the request and ``routed_at`` when
+    the middleware passed it on to be routed, on the ``time.perf_counter``
+    clock. The other attributes are durations in seconds: ``upstream`` is all
+    the time spent waiting on the origin, and with ``detailed`` timings, the
+    ``connect`` and ``send`` parts of it are recorded as well.
+    """
+
+    __slots__ = (
+        "started_at",
+        "routed_at",
+        "detailed",
+        "middleware",
+        "token",
+        "routing",
+        "connect",
+        "send",
+        "upstream",
+        "_phase_started_at",
+    )
+
+    def __init__(self, started_at: float | None = None, detailed: bool = False):
+        self.started_at = time.perf_counter() if started_at is None else started_at
+        self.routed_at = self.started_at
+        self.detailed = detailed
+        self.middleware = 0.0
+        self.token = 0.0
+        self.routing = 0.0
+        self.connect = 0.0
+        self.send = 0.0
+        self.upstream = 0.0
+        self._phase_started_at = 0.0
+
+    async def trace(self, event: str, info: dict):
+        """Time connection phases, as the ``trace`` extension of httpx requests."""
+        name, _, stage = event.rpartition(".")
+        phase = TRACED_PHASES.get(name)
+        if phase is None:
+            return
+        now = time.perf_counter()
+        if stage == "started":
+            self._phase_started_at = now
+        else:
+            setattr(self, phase, getattr(self, phase) + now - self._phase_started_at)
+
+    def server_timing(self) -> str:
+        """Return the timings so far as a ``Server-Timing`` header value."""
+        total = time.perf_counter() - self.started_at
+        return ", ".join(
+            f"{name};dur={duration * 1000:.3f}"
+            for name, duration in (
+                *((name, getattr(self, name)) for name in SERVER_TIMING_PHASES),
+                ("total", total),
+            )
+        )
+
+
+class OperationMetrics:
+    """Counters for one proxied operation, bound when its route is created.
+
+    Recording is plain attribute arithmetic on the event loop thread, with no
+    label lookups or locks; the values are only formatted when scraped.
+    """
+
+    __slots__ = (
+        "method",
+        "path",
+        "in_flight",
+        "responses",
+        "duration",
+        "upstream",
+        "overhead",
+    )
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.in_flight = 0
+        self.responses = [0] * len(STATUS_CLASSES)
+        self.duration = Histogram()
+        self.upstream = Histogram()
+        self.overhead = Histogram()
+
+    async def track(self, call: Awaitable, timings: RequestTimings):
+        """Await the proxied ``call`` and record its response and timings."""
+        started_at = time.perf_counter()
+        self.in_flight += 1
+        try:
+            response = await call
+        except Exception:
+            self.finish(500, started_at, timings)
+            raise
+        except BaseException:
+            # Cancelled, e.g. because the client went away: nothing to count.
+            self.in_flight -= 1
+            raise
+        self.finish(response.status_code, started_at, timings)
+        return response
+
+    def finish(self, status_code: int, started_at: float, timings: RequestTimings):
+        """Record a request that started at ``started_at`` and has completed."""
+        self.in_flight -= 1
+        self.responses[min(max(status_code // 100, 1), 5) - 1] += 1
+        duration = time.perf_counter() - started_at
+        self.duration.observe(duration)
+        self.upstream.observe(timings.upstream)
+        self.overhead.observe(duration - timings.upstream)
+
+
+class ProxyMetrics:
+    """Collect proxy metrics and expose them in the Prometheus format.
+
+    Per-operation metrics are recorded as requests complete. Gauges for the
+    upstream connection pool, token manager, cache, coalescer and compressor
+    are read from those objects when Prometheus scrapes the endpoint.
+    """
+
+    def __init__(
+        self,
+        token_manager=None,
+        cache=None,
+        coalescer=None,
+        origin_pool=None,
+        compressor=None,
+    ):
+        self.token_manager = token_manager
+        self.cache = cache
+        self.coalescer = coalescer
+        self.compressor = compressor
+        self.origin_pool = origin_pool
+        self.schema_reloader = None
+        self.upstream_client = None
+        self.operations: dict[tuple, OperationMetrics] = {}
+        self.registry = CollectorRegistry()
+        self.registry.register(self)
+        ProcessCollector(registry=self.registry)
+
+    def operation(self, method: str, path: str) -> OperationMetrics:
+        """Return the metrics for an operation, kept across schema reloads."""
+        key = (method, path)
+        if key not in self.operations:
+            self.operations[key] = OperationMetrics(method, path)
+        return self.operations[key]
+
+    def collect(self):
+        """Yield the metric families for a Prometheus scrape."""
+        yield from self._collect_operations()
+        yield from self._collect_upstream()
+        yield from self._collect_components()
+
+    def _collect_operations(self):
+        labels = ["method", "path"]
+        in_flight = GaugeMetricFamily(
+            "proxy_requests_in_flight", "Requests being proxied.", labels=labels
+        )
+        responses = CounterMetricFamily(
+            "proxy_requests",
+            "Proxied requests by response status class.",
+            labels=[*labels, "status"],
+        )
+        duration = HistogramMetricFamily(
+            "proxy_request_duration_seconds",
+            "Time from receiving a request to having its response.",
+            labels=labels,
+        )
+        upstream = HistogramMetricFamily(
+            "proxy_upstream_duration_seconds",
+            "Part of the request duration spent waiting on the origin.",
+            labels=labels,
+        )
+        overhead = HistogramMetricFamily(
+            "proxy_overhead_duration_seconds",
+            "Part of the request duration spent in the proxy itself.",
+            labels=labels,
+        )
+        for operation in list(self.operations.values()):
+            values = [operation.method, operation.path]
+            in_flight.add_metric(values, operation.in_flight)
+            for status, count in zip(STATUS_CLASSES, operation.responses):
+                if count:
+                    responses.add_metric([*values, status], count)
+            for family, histogram in (
+                (duration, operation.duration),
+                (upstream, operation.upstream),
+                (overhead, operation.overhead),
+            ):
+                family.add_metric(values, histogram.cumulative(), histogram.sum)
+        yield from (in_flight, responses, duration, upstream, overhead)
+
+    def _collect_upstream(self):
+        if self.origin_pool is not None:
+            yield from self._collect_origins()
+        pool = upstream_pool(self.upstream_client)
+        if pool is None:
+            return
+        connections = GaugeMetricFamily(
+            "proxy_upstream_connections",
+            "Pooled connections to the origin by state.",
+            labels=["state"],
+        )
+        idle = sum(1 for connection in pool.connections if connection.is_idle())
+        connections.add_metric(["active"], len(pool.connections) - idle)
+        connections.add_metric(["idle"], idle)
+        yield connections
+        yield GaugeMetricFamily(
+            "proxy_upstream_requests_waiting",
+            "Requests waiting for a pooled connection to the origin.",
+            value=sum(1 for request in pool._requests if request.is_queued()),
+        )
+
+    def _collect_origins(self):
+        outstanding = GaugeMetricFamily(
+            "proxy_origin_outstanding_requests",
+            "Requests in flight to each origin.",
+            labels=["origin"],
+        )
+        available = GaugeMetricFamily(
+            "proxy_origin_available",
+            "Whether each origin is healthy and not ejected.",
+            labels=["origin"],
+        )
+        now = time.monotonic()
+        for origin in self.origin_pool.origins:
+            outstanding.add_metric([origin.url], origin.outstanding)
+            available.add_metric([origin.url], int(origin.available(now)))
+        yield from (outstanding, available)
+
+    def _collect_components(self):
+        if self.token_manager is not None:
+            yield CounterMetricFamily(
+                "proxy_token_refreshes",
+                "OAuth2 access tokens obtained.",
+                value=self.token_manager.refresh_count,
+            )
+        if self.schema_reloader is not None:
+            yield CounterMetricFamily(
+                "proxy_schema_reloads",
+                "OpenAPI schema reloads that changed the proxied routes.",
+                value=self.schema_reloader.reloads,
+            )
+        if self.coalescer is not None:
+            yield CounterMetricFamily(
+                "proxy_coalesced_requests",
+                "Requests served by sharing another request's origin response.",
+                value=self.coalescer.coalesced,
+            )
+        if self.compressor is not None:
+            yield CounterMetricFamily(
+                "proxy_compressed_responses",
+                "Responses compressed by the proxy, not counting cached variants.",
+                value=self.compressor.compressed,
+            )
+        if self.cache is not None:
+            stats = self.cache.stats()
+            for name in ("hits", "misses", "evictions", "revalidations"):
+                yield CounterMetricFamily(
+                    f"proxy_cache_{name}", f"Response cache {name}.", value=stats[name]
+                )
+            yield CounterMetricFamily(
+                "proxy_cache_stale_responses",
+                "Stale responses served while refreshing them or on origin errors.",
+                value=stats["stale"],
+            )
+            if "store_errors" in stats:
+                yield CounterMetricFamily(
+                    "proxy_cache_store_errors",
+                    "Failed requests to the shared or disk cache store.",
+                    value=stats["store_errors"],
+                )
+            yield GaugeMetricFamily(
+                "proxy_cache_entries", "Responses in the cache.", value=stats["entries"]
+            )
+            yield GaugeMetricFamily(
+                "proxy_cache_size_bytes",
+                "Bytes used by the cache.",
+                value=stats["size"],
+            )
+            if "disk_entries" in stats:
+                yield from disk_cache_metrics(stats)
+
+
+class SharedMetrics:
+    """Serve the metrics of every worker process from whichever is scraped.
+
+    Each worker writes the metrics in its ``registry`` to a file of its own
+    under ``path`` every ``interval`` seconds. A scrape collects the metrics
+    of the worker answering it afresh, and those of the others from their
+    files, labelling the samples of each with the worker's process id. Files
+    left behind by workers that exited are removed.
+    """
+
+    def __init__(
+        self, registry: CollectorRegistry, path: str, interval: float = SHARE_INTERVAL
+    ):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.worker = str(os.getpid())
+        self._writer: asyncio.Task | None = None
+        os.makedirs(path, mode=0o700, exist_ok=True)
+
+    def start(self):
+        """Start writing this worker's metrics for the other workers."""
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._write_periodically())
+
+    async def stop(self):
+        """Stop writing this worker's metrics, and remove them."""
+        if self._writer is not None:
+            self._writer.cancel()
+            await asyncio.gather(self._writer, return_exceptions=True)
+            self._writer = None
+        with suppress(FileNotFoundError):
+            os.unlink(os.path.join(self.path, f"{self.worker}.prom"))
+
+    def collect(self):
+        """Return the metric families of all workers, one family per name."""
+        families = {}
+        for worker, family in self._worker_families():
+            samples = [
+                sample._replace(labels={**sample.labels, "worker": worker})
+                for sample in family.samples
+            ]
+            if family.name in families:
+                families[family.name].samples.extend(samples)
+            else:
+                family.samples = samples
+                families[family.name] = family
+        return families.values()
+
+    def _worker_families(self):
+        for family in self.registry.collect():
+            yield self.worker, family
+        for name in os.listdir(self.path):
+            worker, extension = os.path.splitext(name)
+            if extension != ".prom" or worker == self.worker:
+                continue
+            try:
+                if not process_exists(int(worker)):
+                    os.unlink(os.path.join(self.path, name))
+                    continue
+                with open(os.path.join(self.path, name)) as metrics_file:
+                    text = metrics_file.read()
+            except (OSError, ValueError):
+                # Not a worker's file, or removed since it was listed.
+                continue
+            for family in text_string_to_metric_families(text):
+                yield worker, family
+
+    async def _write_periodically(self):
+        while True:
+            try:
+                await asyncio.to_thread(self._write, generate_latest(self.registry))
+            except OSError:
+                logging.exception("Could not share metrics in %s", self.path)
+            await asyncio.sleep(self.interval)
+
+    def _write(self, data: bytes):
+        path = os.path.join(self.path, f"{self.worker}.prom")
+        with open(f"{path}.tmp", "wb") as metrics_file:
+            metrics_file.write(data)
+        os.replace(f"{path}.tmp", path)
+
+
+def process_exists(pid: int) -> bool:
+    """Return whether a process with the id ``pid`` is running."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def disk_cache_metrics(stats: dict):
+    """Yield the metrics of a DiskStore from the cache ``stats``."""
+    yield GaugeMetricFamily(
+        "proxy_cache_disk_entries",
+        "Responses in the disk cache.",
+        value=stats["disk_entries"],
+    )
+    yield GaugeMetricFamily(
+        "proxy_cache_disk_size_bytes",
+        "Bytes used by the disk cache.",
+        value=stats["disk_size"],
+    )
+    yield CounterMetricFamily(
+        "proxy_cache_disk_evictions",
+        "Responses evicted from the disk cache.",
+        value=stats["disk_evictions"],
+    )
+
+
+def upstream_pool(client):
+    """Return the connection pool behind an httpx client, if it can be found."""
+    # httpx does not expose pool usage, so look through its default transport,
+    # which a BalancingTransport wraps.
+    transport = getattr(client, "_transport", None)
+    transport = getattr(transport, "transport", transport)
+    pool = getattr(transport, "_pool", None)
+    if not hasattr(pool, "connections") or not hasattr(pool, "_requests"):
+        return None
+    return pool
@@ -0,0 +1,67 @@
+import time
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from .auth import TokenManager
+from .metrics import TIMINGS_SCOPE_KEY, RequestTimings
+
+# Where the headers sent by the client, before any were injected, are kept in
+# the request scope.
+CLIENT_HEADERS_SCOPE_KEY = "proxy.client_headers"
+
+
+class HeaderInjectionMiddleware:
+    """Add fixed headers and authorization to requests bound for the origin.
+
+    Fixed headers are encoded once when the middleware is created, and paths
+    served by the proxy itself (such as ``/``) are passed through untouched.
+    When ``timed``, the time spent here and on getting the access token is
+    recorded in RequestTimings passed on in the request scope. The client's
+    own headers are kept in the scope too, so that responses are cached by
+    the client's credentials rather than the proxy's.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        fixed_headers: dict,
+        token_manager: TokenManager | None = None,
+        skip_paths: set | frozenset = frozenset(),
+        timed: bool = False,
+    ):
+        self.app = app
+        self.fixed_headers = [
+            (header.lower().encode("utf-8"), value.encode("utf-8"))
+            for header, value in fixed_headers.items()
+        ]
+        self.token_manager = token_manager
+        self.skip_paths = frozenset(skip_paths)
+        self.timed = timed
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        """Inject the headers into the request scope and call the app."""
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings(detailed=True) if self.timed else None
+        scope[CLIENT_HEADERS_SCOPE_KEY] = scope["headers"]
+        if self.token_manager:
+            authorization = self.token_manager.current
+            if not authorization:
+                authorization = await self.token_manager.refresh()
+                if timings is not None:
+                    timings.token = time.perf_counter() - timings.started_at
+            scope["headers"] = [
+                *scope["headers"],
+                *self.fixed_headers,
+                (b"authorization", authorization),
+            ]
+        elif self.fixed_headers:
+            scope["headers"] = [*scope["headers"], *self.fixed_headers]
+
+        if timings is not None:
+            timings.routed_at = time.perf_counter()
+            timings.middleware = timings.routed_at - timings.started_at
+            scope[TIMINGS_SCOPE_KEY] = timings
+        await self.app(scope, receive, send)
@@ -0,0 +1,73 @@
+from urllib.parse import quote
+
+from .dispatch import PARAM_PATTERN
+
+# Request headers that describe the client's connection to the proxy rather
+# than the request, so they are never forwarded to the origin. httpx sets
+# "host" and the body framing headers for the upstream request itself.
+REQUEST_HOP_BY_HOP_HEADERS = frozenset(
+    [
+        "connection",
+        "content-length",
+        "host",
+        "keep-alive",
+        "proxy-authenticate",
+        "proxy-authorization",
+        "te",
+        "trailer",
+        "transfer-encoding",
+        "upgrade",
+    ]
+)
+
+# Characters allowed unencoded in a path segment (RFC 3986 "pchar"), besides
+# the unreserved ones that ``quote`` always leaves alone.
+PATH_SEGMENT_SAFE = "!$&'()*+,;=:@"
+
+
+class RequestPlan:
+    """Everything needed to forward a request for one operation.
+
+    The path template is split into literal text and parameter names once,
+    when the route is created, so building the origin URL for a request is a
+    single join of the literals with the percent-encoded parameter values.
+    """
+
+    __slots__ = ("method", "path", "prefix", "segments")
+
+    def __init__(self, method: str, path: str, origin_base_url: str):
+        self.method = method
+        self.path = path
+        parts = PARAM_PATTERN.split(path)
+        self.prefix = f"{origin_base_url}{parts[0]}"
+        # Pairs of a parameter name and the literal text that follows it.
+        self.segments = tuple(zip(parts[1::2], parts[2::2]))
+
+    def url(self, path_params: dict) -> str:
+        """Return the origin URL for a request with ``path_params``."""
+        if not self.segments:
+            return self.prefix
+        parts = [self.prefix]
+        for name, literal in self.segments:
+            parts.append(quote(str(path_params[name]), safe=PATH_SEGMENT_SAFE))
+            parts.append(literal)
+        return "".join(parts)
+
+    @staticmethod
+    def headers(request_headers) -> dict:
+        """Return the client's request headers to forward to the origin."""
+        strip = REQUEST_HOP_BY_HOP_HEADERS
+        connection = request_headers.get("connection")
+        if connection:
+            # Headers named in "Connection" are hop-by-hop as well.
+            strip = strip | {token.strip().lower() for token in connection.split(",")}
+        return {
+            name: value
+            for name, value in request_headers.items()
+            if name.lower() not in strip
+        }
+
+    @staticmethod
+    def query(scope) -> str:
+        """Return the raw query string, with repeated keys and encoding intact."""
+        return scope.get("query_string", b"").decode("latin-1")
@@ -1,17 +1,165 @@
 import logging
+import math
+import time
+from collections.abc import Callable
+from functools import partial
 
 from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.routing import APIRouter
-from httpx import AsyncClient
+from httpx import AsyncClient, HTTPError
+from httpx import Request as UpstreamRequest
+from httpx import Response as UpstreamResponse
+from starlette.datastructures import Headers
+from starlette.routing import request_response
+from starlette.types import Receive, Scope, Send
 
+from .accesslog import AccessLog
+from .admission import AdmissionLimiter, AdmissionPolicy
+from .cache import (
+    CACHEABLE_METHODS,
+    CachedResponse,
+    ResponseCache,
+    StalePolicy,
+    cache_key,
+    not_modified,
+    parse_cache_control,
+)
+from .coalesce import RequestCoalescer, coalesce_key
+from .compression import Compressor
+from .dispatch import RouteTrie, TrieDispatcher
+from .metrics import TIMINGS_SCOPE_KEY, OperationMetrics, ProxyMetrics, RequestTimings
+from .middleware import CLIENT_HEADERS_SCOPE_KEY
+from .plan import RequestPlan
+from .ratelimit import BucketStore, RateLimiter, RateLimitPolicy, SharedBucketStore
+from .resilience import (
+    CircuitOpenError,
+    OperationResilience,
+    ResiliencePolicy,
+    RetryBudget,
+)
+from .tracing import Tracing
 
-def create_proxy_handler(method: str, path: str, origin_base_url: str):
-    """Create a proxy handler for a specific HTTP method and path."""
+HOP_BY_HOP_HEADERS = frozenset(
+    [
+        b"connection",
+        b"keep-alive",
+        b"proxy-authenticate",
+        b"proxy-authorization",
+        b"te",
+        b"trailer",
+        b"transfer-encoding",
+        b"upgrade",
+    ]
+)
+
+HTTP_METHODS = frozenset(
+    ["get", "put", "post", "delete", "options", "head", "patch", "trace"]
+)
+
+# Conditional request headers the proxy evaluates itself for safe requests.
+CONDITIONAL_HEADERS = frozenset(["if-none-match", "if-modified-since"])
+
+# Headers sent along with a 304 Not Modified response.
+NOT_MODIFIED_HEADERS = frozenset(
+    [
+        b"cache-control",
+        b"content-location",
+        b"date",
+        b"etag",
+        b"expires",
+        b"last-modified",
+        b"vary",
+    ]
+)
+
+
+def create_proxy_handler(
+    method: str,
+    path: str,
+    origin_base_url: str,
+    streaming: bool = False,
+    cache: ResponseCache | None = None,
+    cache_ttl: float | None = None,
+    coalescer: RequestCoalescer | None = None,
+    compressor: Compressor | None = None,
+    metrics: OperationMetrics | None = None,
+    resilience: OperationResilience | None = None,
+    admission: AdmissionLimiter | None = None,
+    rate_limiter: RateLimiter | None = None,
+    access_log: AccessLog | None = None,
+    server_timing: bool = False,
+    tracing: Tracing | None = None,
+    stale: StalePolicy | None = None,
+):
+    """Create a proxy handler for a specific HTTP method and path.
+
+    With a ``rate_limiter``, clients over their rate get 429, and with
+    ``admission``, requests beyond the operation's concurrency limit and
+    queue are shed with 503, before reaching the origin. Each request is
+    recorded in the ``access_log``, if given.
+
+    With ``server_timing``, responses carry a ``Server-Timing`` header with
+    the time spent in each phase of the request, and with ``tracing``, each
+    request is traced with OpenTelemetry spans.
+    """
+    plan = RequestPlan(method, path, origin_base_url)
+    operation = f"{method}:{path}"
+    detailed = server_timing or tracing is not None
+    timed = (
+        detailed
+        or metrics is not None
+        or access_log is not None
+        or (admission is not None and admission.adaptive)
+    )
 
     async def proxy_handler(request: Request):
-        return await proxy(
-            request, method=method, path=path, origin_base_url=origin_base_url
+        started_at = time.perf_counter()
+        timings = None
+        if timed:
+            timings = request.scope.get(TIMINGS_SCOPE_KEY)
+            if timings is None:
+                timings = RequestTimings(started_at, detailed=detailed)
+            timings.routing = started_at - timings.routed_at
+        call = guarded_proxy(
+            request,
+            rate_limiter=rate_limiter,
+            admission=admission,
+            method=method,
+            path=path,
+            origin_base_url=origin_base_url,
+            client=request.app.state.upstream_client,
+            streaming=streaming,
+            cache=cache,
+            cache_ttl=cache_ttl,
+            coalescer=coalescer,
+            compressor=compressor,
+            timings=timings,
+            plan=plan,
+            resilience=resilience,
+            tracing=tracing,
+            stale=stale,
         )
+        if tracing is not None:
+            call = tracing.track(call, request, method, path, timings)
+        if metrics is not None:
+            call = metrics.track(call, timings)
+        try:
+            response = await call
+        except Exception:
+            if access_log is not None:
+                access_log.record(request, operation, 500, None, started_at, timings)
+            raise
+        if server_timing:
+            response.raw_headers = [
+                *response.raw_headers,
+                (b"server-timing", timings.server_timing().encode("latin-1")),
+            ]
+        if access_log is not None:
+            access_log.record(
+                request, operation, response.status_code, response, started_at, timings
+            )
+        return response
 
     return proxy_handler
 
@@ -19,21 +167,20 @@ def create_proxy_handler(method: str, path: str, origin_base_url: str):
 def filter_endpoints(schema: dict, allow_list: list):
     """Filter OpenAPI schema to only include allowed endpoints."""
     logging.debug("Filtering endpoints...")
-    logging.debug(f"Allow list: {allow_list}")
+    logging.debug("Allow list: %s", allow_list)
+    allowed = set(allow_list)
     filtered_paths = {}
     for path, methods in schema.get("paths", {}).items():
         for method in methods.keys():
-            method_path_combo = f"{method.upper()}:{path}"
-            formatted_method_path_combo = f"{method.upper()} {path}"
-
-            logging.debug(f"Checking {method_path_combo}")
-            if method_path_combo in allow_list:
-                logging.info(f"Allowing {formatted_method_path_combo}")
+            method_name = method.upper()
+            logging.debug("Checking %s:%s", method_name, path)
+            if f"{method_name}:{path}" in allowed:
+                logging.info("Allowing %s %s", method_name, path)
                 if path not in filtered_paths:
                     filtered_paths[path] = {}
                 filtered_paths[path][method] = methods[method]
             else:
-                logging.debug(f"Not allowing {formatted_method_path_combo}")
+                logging.debug("Not allowing %s %s", method_name, path)
 
     if not filtered_paths or not filtered_paths.keys():
         raise ValueError("No endpoints matched the allow list.")
@@ -43,53 +190,589 @@ def filter_endpoints(schema: dict, allow_list: list):
     return filtered_schema
 
 
-def create_proxy_routes(router: APIRouter, schema: dict, origin_base_url: str):
-    """Create proxy routes from OpenAPI schema."""
+def create_proxy_routes(
+    router: APIRouter,
+    schema: dict,
+    origin_base_url: str,
+    streaming: bool = False,
+    cache: ResponseCache | None = None,
+    cache_ttls: dict | None = None,
+    coalescer: RequestCoalescer | None = None,
+    compressor: Compressor | None = None,
+    trie_routing: bool = False,
+    metrics: ProxyMetrics | None = None,
+    resilience: ResiliencePolicy | None = None,
+    retry_budget: RetryBudget | None = None,
+    admission: AdmissionPolicy | None = None,
+    rate_limit: RateLimitPolicy | None = None,
+    rate_limit_store: BucketStore | SharedBucketStore | None = None,
+    rate_limit_key_header: str | None = None,
+    access_log: AccessLog | None = None,
+    server_timing: bool = False,
+    tracing: Tracing | None = None,
+    stale: StalePolicy | None = None,
+):
+    """Create proxy routes from OpenAPI schema.
+
+    An operation's cache TTL is taken from ``cache_ttls`` (keyed by
+    ``METHOD:PATH``) or else from its ``x-proxy-cache-ttl`` extension, and
+    its stale windows from the ``stale`` policy, overridden by its
+    ``x-proxy-stale-*`` extensions.
+    Buffered responses are compressed for clients with ``compressor``.
+
+    Each operation's retries, hedging and circuit breaker follow the
+    ``resilience`` policy, overridden by its ``x-proxy-*`` extensions, and all
+    retries and hedges share ``retry_budget``. Likewise, each operation gets
+    its own concurrency limit and queue from the ``admission`` policy, and
+    its own per-client rate limit from ``rate_limit``, counted in
+    ``rate_limit_store`` for clients identified by ``rate_limit_key_header``
+    or their IP address.
+
+    With ``trie_routing``, all operations are served by a single route that
+    looks them up in a RouteTrie, instead of one FastAPI route per operation.
+
+    With ``metrics``, each operation records its requests and timings, and
+    with an ``access_log``, each request is logged. ``server_timing`` and
+    ``tracing`` are passed on to create_proxy_handler.
+    """
     logging.debug("Creating proxy routes...")
+    cache_ttls = cache_ttls or {}
+    trie = RouteTrie() if trie_routing else None
+    resilience = resilience or ResiliencePolicy()
+    retry_budget = retry_budget or RetryBudget()
+    admission = admission or AdmissionPolicy()
+    rate_limit = rate_limit or RateLimitPolicy()
+    rate_limit_store = rate_limit_store or BucketStore()
+    stale = stale or StalePolicy()
 
     for path, methods in schema.get("paths", {}).items():
-        for method, _operation in methods.items():
+        for method, operation in methods.items():
+            if method.lower() not in HTTP_METHODS:
+                # Path items may also hold "parameters", "summary" and such.
+                continue
             method_name = method.upper()
+            cache_ttl = cache_ttls.get(
+                f"{method_name}:{path}", (operation or {}).get("x-proxy-cache-ttl")
+            )
+            if cache_ttl is not None:
+                cache_ttl = float(cache_ttl)
+            policy = resilience.for_operation(operation or {})
+            admission_policy = admission.for_operation(operation or {})
+            rate_limit_policy = rate_limit.for_operation(operation or {})
 
-            router.add_api_route(
-                path=path,
-                endpoint=create_proxy_handler(method_name, path, origin_base_url),
-                methods=[method_name],
+            endpoint = create_proxy_handler(
+                method_name,
+                path,
+                origin_base_url,
+                streaming=streaming,
+                cache=cache,
+                cache_ttl=cache_ttl,
+                coalescer=coalescer,
+                compressor=compressor,
+                metrics=metrics and metrics.operation(method_name, path),
+                resilience=(
+                    OperationResilience(method_name, policy, retry_budget)
+                    if policy.enabled
+                    else None
+                ),
+                admission=(
+                    AdmissionLimiter(admission_policy)
+                    if admission_policy.limit > 0
+                    else None
+                ),
+                rate_limiter=(
+                    RateLimiter(
+                        f"{method_name}:{path}",
+                        rate_limit_policy,
+                        rate_limit_store,
+                        key_header=rate_limit_key_header,
+                    )
+                    if rate_limit_policy.rate > 0
+                    else None
+                ),
+                access_log=access_log,
+                server_timing=server_timing,
+                tracing=tracing,
+                stale=stale.for_operation(operation or {}),
             )
-            logging.info(f"Registered route {method_name} {path}")
+            if trie is not None:
+                trie.add(path, method_name, request_response(endpoint))
+            else:
+                router.add_api_route(
+                    path=path, endpoint=endpoint, methods=[method_name]
+                )
+            logging.info("Registered route %s %s", method_name, path)
 
+    if trie is not None:
+        router.routes.append(TrieDispatcher(trie))
     logging.debug("Proxy routes created.")
 
 
-async def proxy(request: Request, method: str, path: str, origin_base_url: str):
-    """Proxy HTTP request to origin server with path parameter substitution."""
-    logging.info(f"Proxying {method.upper()} {path}")
+async def guarded_proxy(
+    request: Request,
+    rate_limiter: RateLimiter | None = None,
+    admission: AdmissionLimiter | None = None,
+    **kwargs,
+):
+    """Proxy the request, failing fast when it cannot be served.
 
-    actual_path = path
-    for param_name, param_value in request.path_params.items():
-        actual_path = actual_path.replace(f"{{{param_name}}}", param_value)
+    That is with 429 when the client is over its ``rate_limiter`` rate, and
+    with 503 when ``admission`` sheds the request or while the operation's
+    circuit is open.
+    """
+    if rate_limiter is not None:
+        headers = rate_limiter.check(request)
+        if headers is not None:
+            return Response(status_code=429, headers=headers)
+    if admission is None:
+        try:
+            return await proxy(request, **kwargs)
+        except CircuitOpenError as exc:
+            return unavailable(exc.retry_after)
+    if not await admission.acquire():
+        return unavailable(admission.retry_after)
 
-    url = f"{origin_base_url}{actual_path}"
-    params = dict(request.query_params)
+    def release():
+        timings = kwargs.get("timings")
+        # Requests answered without the origin, say from the cache, say
+        # nothing about its latency.
+        admission.release(timings.upstream if timings else None)
 
-    headers = {
-        k: v
-        for k, v in request.headers.items()
-        if k.lower() not in ["host", "content-length"]
-    }
-    body = await request.body()
+    try:
+        response = await proxy(request, **kwargs)
+    except CircuitOpenError as exc:
+        response = unavailable(exc.retry_after)
+    except BaseException:
+        release()
+        raise
+    if isinstance(response, RelayedResponse):
+        # Streamed requests hold their slot until their body is relayed.
+        response.on_sent = release
+    else:
+        release()
+    return response
 
-    async with AsyncClient() as client:
-        response = await client.request(
-            method=method,
-            url=url,
-            headers=headers,
-            params=params,
-            data=body,
+
+class RelayedResponse(StreamingResponse):
+    """A response relayed to the client as the origin sends it.
+
+    ``on_sent``, if set, is called once the response has been sent, or
+    abandoned when the client went away.
+    """
+
+    on_sent: Callable[[], None] | None = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        """Send the response, then call ``on_sent``."""
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.on_sent is not None:
+                self.on_sent()
+
+
+def unavailable(retry_after: float) -> Response:
+    """Return a 503 response asking the client to retry later."""
+    return Response(
+        status_code=503,
+        headers={"retry-after": str(max(math.ceil(retry_after), 1))},
+    )
+
+
+async def proxy(
+    request: Request,
+    method: str,
+    path: str,
+    origin_base_url: str,
+    client: AsyncClient,
+    streaming: bool = False,
+    cache: ResponseCache | None = None,
+    cache_ttl: float | None = None,
+    coalescer: RequestCoalescer | None = None,
+    compressor: Compressor | None = None,
+    timings: RequestTimings | None = None,
+    plan: RequestPlan | None = None,
+    resilience: OperationResilience | None = None,
+    tracing: Tracing | None = None,
+    stale: StalePolicy | None = None,
+):
+    """Proxy HTTP request to origin server with path parameter substitution.
+
+    ``plan`` is the operation's precompiled RequestPlan; without one, it is
+    compiled from ``method``, ``path`` and ``origin_base_url`` for this call.
+    The query string is forwarded as the client sent it.
+
+    The origin response body is passed through as raw bytes, still in the
+    content encoding the origin chose. In streaming mode the request body is
+    forwarded to the origin as it arrives and the response is relayed to the
+    client chunk by chunk, instead of buffering either of them in memory.
+    With a ``compressor``, buffered responses are instead requested from the
+    origin uncompressed, and compressed in the best encoding the client
+    accepts.
+
+    With a ``cache``, GET and HEAD responses are served from and stored in it,
+    using ``cache_ttl`` as the operation's maximum lifetime and ``stale`` as
+    its StalePolicy. With a
+    ``coalescer``, identical concurrent GET and HEAD requests share a single
+    request to the origin. Time spent waiting on the origin is added to
+    ``timings``. Requests to the origin are sent through ``resilience``, if
+    given, for retries, hedging and the circuit breaker, and traced with
+    ``tracing``.
+    """
+    logging.debug("Proxying %s %s", method, path)
+
+    if plan is None:
+        plan = RequestPlan(method, path, origin_base_url)
+    url = plan.url(request.path_params)
+    query = plan.query(request.scope)
+    headers = plan.headers(request.headers)
+    cached = method in CACHEABLE_METHODS and (
+        cache is not None or coalescer is not None
+    )
+    if "accept-encoding" not in headers or (
+        compressor is not None and (cached or not streaming)
+    ):
+        # Otherwise httpx asks for compression the client may not understand,
+        # or the origin compresses what the proxy compresses itself.
+        headers["accept-encoding"] = "identity"
+
+    if cached:
+        return await cached_proxy(
+            request,
+            method,
+            url,
+            headers,
+            query,
+            client,
+            cache,
+            cache_ttl,
+            coalescer,
+            compressor,
+            timings,
+            resilience,
+            tracing,
+            stale,
         )
 
-        return Response(
-            content=response.text,
-            status_code=response.status_code,
-            headers=dict(response.headers),
+    if streaming:
+        content = request_stream(request, headers)
+    else:
+        content = await request.body()
+
+    upstream_request = client.build_request(
+        method=method,
+        url=f"{url}?{query}" if query else url,
+        headers=headers,
+        content=content,
+    )
+    started_at = time.perf_counter()
+    response = await send(client, upstream_request, resilience, timings, tracing)
+
+    if streaming:
+        if timings is not None:
+            timings.upstream += time.perf_counter() - started_at
+        streaming_response = RelayedResponse(
+            relay_body(response), status_code=response.status_code
         )
+        streaming_response.raw_headers = relay_headers(response)
+        return streaming_response
+
+    entry = await read_response(response)
+    if timings is not None:
+        timings.upstream += time.perf_counter() - started_at
+    return build_response(await encode_entry(entry, request.headers, compressor))
+
+
+async def cached_proxy(
+    request: Request,
+    method: str,
+    url: str,
+    headers: dict,
+    query: str,
+    client: AsyncClient,
+    cache: ResponseCache | None = None,
+    cache_ttl: float | None = None,
+    coalescer: RequestCoalescer | None = None,
+    compressor: Compressor | None = None,
+    timings: RequestTimings | None = None,
+    resilience: OperationResilience | None = None,
+    tracing: Tracing | None = None,
+    stale: StalePolicy | None = None,
+):
+    """Serve a safe request from the cache or a shared upstream request.
+
+    The client's ``If-None-Match`` and ``If-Modified-Since`` headers are
+    answered by the proxy rather than forwarded. Stale cached entries are
+    revalidated with the origin using their own validators instead. Compressed
+    variants of a cached response are kept with it, so each is made once.
+
+    Within their ``stale`` windows, stale entries are served at once while
+    the cache refreshes them in the background, or served when the origin
+    fails or answers with a 5xx error.
+    """
+    target = f"{url}?{query}" if query else url
+    headers = {k: v for k, v in headers.items() if k not in CONDITIONAL_HEADERS}
+    # Keyed by the client's credentials: the proxy's own token is the same
+    # for every client, and changes whenever it is refreshed.
+    client_headers = request.scope.get(CLIENT_HEADERS_SCOPE_KEY)
+    key = cache_key(
+        method,
+        target,
+        request.headers if client_headers is None else Headers(raw=client_headers),
+    )
+    directives = parse_cache_control(request.headers.get("cache-control"))
+
+    stored = None
+    if cache is not None and "no-store" not in directives:
+        stored = await cache.get(key, request.headers, stale=True)
+    # Stored entries may only be served, fresh or stale, if the client agrees.
+    usable = None if "no-cache" in directives else stored
+    if usable is not None and usable.is_fresh():
+        return await serve_stored(usable, request, compressor, cache, key)
+    fallback = None
+    if usable is not None and usable.is_stale_within(usable.stale_if_error):
+        fallback = usable
+
+    fetch = partial(
+        fetch_entry,
+        request,
+        client,
+        method,
+        target,
+        headers,
+        key,
+        stored,
+        cache if "no-store" not in directives else None,
+        cache_ttl,
+        stale,
+        resilience,
+        tracing,
+        keep_stored=fallback is not None,
+    )
+    if coalescer is not None:
+        fetch = coalesced(fetch, coalescer, coalesce_key(method, url, query, headers))
+
+    if usable is not None and usable.is_stale_within(usable.stale_while_revalidate):
+        cache.refresh(key, fetch)
+        cache.stale += 1
+        return await serve_stored(usable, request, compressor, cache, key)
+
+    started_at = time.perf_counter()
+    try:
+        entry = await fetch(timings)
+    except (HTTPError, CircuitOpenError):
+        if fallback is None:
+            raise
+        entry = None
+    finally:
+        if timings is not None:
+            # Waiting on a shared request counts as waiting on the origin.
+            timings.upstream += time.perf_counter() - started_at
+    if fallback is not None and (entry is None or entry.status_code >= 500):
+        cache.stale += 1
+        return await serve_stored(fallback, request, compressor, cache, key)
+    entry = await encode_entry(entry, request.headers, compressor, cache=cache, key=key)
+    return conditional_response(entry, request.headers)
+
+
+def coalesced(fetch, coalescer: RequestCoalescer, shared_key: tuple):
+    """Return ``fetch`` sharing its result with concurrent identical requests."""
+
+    def fetch_shared(timings: RequestTimings | None = None):
+        return coalescer.run(shared_key, lambda: fetch(timings))
+
+    return fetch_shared
+
+
+async def fetch_entry(
+    request: Request,
+    client: AsyncClient,
+    method: str,
+    target: str,
+    headers: dict,
+    key: str,
+    stored: CachedResponse | None,
+    cache: ResponseCache | None,
+    cache_ttl: float | None,
+    stale: StalePolicy | None,
+    resilience: OperationResilience | None,
+    tracing: Tracing | None,
+    timings: RequestTimings | None = None,
+    keep_stored: bool = False,
+) -> CachedResponse:
+    """Fetch the response for a safe request and store it in the ``cache``.
+
+    A ``stored`` entry is revalidated with its validators. With
+    ``keep_stored``, 5xx errors do not replace the stored entry, which is
+    served stale instead.
+    """
+    validators = stored.validators if stored else {}
+    upstream_request = client.build_request(
+        method=method, url=target, headers={**headers, **validators}
+    )
+    response = await send(client, upstream_request, resilience, timings, tracing)
+    if stored and response.status_code == 304:
+        await response.aclose()
+        return await cache.revalidate(
+            key,
+            stored,
+            relay_headers(response),
+            request.headers,
+            ttl=cache_ttl,
+            stale=stale,
+        )
+
+    entry = await read_response(response)
+    if cache is not None and not (entry.status_code >= 500 and keep_stored):
+        await cache.set(key, entry, request.headers, ttl=cache_ttl, stale=stale)
+    return entry
+
+
+async def serve_stored(
+    stored: CachedResponse,
+    request: Request,
+    compressor: Compressor | None,
+    cache: ResponseCache,
+    key: str,
+) -> Response:
+    """Answer the request with the cached ``stored`` entry and its age."""
+    age = time.time() - stored.stored_at
+    entry = await encode_entry(
+        stored, request.headers, compressor, cache=cache, key=key
+    )
+    return conditional_response(entry, request.headers, age=age)
+
+
+async def encode_entry(
+    entry: CachedResponse,
+    request_headers,
+    compressor: Compressor | None = None,
+    cache: ResponseCache | None = None,
+    key: str | None = None,
+) -> CachedResponse:
+    """Return ``entry`` in the best encoding the client accepts.
+
+    Variants are kept with ``entry`` in the ``cache``, if it is stored there
+    under ``key``. With a ``compressor``, the response varies by encoding
+    even when it is sent as it is.
+    """
+    if compressor is None:
+        return entry
+    encoding = compressor.negotiate(entry, request_headers.get("accept-encoding"))
+    if encoding is None:
+        return compressor.uncompressed(entry)
+    variant = entry.variants.get(encoding)
+    if variant is None:
+        variant = await compressor.compress(entry, encoding)
+        if cache is not None:
+            await cache.add_variant(key, entry, encoding, variant)
+    return variant
+
+
+async def send(
+    client: AsyncClient,
+    request: UpstreamRequest,
+    resilience: OperationResilience | None = None,
+    timings: RequestTimings | None = None,
+    tracing: Tracing | None = None,
+) -> UpstreamResponse:
+    """Send ``request`` to the origin, streaming the response.
+
+    Connecting and sending the request are timed in detailed ``timings``.
+    """
+    if timings is not None and timings.detailed:
+        request.extensions["trace"] = timings.trace
+    if tracing is None:
+        return await resilient_send(client, request, resilience)
+    with tracing.client_span(request) as span:
+        response = await resilient_send(client, request, resilience)
+        span.set_attribute("http.response.status_code", response.status_code)
+        return response
+
+
+async def resilient_send(
+    client: AsyncClient,
+    request: UpstreamRequest,
+    resilience: OperationResilience | None = None,
+) -> UpstreamResponse:
+    """Send ``request`` to the origin, with ``resilience`` if given."""
+    if resilience is None:
+        return await client.send(request, stream=True)
+    return await resilience.send(client, request)
+
+
+async def read_response(response: UpstreamResponse) -> CachedResponse:
+    """Read the raw origin response body and release the connection."""
+    try:
+        body = b"".join([chunk async for chunk in response.aiter_raw()])
+    finally:
+        await response.aclose()
+    return CachedResponse(
+        status_code=response.status_code,
+        headers=relay_headers(response, body),
+        body=body,
+    )
+
+
+def conditional_response(
+    entry: CachedResponse, request_headers, age: float | None = None
+) -> Response:
+    """Answer with 304 Not Modified if the client already has ``entry``."""
+    if not not_modified(entry, request_headers):
+        return build_response(entry, age=age)
+
+    response = Response(status_code=304)
+    response.raw_headers = [
+        header for header in entry.headers if header[0] in NOT_MODIFIED_HEADERS
+    ]
+    return response
+
+
+def build_response(entry: CachedResponse, age: float | None = None) -> Response:
+    """Build the client response for a buffered origin response."""
+    response = Response(content=entry.body, status_code=entry.status_code)
+    response.raw_headers = entry.headers
+    if age is not None:
+        response.raw_headers = [
+            *(header for header in entry.headers if header[0] != b"age"),
+            (b"age", str(int(age)).encode("latin-1")),
+        ]
+    return response
+
+
+def request_stream(request: Request, headers: dict):
+    """Return the request body as an async iterator, or None without a body."""
+    if "content-length" in request.headers:
+        # Forwarding the length lets the origin receive a plain, unchunked body.
+        headers["content-length"] = request.headers["content-length"]
+        return request.stream()
+    if "transfer-encoding" in request.headers:
+        return request.stream()
+    return None
+
+
+def relay_headers(response: UpstreamResponse, body: bytes | None = None):
+    """Return the origin response headers to pass on to the client.
+
+    Hop-by-hop headers are dropped and repeated headers such as ``set-cookie``
+    are kept as separate entries. The body is relayed in its original encoding,
+    so the origin's ``content-length`` still applies; when the origin did not
+    send one, it is added for a buffered ``body``.
+    """
+    headers = [
+        (name.lower(), value)
+        for name, value in response.headers.raw
+        if name.lower() not in HOP_BY_HOP_HEADERS
+    ]
+    if body and "content-length" not in response.headers:
+        headers.append((b"content-length", str(len(body)).encode("latin-1")))
+    return headers
+
+
+async def relay_body(response: UpstreamResponse):
+    """Yield raw origin body chunks, releasing the connection when done."""
+    try:
+        async for chunk in response.aiter_raw():
+            yield chunk
+    finally:
+        await response.aclose()
@@ -0,0 +1,154 @@
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import struct
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+
+from fastapi import Request
+
+# A shared bucket: a hash of its key, its tokens and when they were counted.
+SHARED_BUCKET = struct.Struct("<Qdd")
+
+
+@dataclass(frozen=True)
+class RateLimitPolicy:
+    """How many requests per second one client may make to an operation.
+
+    Each client has a bucket of ``burst`` tokens (by default one second's
+    worth) that refills at ``rate`` tokens per second, and every request
+    takes one.
+    """
+
+    rate: float = 0.0
+    burst: float = 0.0
+
+    def for_operation(self, operation: dict) -> "RateLimitPolicy":
+        """Apply the operation's ``x-proxy-*`` schema extensions."""
+        return replace(
+            self,
+            rate=float(operation.get("x-proxy-rate-limit", self.rate)),
+            burst=float(operation.get("x-proxy-rate-limit-burst", self.burst)),
+        )
+
+
+class BucketStore:
+    """Token buckets of one worker process, in least recently used order.
+
+    A bucket left alone until it is full again is no different from a new
+    one, so such buckets are dropped as new requests come in. At most
+    ``max_buckets`` are kept, which bounds memory with many clients.
+    """
+
+    def __init__(self, max_buckets: int = 100_000):
+        self.max_buckets = max_buckets
+        self.buckets: OrderedDict = OrderedDict()
+
+    def take(self, key: str, rate: float, burst: float) -> float:
+        """Take a token from ``key``'s bucket, returning the tokens left.
+
+        A negative result means there was no token to take.
+        """
+        now = time.monotonic()
+        bucket = self.buckets.pop(key, None)
+        tokens = burst if bucket is None else refill(*bucket[:2], now, rate, burst)
+        left = tokens - 1
+        tokens = left if left >= 0 else tokens
+        self.buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+
+        while self.buckets:
+            oldest = next(iter(self.buckets.values()))
+            if oldest[2] > now and len(self.buckets) <= self.max_buckets:
+                break
+            self.buckets.popitem(last=False)
+        return left
+
+
+class SharedBucketStore:
+    """Token buckets shared by the worker processes through a mapped file.
+
+    The file is a fixed table of ``slots`` buckets, each locked on its own
+    while a request takes a token, so memory is bounded and a lookup is a
+    hash and a byte-range lock. Clients whose keys land on the same slot
+    reset each other's bucket, which errs on the side of letting requests
+    through.
+    """
+
+    def __init__(self, path: str, slots: int = 65_536):
+        self.slots = slots
+        size = slots * SHARED_BUCKET.size
+        self.descriptor = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self.descriptor).st_size < size:
+            os.ftruncate(self.descriptor, size)
+        self.table = mmap.mmap(self.descriptor, size)
+
+    def take(self, key: str, rate: float, burst: float) -> float:
+        """Take a token from ``key``'s bucket, returning the tokens left."""
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        key_hash = int.from_bytes(digest, "little") | 1
+        offset = key_hash % self.slots * SHARED_BUCKET.size
+        fcntl.lockf(self.descriptor, fcntl.LOCK_EX, SHARED_BUCKET.size, offset)
+        try:
+            # The monotonic clock is the same for every process on the host.
+            now = time.monotonic()
+            stored_hash, tokens, updated_at = SHARED_BUCKET.unpack_from(
+                self.table, offset
+            )
+            if stored_hash == key_hash:
+                tokens = refill(tokens, updated_at, now, rate, burst)
+            else:
+                tokens = burst
+            left = tokens - 1
+            tokens = left if left >= 0 else tokens
+            SHARED_BUCKET.pack_into(self.table, offset, key_hash, tokens, now)
+        finally:
+            fcntl.lockf(self.descriptor, fcntl.LOCK_UN, SHARED_BUCKET.size, offset)
+        return left
+
+
+def refill(tokens: float, updated_at: float, now: float, rate: float, burst: float):
+    """Return a bucket's tokens after refilling it since ``updated_at``."""
+    return min(tokens + max(now - updated_at, 0.0) * rate, burst)
+
+
+class RateLimiter:
+    """Apply a RateLimitPolicy to the clients of one operation.
+
+    Clients are told apart by their IP address, or by the value of
+    ``key_header`` when the request has it, such as an API key.
+    """
+
+    def __init__(
+        self,
+        operation: str,
+        policy: RateLimitPolicy,
+        store: BucketStore | SharedBucketStore,
+        key_header: str | None = None,
+    ):
+        self.operation = operation
+        self.rate = policy.rate
+        self.burst = policy.burst or max(policy.rate, 1.0)
+        self.store = store
+        self.key_header = key_header
+        self.limited = 0
+
+    def check(self, request: Request) -> dict | None:
+        """Take a token for ``request``, returning 429 headers if there is none."""
+        client = self.key_header and request.headers.get(self.key_header)
+        if not client:
+            client = request.client.host if request.client else ""
+        left = self.store.take(f"{self.operation} {client}", self.rate, self.burst)
+        if left >= 0:
+            return None
+
+        self.limited += 1
+        tokens = left + 1
+        return {
+            "retry-after": str(math.ceil((1 - tokens) / self.rate)),
+            "ratelimit-limit": str(int(self.burst)),
+            "ratelimit-remaining": "0",
+            "ratelimit-reset": str(math.ceil((self.burst - tokens) / self.rate)),
+        }
@@ -0,0 +1,319 @@
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass, replace
+
+from httpx import (
+    AsyncClient,
+    ByteStream,
+    Request,
+    Response,
+    Timeout,
+    TransportError,
+)
+
+# Methods that may be sent again without changing the outcome.
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "PUT", "DELETE", "TRACE"])
+# Methods that may be sent twice at once; hedging is limited to these.
+SAFE_METHODS = frozenset(["GET", "HEAD", "OPTIONS"])
+RETRY_STATUS_CODES = frozenset([502, 503, 504])
+
+RETRY_BACKOFF = 0.025
+LATENCY_SAMPLES = 256
+MIN_LATENCY_SAMPLES = 20
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of contacting an origin whose circuit breaker is open."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Circuit open, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class ResiliencePolicy:
+    """How hard to try one operation's requests to the origin.
+
+    ``retries`` extra attempts are made for idempotent methods on connection
+    errors and 502/503/504 responses. With ``hedge_percentile``, a safe
+    request still unanswered after that percentile of recent latencies is
+    sent a second time, and whichever response arrives first is used. With
+    ``breaker_threshold``, that many failures in a row open the circuit for
+    ``breaker_recovery_time`` seconds, during which requests fail fast. A
+    ``timeout`` replaces the upstream client's timeouts for each attempt.
+    """
+
+    retries: int = 0
+    hedge_percentile: float = 0.0
+    breaker_threshold: int = 0
+    breaker_recovery_time: float = 30.0
+    timeout: float | None = None
+
+    @property
+    def enabled(self) -> bool:
+        """Return whether the policy does anything."""
+        return bool(
+            self.retries
+            or self.hedge_percentile
+            or self.breaker_threshold
+            or self.timeout
+        )
+
+    def for_operation(self, operation: dict) -> "ResiliencePolicy":
+        """Apply the operation's ``x-proxy-*`` schema extensions.
+
+        Raises ValueError if ``x-proxy-timeout`` is not a positive number.
+        """
+        timeout = self.timeout
+        if "x-proxy-timeout" in operation:
+            value = operation["x-proxy-timeout"]
+            try:
+                timeout = float(value)
+            except (TypeError, ValueError):
+                timeout = 0.0
+            if not timeout > 0:
+                raise ValueError(
+                    f"x-proxy-timeout must be a positive number of seconds, "
+                    f"not {value!r}"
+                )
+        return replace(
+            self,
+            retries=int(operation.get("x-proxy-retries", self.retries)),
+            hedge_percentile=float(
+                operation.get("x-proxy-hedge-percentile", self.hedge_percentile)
+            ),
+            breaker_threshold=int(
+                operation.get(
+                    "x-proxy-circuit-breaker-threshold", self.breaker_threshold
+                )
+            ),
+            timeout=timeout,
+        )
+
+
+class RetryBudget:
+    """Limit retries and hedges to a fraction of all requests.
+
+    Every request earns ``ratio`` of a retry, and ``min_per_second`` retries
+    are granted over time so that quiet operations can still retry. Unused
+    allowance is capped, so a burst of failures cannot turn into a burst of
+    retries against a struggling origin.
+    """
+
+    def __init__(
+        self, ratio: float = 0.2, min_per_second: float = 10.0, burst: float = 10.0
+    ):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.burst = max(burst, min_per_second)
+        self.balance = self.burst
+        self._updated_at = time.monotonic()
+
+    def record_request(self):
+        """Earn allowance for one request."""
+        self.balance = min(self.balance + self.ratio, self.burst)
+
+    def try_spend(self) -> bool:
+        """Take allowance for one retry, returning whether there was any."""
+        now = time.monotonic()
+        self.balance = min(
+            self.balance + (now - self._updated_at) * self.min_per_second, self.burst
+        )
+        self._updated_at = now
+        if self.balance < 1.0:
+            return False
+        self.balance -= 1.0
+        return True
+
+
+class CircuitBreaker:
+    """Fail fast while an origin keeps failing, then let one probe through."""
+
+    def __init__(self, failure_threshold: int, recovery_time: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.probing = False
+
+    def allow(self) -> bool:
+        """Return whether a request may be sent now."""
+        if self.opened_at is None:
+            return True
+        if not self.probing and self.retry_after() == 0:
+            # Half-open: send one request to find out whether to close.
+            self.probing = True
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        """Return the seconds until the breaker lets a probe through."""
+        if self.opened_at is None:
+            return 0.0
+        return max(self.opened_at + self.recovery_time - time.monotonic(), 0.0)
+
+    def record(self, success: bool):
+        """Record the outcome of a request the breaker allowed."""
+        if success:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+            return
+        self.failures += 1
+        if self.probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logging.warning("Opening circuit after %s failures", self.failures)
+            self.opened_at = time.monotonic()
+            self.failures = 0
+            self.probing = False
+
+
+class LatencyTracker:
+    """Recent response latencies, for choosing when to hedge."""
+
+    def __init__(self, size: int = LATENCY_SAMPLES):
+        self.samples = [0.0] * size
+        self.count = 0
+        self._sorted: list = []
+
+    def observe(self, latency: float):
+        """Record the latency of a response."""
+        self.samples[self.count % len(self.samples)] = latency
+        self.count += 1
+        if self.count % MIN_LATENCY_SAMPLES == 0:
+            self._sorted = sorted(self.samples[: min(self.count, len(self.samples))])
+
+    def percentile(self, fraction: float) -> float | None:
+        """Return the ``fraction`` percentile, once there are enough samples."""
+        if not self._sorted:
+            return None
+        return self._sorted[
+            min(int(fraction * len(self._sorted)), len(self._sorted) - 1)
+        ]
+
+
+class OperationResilience:
+    """Apply a ResiliencePolicy to the requests of one operation."""
+
+    def __init__(self, method: str, policy: ResiliencePolicy, budget: RetryBudget):
+        self.retries = policy.retries if method in IDEMPOTENT_METHODS else 0
+        self.hedge_percentile = (
+            policy.hedge_percentile if method in SAFE_METHODS else 0.0
+        )
+        self.breaker = (
+            CircuitBreaker(policy.breaker_threshold, policy.breaker_recovery_time)
+            if policy.breaker_threshold
+            else None
+        )
+        self.timeout = Timeout(policy.timeout).as_dict() if policy.timeout else None
+        self.budget = budget
+        self.latencies = LatencyTracker()
+
+    async def send(self, client: AsyncClient, request: Request) -> Response:
+        """Send ``request`` with retries, hedging and the circuit breaker."""
+        if self.breaker is not None and not self.breaker.allow():
+            raise CircuitOpenError(self.breaker.retry_after())
+        self.budget.record_request()
+        if self.timeout is not None:
+            request.extensions["timeout"] = self.timeout
+        try:
+            response = await self._retrying(client, request)
+        except Exception:
+            self._record(False)
+            raise
+        except BaseException:
+            # Interrupted, so the probe proved nothing: let another request try.
+            if self.breaker is not None:
+                self.breaker.probing = False
+            raise
+        self._record(response.status_code < 500)
+        return response
+
+    def _record(self, success: bool):
+        if self.breaker is not None:
+            self.breaker.record(success)
+
+    async def _retrying(self, client: AsyncClient, request: Request) -> Response:
+        # Streamed request bodies can only be sent once.
+        replayable = isinstance(request.stream, ByteStream)
+        attempt = 0
+        while True:
+            try:
+                response = await self._attempt(client, request, replayable)
+            except TransportError:
+                if not self._may_retry(attempt, replayable):
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or (
+                    not self._may_retry(attempt, replayable)
+                ):
+                    return response
+                await response.aclose()
+            attempt += 1
+            await asyncio.sleep(random.uniform(0, RETRY_BACKOFF * 2**attempt))
+
+    def _may_retry(self, attempt: int, replayable: bool) -> bool:
+        return replayable and attempt < self.retries and self.budget.try_spend()
+
+    async def _attempt(
+        self, client: AsyncClient, request: Request, replayable: bool
+    ) -> Response:
+        started_at = time.perf_counter()
+        delay = self.latencies.percentile(self.hedge_percentile)
+        if not replayable or not self.hedge_percentile or delay is None:
+            response = await client.send(copy_request(request, replayable), stream=True)
+        else:
+            response = await self._hedged(client, request, delay)
+        self.latencies.observe(time.perf_counter() - started_at)
+        return response
+
+    async def _hedged(self, client: AsyncClient, request: Request, delay: float):
+        attempts = {
+            asyncio.ensure_future(client.send(copy_request(request), stream=True))
+        }
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=delay)
+            if not done and self.budget.try_spend():
+                attempts.add(
+                    asyncio.ensure_future(
+                        client.send(copy_request(request), stream=True)
+                    )
+                )
+            while True:
+                done, pending = await asyncio.wait(
+                    attempts, return_when=asyncio.FIRST_COMPLETED
+                )
+                winner = next((task for task in done if task.exception() is None), None)
+                if winner is not None or not pending:
+                    break
+                attempts = pending
+            if winner is None:
+                return done.pop().result()
+            attempts.discard(winner)
+            return winner.result()
+        finally:
+            for task in attempts:
+                task.cancel()
+                task.add_done_callback(close_response)
+
+
+def copy_request(request: Request, replayable: bool = True) -> Request:
+    """Return a fresh copy of ``request``, which transports may rewrite."""
+    if not replayable:
+        return request
+    return Request(
+        request.method,
+        request.url,
+        headers=request.headers,
+        content=request.content,
+        extensions=dict(request.extensions),
+    )
+
+
+def close_response(task: asyncio.Future):
+    """Close the response of an attempt that lost the race, if it got one."""
+    if task.cancelled() or task.exception() is not None:
+        return
+    asyncio.ensure_future(task.result().aclose())
@@ -0,0 +1,203 @@
+import asyncio
+import collections
+import logging
+import ssl
+import time
+from urllib.parse import unquote, urlsplit
+
+# Seconds a pool slot waits before connecting again after failing to connect.
+RECONNECT_BACKOFF = 1.0
+
+
+class RespError(Exception):
+    """An error reply from a Redis or Valkey server."""
+
+
+def encode_command(args: tuple) -> bytes:
+    """Encode a command as a RESP array of bulk strings."""
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode()
+        elif isinstance(arg, int):
+            arg = b"%d" % arg
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+async def read_reply(reader: asyncio.StreamReader):
+    """Read one RESP2 reply, returning error replies as RespError."""
+    line = await reader.readuntil(b"\r\n")
+    kind, value = line[:1], line[1:-2]
+    if kind == b"+":
+        return value
+    if kind == b"-":
+        return RespError(value.decode(errors="replace"))
+    if kind == b":":
+        return int(value)
+    if kind == b"$":
+        length = int(value)
+        if length < 0:
+            return None
+        return (await reader.readexactly(length + 2))[:-2]
+    if kind == b"*":
+        length = int(value)
+        if length < 0:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    raise ConnectionError(f"Unexpected RESP reply: {line!r}")
+
+
+class RespConnection:
+    """One connection to a Redis or Valkey server, pipelining its commands.
+
+    Commands are buffered and written together once the event loop gets
+    round to it, so all commands issued by concurrent requests in the
+    meantime share one write and one round trip. Replies come back in the
+    order the commands were sent, and resolve their futures in turn.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.closed = False
+        self._buffer: list[bytes] = []
+        self._pending: collections.deque[asyncio.Future] = collections.deque()
+        self._reader_task = asyncio.create_task(self._read_replies())
+
+    def send(self, *args) -> asyncio.Future:
+        """Queue a command, returning a future for its reply."""
+        if self.closed:
+            raise ConnectionError("Connection to the cache store is closed")
+        future = asyncio.get_running_loop().create_future()
+        if not self._buffer:
+            asyncio.get_running_loop().call_soon(self._flush)
+        self._buffer.append(encode_command(args))
+        self._pending.append(future)
+        return future
+
+    def close(self):
+        """Close the connection, failing the commands still waiting."""
+        self.closed = True
+        self._reader_task.cancel()
+        self.writer.close()
+        self._fail_pending(ConnectionError("Connection to the cache store closed"))
+
+    def _flush(self):
+        if self.closed:
+            return
+        self.writer.write(b"".join(self._buffer))
+        self._buffer.clear()
+
+    async def _read_replies(self):
+        try:
+            while True:
+                reply = await read_reply(self.reader)
+                future = self._pending.popleft()
+                # Commands that timed out were cancelled: drop their replies.
+                if future.done():
+                    continue
+                if isinstance(reply, RespError):
+                    future.set_exception(reply)
+                else:
+                    future.set_result(reply)
+        except Exception as exc:
+            logging.warning("Lost the connection to the cache store: %s", exc)
+            self.closed = True
+            self.writer.close()
+            self._fail_pending(ConnectionError(str(exc) or type(exc).__name__))
+
+    def _fail_pending(self, exc: Exception):
+        self._buffer.clear()
+        while self._pending:
+            future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(exc)
+
+
+class RespPool:
+    """A fixed-size pool of pipelining connections to a Redis or Valkey server.
+
+    ``url`` is a ``redis://`` (or ``valkey://``) URL, optionally with a user
+    name, password and database number, as in ``redis://:secret@cache:6379/1``;
+    ``rediss://`` and ``valkeys://`` connect over TLS. Connections are opened
+    when first used and reopened after failing, at most once per
+    RECONNECT_BACKOFF seconds per connection. Each command, including
+    connecting for it, fails with TimeoutError after ``timeout`` seconds.
+    """
+
+    def __init__(self, url: str, size: int = 4, timeout: float = 0.25):
+        parts = urlsplit(url)
+        if parts.scheme not in ("redis", "rediss", "valkey", "valkeys"):
+            raise ValueError(f"Unsupported cache store URL: {url!r}")
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or 6379
+        self.tls = parts.scheme in ("rediss", "valkeys")
+        self.username = unquote(parts.username) if parts.username else None
+        self.password = unquote(parts.password) if parts.password else None
+        self.db = int(parts.path.strip("/") or 0)
+        self.timeout = timeout
+        self._slots: list[asyncio.Task | None] = [None] * max(size, 1)
+        self._retry_at = [0.0] * len(self._slots)
+        self._next = 0
+
+    async def execute(self, *args):
+        """Send a command on the next connection and return its reply."""
+        async with asyncio.timeout(self.timeout):
+            connection = await self._connection()
+            return await connection.send(*args)
+
+    async def close(self):
+        """Close all connections."""
+        for index, slot in enumerate(self._slots):
+            self._slots[index] = None
+            if slot is None:
+                continue
+            if not slot.done():
+                slot.cancel()
+            elif not slot.cancelled() and slot.exception() is None:
+                slot.result().close()
+
+    async def _connection(self) -> RespConnection:
+        index = self._next
+        self._next = (index + 1) % len(self._slots)
+        slot = self._slots[index]
+        if slot is None or (slot.done() and not self._usable(slot)):
+            if time.monotonic() < self._retry_at[index]:
+                raise ConnectionError("The cache store is unavailable")
+            slot = self._slots[index] = asyncio.ensure_future(self._open(index))
+        # Several commands may wait for the same connection to open.
+        return await asyncio.shield(slot)
+
+    @staticmethod
+    def _usable(slot: asyncio.Task) -> bool:
+        return (
+            not slot.cancelled()
+            and slot.exception() is None
+            and not slot.result().closed
+        )
+
+    async def _open(self, index: int) -> RespConnection:
+        try:
+            reader, writer = await asyncio.open_connection(
+                self.host,
+                self.port,
+                ssl=ssl.create_default_context() if self.tls else None,
+            )
+            connection = RespConnection(reader, writer)
+        except Exception:
+            self._retry_at[index] = time.monotonic() + RECONNECT_BACKOFF
+            raise
+        setup = []
+        if self.password is not None:
+            credentials = [self.username] if self.username else []
+            setup.append(connection.send("AUTH", *credentials, self.password))
+        if self.db:
+            setup.append(connection.send("SELECT", self.db))
+        try:
+            await asyncio.gather(*setup)
+        except Exception:
+            self._retry_at[index] = time.monotonic() + RECONNECT_BACKOFF
+            connection.close()
+            raise
+        return connection
@@ -0,0 +1,262 @@
+import asyncio
+import json
+import logging
+import os
+from collections.abc import Callable
+
+import httpx
+import yaml
+
+from .proxy import HTTP_METHODS, filter_endpoints
+from .tasks import consume_exception
+
+# The libyaml-based loader is several times faster on large schemas.
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+SNAPSHOT_VERSION = 1
+
+
+def parse_schema(text: str, content_type: str = "") -> dict:
+    """Parse an OpenAPI schema document in JSON or YAML."""
+    if "json" in content_type or text.lstrip().startswith("{"):
+        try:
+            return json.loads(text)
+        except ValueError:
+            # Not JSON after all; YAML is a superset, so fall through.
+            pass
+    return yaml.load(text, Loader=YamlLoader)
+
+
+def fetch_schema(url: str, validators: dict | None = None, timeout: float = 30.0):
+    """Fetch the OpenAPI schema from ``url``.
+
+    ``validators`` are conditional request headers from an earlier fetch.
+    Returns the parsed schema and the validators of the response, or
+    ``(None, validators)`` when the schema host answered 304 Not Modified.
+    """
+    logging.debug("Loading OpenAPI schema from %s", url)
+    response = httpx.get(url, headers=validators or {}, timeout=timeout)
+    if validators and response.status_code == 304:
+        logging.debug("OpenAPI schema at %s has not changed.", url)
+        return None, validators
+    response.raise_for_status()
+    schema = parse_schema(response.text, response.headers.get("content-type", ""))
+    logging.debug("Loaded OpenAPI schema from %s.", url)
+    return schema, response_validators(response)
+
+
+def response_validators(response: httpx.Response) -> dict:
+    """Return the conditional request headers that revalidate ``response``."""
+    validators = {}
+    if "etag" in response.headers:
+        validators["if-none-match"] = response.headers["etag"]
+    if "last-modified" in response.headers:
+        validators["if-modified-since"] = response.headers["last-modified"]
+    return validators
+
+
+def apply_allow_list(schema: dict, allow_list: list) -> dict:
+    """Filter ``schema`` to the allow list, if one is given."""
+    if allow_list:
+        logging.info("Filtering API to allow list: %s", allow_list)
+        return filter_endpoints(schema, allow_list)
+    logging.info("No allow list provided. Proxying all endpoints.")
+    return schema
+
+
+def schema_operations(schema: dict) -> list:
+    """Return the ``[METHOD, PATH]`` pairs the proxy will route."""
+    return [
+        [method.upper(), path]
+        for path, methods in schema.get("paths", {}).items()
+        for method in methods
+        if method.lower() in HTTP_METHODS
+    ]
+
+
+def load_snapshot(path: str, url: str, allow_list: list) -> dict | None:
+    """Return the snapshot at ``path`` if it was made for this configuration."""
+    try:
+        with open(path, "rb") as snapshot_file:
+            snapshot = json.load(snapshot_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        logging.warning("Ignoring unreadable schema snapshot at %s", path)
+        return None
+
+    if (
+        snapshot.get("version") != SNAPSHOT_VERSION
+        or snapshot.get("url") != url
+        or snapshot.get("allow_list") != allow_list
+    ):
+        logging.info("Ignoring schema snapshot at %s made for another config", path)
+        return None
+    return snapshot
+
+
+def save_snapshot(
+    path: str, url: str, allow_list: list, schema: dict, validators: dict
+):
+    """Atomically write the filtered schema and its route table to ``path``."""
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "url": url,
+        "allow_list": allow_list,
+        "etag": validators.get("if-none-match"),
+        "last_modified": validators.get("if-modified-since"),
+        "operations": schema_operations(schema),
+        "schema": schema,
+    }
+    temporary_path = f"{path}.tmp"
+    try:
+        with open(temporary_path, "w") as snapshot_file:
+            json.dump(snapshot, snapshot_file, separators=(",", ":"))
+        os.replace(temporary_path, path)
+    except OSError:
+        logging.exception("Could not write schema snapshot to %s", path)
+        return
+    logging.debug("Saved schema snapshot to %s", path)
+
+
+def load_openapi_schema(
+    url: str,
+    allow_list: list,
+    snapshot_path: str | None = None,
+    timeout: float = 30.0,
+) -> tuple[dict, dict]:
+    """Load the allow-listed OpenAPI schema, preferring a local snapshot.
+
+    A snapshot made for the same URL and allow list is used without contacting
+    the schema host. Otherwise the schema is fetched, filtered and, with a
+    ``snapshot_path``, saved for the next start. Returns the schema and the
+    validators to fetch it conditionally with later.
+    """
+    if snapshot_path:
+        snapshot = load_snapshot(snapshot_path, url, allow_list)
+        if snapshot is not None:
+            logging.info(
+                "Loaded %d operations from schema snapshot at %s",
+                len(snapshot["operations"]),
+                snapshot_path,
+            )
+            validators = {
+                "if-none-match": snapshot.get("etag"),
+                "if-modified-since": snapshot.get("last_modified"),
+            }
+            return snapshot["schema"], {
+                name: value for name, value in validators.items() if value
+            }
+
+    schema, validators = fetch_schema(url, timeout=timeout)
+    schema = apply_allow_list(schema, allow_list)
+    if snapshot_path:
+        save_snapshot(snapshot_path, url, allow_list, schema, validators)
+    return schema, validators
+
+
+class SchemaReloader:
+    """Refetch the OpenAPI schema and hand changed versions to ``on_change``.
+
+    Reloads use conditional requests, so an unchanged schema costs a 304 from
+    the schema host. They run on a timer when ``interval`` is set, and on
+    demand through ``reload`` and ``trigger``. Concurrent reloads share one
+    fetch. With a ``snapshot_path``, the schema may have been loaded from a
+    stale snapshot, so it is reloaded once in the background when started.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        allow_list: list,
+        schema: dict,
+        on_change: Callable[[dict], None],
+        validators: dict | None = None,
+        snapshot_path: str | None = None,
+        interval: float = 0.0,
+        timeout: float = 30.0,
+    ):
+        self.url = url
+        self.allow_list = allow_list
+        self.schema = schema
+        self.on_change = on_change
+        self.validators = validators or {}
+        self.snapshot_path = snapshot_path
+        self.interval = interval
+        self.timeout = timeout
+        self.reloads = 0
+        self._inflight: asyncio.Task | None = None
+        self._poller: asyncio.Task | None = None
+
+    def start(self):
+        """Revalidate a snapshot and start polling, if an interval is configured."""
+        if self.snapshot_path:
+            self.trigger()
+        if self.interval > 0 and self._poller is None:
+            self._poller = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        """Stop polling and wait for a running reload to finish."""
+        if self._poller is not None:
+            self._poller.cancel()
+            await asyncio.gather(self._poller, return_exceptions=True)
+            self._poller = None
+        if self._inflight is not None:
+            await asyncio.gather(self._inflight, return_exceptions=True)
+
+    def trigger(self):
+        """Schedule a reload without waiting for it, e.g. from a signal handler."""
+        task = asyncio.ensure_future(self.reload())
+        task.add_done_callback(self._log_failure)
+
+    async def reload(self) -> bool:
+        """Reload the schema, returning whether the proxied routes changed."""
+        if self._inflight is None:
+            self._inflight = asyncio.create_task(self._reload())
+            self._inflight.add_done_callback(consume_exception)
+            self._inflight.add_done_callback(self._forget)
+        return await asyncio.shield(self._inflight)
+
+    async def _reload(self) -> bool:
+        schema, validators = await asyncio.to_thread(
+            fetch_schema, self.url, self.validators, self.timeout
+        )
+        self.validators = validators
+        if schema is None:
+            return False
+        schema = await asyncio.to_thread(apply_allow_list, schema, self.allow_list)
+        if schema == self.schema:
+            logging.debug("OpenAPI schema changed, but not the proxied operations.")
+            return False
+
+        self.on_change(schema)
+        self.schema = schema
+        self.reloads += 1
+        logging.info(
+            "Reloaded OpenAPI schema with %d operations",
+            len(schema_operations(schema)),
+        )
+        if self.snapshot_path:
+            save_snapshot(
+                self.snapshot_path, self.url, self.allow_list, schema, validators
+            )
+        return True
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reload()
+            except Exception:
+                logging.exception("Failed to reload OpenAPI schema from %s", self.url)
+
+    def _forget(self, task: asyncio.Task):
+        self._inflight = None
+
+    def _log_failure(self, task: asyncio.Future):
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(
+                "Failed to reload OpenAPI schema from %s",
+                self.url,
+                exc_info=task.exception(),
+            )
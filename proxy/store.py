@@ -0,0 +1,232 @@
+import logging
+import math
+import struct
+
+from .cache import CachedResponse, CacheStore, MemoryStore
+from .resp import RespError, RespPool
+
+# Entry layout version, status, stored_at, expires_at, the two stale windows,
+# header count, vary count, variant count and body length, followed by the
+# headers, the vary values and the variants, each length-prefixed, and
+# finally the body.
+ENTRY_HEADER = struct.Struct("<BHddddHHBI")
+PAIR_HEADER = struct.Struct("<HI")
+VARIANT_HEADER = struct.Struct("<BI")
+# Version 3 has the layout of version 2, but earlier entries may have been
+# cached without regard to the request's credentials, so are never loaded.
+ENTRY_VERSION = 3
+# Stands for a vary value of None, a request header that was absent.
+ABSENT = 0xFFFFFFFF
+# Bytes of memory in which each worker keeps the entries of a shared store it
+# uses, when no size is configured.
+NEAR_MAX_BYTES = 16 << 20
+
+
+def dumps_entry(entry: CachedResponse) -> bytes:
+    """Serialise ``entry``, with its compressed variants, to compact bytes."""
+    parts = [
+        ENTRY_HEADER.pack(
+            ENTRY_VERSION,
+            entry.status_code,
+            entry.stored_at,
+            entry.expires_at,
+            entry.stale_while_revalidate,
+            entry.stale_if_error,
+            len(entry.headers),
+            len(entry.vary),
+            len(entry.variants),
+            len(entry.body),
+        )
+    ]
+    for name, value in entry.headers:
+        parts += [PAIR_HEADER.pack(len(name), len(value)), name, value]
+    for name, value in entry.vary.items():
+        name = name.encode("latin-1")
+        if value is None:
+            parts += [PAIR_HEADER.pack(len(name), ABSENT), name]
+        else:
+            value = value.encode("latin-1")
+            parts += [PAIR_HEADER.pack(len(name), len(value)), name, value]
+    for encoding, variant in entry.variants.items():
+        data = dumps_entry(variant)
+        parts += [VARIANT_HEADER.pack(len(encoding), len(data)), encoding.encode()]
+        parts.append(data)
+    parts.append(entry.body)
+    return b"".join(parts)
+
+
+def loads_entry(data, copy: bool = True) -> CachedResponse:
+    """Return the entry serialised by dumps_entry as ``data``.
+
+    Without ``copy``, the bodies of the entry and its variants are views of
+    ``data`` rather than copies of them.
+    """
+    view = memoryview(data)
+    (
+        version,
+        status_code,
+        stored_at,
+        expires_at,
+        stale_while_revalidate,
+        stale_if_error,
+        header_count,
+        vary_count,
+        variant_count,
+        body_length,
+    ) = ENTRY_HEADER.unpack_from(view)
+    if version != ENTRY_VERSION:
+        raise ValueError(f"Unknown cache entry version {version}")
+    offset = ENTRY_HEADER.size
+
+    def pair():
+        nonlocal offset
+        name_length, value_length = PAIR_HEADER.unpack_from(view, offset)
+        offset += PAIR_HEADER.size + name_length
+        name = bytes(view[offset - name_length : offset])
+        if value_length == ABSENT:
+            return name, None
+        offset += value_length
+        return name, bytes(view[offset - value_length : offset])
+
+    headers = [pair() for _ in range(header_count)]
+    vary = {}
+    for _ in range(vary_count):
+        name, value = pair()
+        vary[name.decode("latin-1")] = (
+            None if value is None else value.decode("latin-1")
+        )
+    variants = {}
+    for _ in range(variant_count):
+        encoding_length, length = VARIANT_HEADER.unpack_from(view, offset)
+        offset += VARIANT_HEADER.size + encoding_length + length
+        encoding = bytes(view[offset - length - encoding_length : offset - length])
+        variants[encoding.decode()] = loads_entry(
+            view[offset - length : offset], copy=copy
+        )
+    if len(view) - offset != body_length:
+        raise ValueError("Truncated cache entry")
+    return CachedResponse(
+        status_code=status_code,
+        headers=headers,
+        body=bytes(view[offset:]) if copy else view[offset:],
+        stored_at=stored_at,
+        expires_at=expires_at,
+        vary=vary,
+        variants=variants,
+        stale_while_revalidate=stale_while_revalidate,
+        stale_if_error=stale_if_error,
+    )
+
+
+class RedisStore(CacheStore):
+    """Keep entries in a Redis or Valkey server shared by all proxies.
+
+    Entries are stored serialised by dumps_entry under ``prefix`` plus their
+    key, expiring after their ``ttl``; bounding the memory they use is left
+    to the server's ``maxmemory`` policy. Failing to reach the server counts
+    as a miss and is logged, so the proxy keeps serving from the origin.
+    """
+
+    def __init__(self, pool: RespPool, prefix: str = "openapi-rest-proxy:"):
+        self.pool = pool
+        self.prefix = prefix
+        self.errors = 0
+
+    async def get(self, key: str) -> CachedResponse | None:
+        """Return the entry stored under ``key``, if any."""
+        data = await self._execute("GET", self.prefix + key)
+        if data is None:
+            return None
+        try:
+            return loads_entry(data)
+        except (ValueError, struct.error, UnicodeDecodeError) as exc:
+            self._failed(exc)
+            return None
+
+    async def set(self, key: str, entry: CachedResponse, ttl: float):
+        """Store ``entry`` under ``key``, replacing any entry there."""
+        await self._execute("SET", self.prefix + key, dumps_entry(entry), *expiry(ttl))
+
+    async def update(self, key: str, entry: CachedResponse, ttl: float):
+        """Store ``entry`` under ``key``, unless the key expired in the meantime.
+
+        Another proxy may have stored a newer entry since this one was got,
+        which this then replaces: that is no worse than having got this entry
+        a little later, as it is still fresh enough to serve.
+        """
+        await self._execute(
+            "SET", self.prefix + key, dumps_entry(entry), *expiry(ttl), "XX"
+        )
+
+    async def delete(self, key: str):
+        """Remove the entry stored under ``key``, if any."""
+        await self._execute("DEL", self.prefix + key)
+
+    def stats(self) -> dict:
+        """Return the number of failed requests to the server."""
+        return {"store_errors": self.errors}
+
+    async def _execute(self, *args):
+        try:
+            return await self.pool.execute(*args)
+        except (OSError, TimeoutError, RespError) as exc:
+            self._failed(exc)
+            return None
+
+    def _failed(self, exc: Exception):
+        self.errors += 1
+        logging.warning(
+            "Cache store request failed: %s", str(exc) or type(exc).__name__
+        )
+
+
+def expiry(ttl: float) -> tuple:
+    """Return the ``SET`` arguments expiring a key after ``ttl`` seconds."""
+    return ("PX", max(math.ceil(ttl * 1000), 1))
+
+
+class TieredStore(CacheStore):
+    """Put a small ``near`` store in front of a shared ``far`` one.
+
+    Entries got from or stored in the far store are kept in the near store
+    for up to ``near_ttl`` seconds, so popular entries are served from
+    process memory, without a request to the far store, while changes made
+    by other proxies show up within ``near_ttl``.
+    """
+
+    def __init__(self, near: MemoryStore, far: CacheStore, near_ttl: float = 1.0):
+        self.near = near
+        self.far = far
+        self.near_ttl = near_ttl
+
+    async def get(self, key: str) -> CachedResponse | None:
+        """Return the entry from the near store, or else the far one."""
+        entry = await self.near.get(key)
+        if entry is None:
+            entry = await self.far.get(key)
+            if entry is not None:
+                await self.near.set(key, entry, self.near_ttl)
+        return entry
+
+    async def set(self, key: str, entry: CachedResponse, ttl: float):
+        """Store ``entry`` in both stores."""
+        await self.far.set(key, entry, ttl)
+        await self.near.set(key, entry, min(ttl, self.near_ttl))
+
+    async def update(self, key: str, entry: CachedResponse, ttl: float):
+        """Store the changed ``entry`` in both stores, where it is still kept.
+
+        The far store is updated even when the near one no longer holds the
+        entry, so that other proxies get its compressed variants.
+        """
+        await self.far.update(key, entry, ttl)
+        await self.near.update(key, entry, min(ttl, self.near_ttl))
+
+    async def delete(self, key: str):
+        """Remove the entry from both stores."""
+        await self.near.delete(key)
+        await self.far.delete(key)
+
+    def stats(self) -> dict:
+        """Return the counters of both stores, sizes being those of the near one."""
+        return {**self.far.stats(), **self.near.stats()}
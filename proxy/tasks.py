@@ -0,0 +1,12 @@
+import asyncio
+
+
+def consume_exception(future: asyncio.Future):
+    """Retrieve the exception of a finished shared future.
+
+    Added as a done-callback to futures that several callers may await, or
+    none: once every waiter has gone, asyncio would otherwise log the failure
+    as "exception was never retrieved".
+    """
+    if not future.cancelled():
+        future.exception()
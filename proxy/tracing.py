@@ -0,0 +1,125 @@
+import time
+from collections.abc import Awaitable
+from contextlib import contextmanager
+
+from fastapi import Request
+from httpx import Request as UpstreamRequest
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    ConsoleSpanExporter,
+    SimpleSpanProcessor,
+    SpanExporter,
+)
+from opentelemetry.trace import SpanKind, StatusCode
+from opentelemetry.trace.propagation.tracecontext import (
+    TraceContextTextMapPropagator,
+)
+
+from .metrics import SERVER_TIMING_PHASES, RequestTimings
+
+
+def create_exporter(name: str, endpoint: str | None = None) -> SpanExporter:
+    """Return the span exporter called ``name``: ``console`` or ``otlp``.
+
+    The OTLP exporter sends spans over HTTP to ``endpoint``, or else to the
+    endpoint in the standard ``OTEL_EXPORTER_OTLP_*`` environment variables.
+    """
+    if name == "console":
+        return ConsoleSpanExporter()
+    if name == "otlp":
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+                OTLPSpanExporter,
+            )
+        except ImportError as exc:
+            raise ValueError(
+                "The otlp tracing exporter needs the proxy's otlp extra installed"
+            ) from exc
+        return OTLPSpanExporter(endpoint=endpoint)
+    raise ValueError(f"Unknown tracing exporter: {name!r}")
+
+
+class Tracing:
+    """Emit OpenTelemetry spans for proxied requests to a span ``exporter``.
+
+    Each request gets a server span, joining the client's trace if it sent a
+    W3C ``traceparent`` header, and each request to the origin a client span,
+    whose ``traceparent`` is passed on to the origin. Spans are exported in
+    batches from a background thread, or one by one as they end without
+    ``batch``, as suits an in-memory exporter in tests.
+    """
+
+    def __init__(
+        self,
+        exporter: SpanExporter,
+        service_name: str = "openapi-rest-proxy",
+        batch: bool = True,
+    ):
+        self.provider = TracerProvider(
+            resource=Resource.create({"service.name": service_name})
+        )
+        self.provider.add_span_processor(
+            BatchSpanProcessor(exporter) if batch else SimpleSpanProcessor(exporter)
+        )
+        self.tracer = self.provider.get_tracer("proxy")
+        self.propagator = TraceContextTextMapPropagator()
+
+    def shutdown(self):
+        """Export the spans still queued and stop exporting."""
+        self.provider.shutdown()
+
+    async def track(
+        self,
+        call: Awaitable,
+        request: Request,
+        method: str,
+        path: str,
+        timings: RequestTimings,
+    ):
+        """Await the proxied ``call`` in a server span for the operation."""
+        span = self.tracer.start_span(
+            f"{method} {path}",
+            context=self.propagator.extract(request.headers),
+            kind=SpanKind.SERVER,
+            start_time=wall_clock_ns(timings.started_at),
+            attributes={
+                "http.request.method": method,
+                "http.route": path,
+                "url.path": request.scope["path"],
+            },
+        )
+        try:
+            with trace.use_span(span):
+                response = await call
+            span.set_attribute("http.response.status_code", response.status_code)
+            if response.status_code >= 500:
+                span.set_status(StatusCode.ERROR)
+            return response
+        finally:
+            for phase in SERVER_TIMING_PHASES:
+                span.set_attribute(
+                    f"proxy.{phase}_ms", round(getattr(timings, phase) * 1000, 3)
+                )
+            span.end()
+
+    @contextmanager
+    def client_span(self, request: UpstreamRequest):
+        """Trace ``request`` to the origin, adding its ``traceparent`` header."""
+        with self.tracer.start_as_current_span(
+            request.method,
+            kind=SpanKind.CLIENT,
+            attributes={
+                "http.request.method": request.method,
+                "url.full": str(request.url),
+            },
+        ) as span:
+            self.propagator.inject(request.headers)
+            yield span
+
+
+def wall_clock_ns(perf_counter: float) -> int:
+    """Convert a ``time.perf_counter`` reading to nanoseconds since the epoch."""
+    return time.time_ns() - int((time.perf_counter() - perf_counter) * 1e9)
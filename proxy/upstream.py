@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import time
+
+from httpx import (
+    URL,
+    AsyncBaseTransport,
+    AsyncByteStream,
+    AsyncClient,
+    AsyncHTTPTransport,
+    HTTPError,
+    Limits,
+    Request,
+    Response,
+    Timeout,
+)
+
+
+def create_upstream_client(
+    max_connections: int = 100,
+    max_keepalive_connections: int = 20,
+    keepalive_expiry: float = 5.0,
+    http2: bool = False,
+    connect_timeout: float = 5.0,
+    read_timeout: float = 5.0,
+    write_timeout: float = 5.0,
+    pool_timeout: float = 5.0,
+    origin_pool: "OriginPool | None" = None,
+) -> AsyncClient:
+    """Create the pooled HTTP client shared by all requests to the origin.
+
+    With an ``origin_pool``, requests for the pool's first origin are spread
+    over all of its healthy origins.
+    """
+    logging.debug(
+        "Creating upstream client (max_connections=%s, keepalive=%s, http2=%s)",
+        max_connections,
+        max_keepalive_connections,
+        http2,
+    )
+    limits = Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry,
+    )
+    timeout = Timeout(
+        connect=connect_timeout,
+        read=read_timeout,
+        write=write_timeout,
+        pool=pool_timeout,
+    )
+    if origin_pool is None:
+        return AsyncClient(http2=http2, limits=limits, timeout=timeout)
+
+    transport = AsyncHTTPTransport(http2=http2, limits=limits)
+    return AsyncClient(
+        transport=BalancingTransport(transport, origin_pool), timeout=timeout
+    )
+
+
+class Origin:
+    """One origin base URL with its load and health."""
+
+    __slots__ = ("url", "weight", "outstanding", "failures", "healthy", "ejected_until")
+
+    def __init__(self, url: str, weight: float = 1.0):
+        self.url = url.rstrip("/")
+        self.weight = weight
+        self.outstanding = 0
+        self.failures = 0
+        self.healthy = True
+        self.ejected_until = 0.0
+
+    def available(self, now: float) -> bool:
+        """Return whether the origin may receive requests."""
+        return self.healthy and now >= self.ejected_until
+
+
+class OriginPool:
+    """Spread requests over several origins serving the same API.
+
+    Each request goes to the available origin with the fewest outstanding
+    requests relative to its weight. Origins failing ``failure_threshold``
+    requests in a row are ejected for ``ejection_time`` seconds (passive
+    checks), and with a ``health_check_path`` each origin is also probed every
+    ``health_check_interval`` seconds (active checks). When no origin is
+    available, requests are still spread over all of them rather than failed.
+    """
+
+    def __init__(
+        self,
+        urls: list,
+        weights: list | None = None,
+        failure_threshold: int = 3,
+        ejection_time: float = 30.0,
+        health_check_path: str | None = None,
+        health_check_interval: float = 10.0,
+        health_check_timeout: float = 2.0,
+    ):
+        weights = weights or [1.0] * len(urls)
+        self.origins = [
+            Origin(url, float(weight)) for url, weight in zip(urls, weights)
+        ]
+        self.failure_threshold = failure_threshold
+        self.ejection_time = ejection_time
+        self.health_check_path = health_check_path
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = health_check_timeout
+        self._turn = 0
+        self._task: asyncio.Task | None = None
+
+    @property
+    def base_url(self) -> str:
+        """Return the URL requests are addressed to before balancing."""
+        return self.origins[0].url
+
+    def acquire(self) -> Origin:
+        """Choose an origin for a request and count it as outstanding."""
+        now = time.monotonic()
+        candidates = [origin for origin in self.origins if origin.available(now)]
+        candidates = candidates or self.origins
+        # Start from a rotating position, so ties are spread evenly.
+        self._turn = (self._turn + 1) % len(candidates)
+        origin = min(
+            candidates[self._turn :] + candidates[: self._turn],
+            key=lambda origin: (origin.outstanding + 1) / origin.weight,
+        )
+        origin.outstanding += 1
+        return origin
+
+    def release(self, origin: Origin, failed: bool):
+        """Record the end of a request to ``origin`` and whether it failed."""
+        origin.outstanding -= 1
+        if not failed:
+            origin.failures = 0
+            return
+        origin.failures += 1
+        if origin.failures >= self.failure_threshold:
+            origin.failures = 0
+            origin.ejected_until = time.monotonic() + self.ejection_time
+            logging.warning(
+                "Ejecting origin %s for %ss after repeated failures",
+                origin.url,
+                self.ejection_time,
+            )
+
+    def start(self, client: AsyncClient):
+        """Start probing the origins with ``client``, if a path is configured."""
+        if self.health_check_path and self._task is None:
+            self._task = asyncio.create_task(self._health_check_loop(client))
+
+    async def stop(self):
+        """Stop probing the origins."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def check(self, client: AsyncClient):
+        """Probe every origin once and update whether it is healthy."""
+        await asyncio.gather(*(self._check(client, origin) for origin in self.origins))
+
+    async def _check(self, client: AsyncClient, origin: Origin):
+        try:
+            response = await client.get(
+                f"{origin.url}{self.health_check_path}",
+                timeout=self.health_check_timeout,
+                extensions={"balance": False},
+            )
+            healthy = response.status_code < 500
+        except HTTPError:
+            healthy = False
+        if healthy != origin.healthy:
+            logging.warning(
+                "Origin %s is now %s", origin.url, "healthy" if healthy else "unhealthy"
+            )
+        origin.healthy = healthy
+
+    async def _health_check_loop(self, client: AsyncClient):
+        while True:
+            await self.check(client)
+            await asyncio.sleep(self.health_check_interval)
+
+
+class BalancingTransport(AsyncBaseTransport):
+    """Send requests for an OriginPool's base URL to one of its origins."""
+
+    def __init__(self, transport: AsyncBaseTransport, pool: OriginPool):
+        self.transport = transport
+        self.pool = pool
+
+    async def handle_async_request(self, request: Request) -> Response:
+        """Rewrite the request to the chosen origin and track its outcome."""
+        url = str(request.url)
+        base_url = self.pool.base_url
+        if (
+            not request.extensions.get("balance", True)
+            or not url.startswith(base_url)
+            or url[len(base_url) : len(base_url) + 1] not in ("", "/", "?")
+        ):
+            return await self.transport.handle_async_request(request)
+
+        origin = self.pool.acquire()
+        if origin.url != base_url:
+            request.url = URL(f"{origin.url}{url[len(base_url) :]}")
+            request.headers["host"] = request.url.netloc.decode("ascii")
+        try:
+            response = await self.transport.handle_async_request(request)
+        except Exception:
+            self.pool.release(origin, failed=True)
+            raise
+        except BaseException:
+            # Interrupted before the origin answered: free its slot without a failure.
+            origin.outstanding -= 1
+            raise
+        response.stream = ReleasingStream(
+            response.stream,
+            lambda: self.pool.release(origin, failed=response.status_code >= 500),
+        )
+        return response
+
+    async def aclose(self):
+        """Close the underlying transport."""
+        await self.transport.aclose()
+
+
+class ReleasingStream(AsyncByteStream):
+    """A response stream that calls ``on_close`` once it has been closed."""
+
+    def __init__(self, stream: AsyncByteStream, on_close):
+        self.stream = stream
+        self.on_close = on_close
+
+    async def __aiter__(self):
+        """Yield the chunks of the wrapped stream."""
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self):
+        """Close the wrapped stream and report the request as finished."""
+        try:
+            await self.stream.aclose()
+        finally:
+            if self.on_close is not None:
+                self.on_close()
+                self.on_close = None
@@ -19,7 +19,8 @@ from proxy.app import app
 
 @pytest.fixture(scope="module")
 def client():
-    return TestClient(app)
+    with TestClient(app) as client:
+        yield client
 
 
 def test_read_root(client):
@@ -0,0 +1,46 @@
+import pytest
+from fastapi import Request
+
+
+@pytest.fixture
+def make_request():
+    """Return a factory of requests built from an ASGI scope.
+
+    ``headers`` are raw header pairs, or a dict of header values. The body is
+    received in ``body_chunks``.
+    """
+
+    def factory(
+        method="GET",
+        path="/pets",
+        query=b"",
+        headers=(),
+        client=None,
+        body_chunks=(),
+    ) -> Request:
+        chunks = list(body_chunks)
+
+        async def receive():
+            if chunks:
+                return {
+                    "type": "http.request",
+                    "body": chunks.pop(0),
+                    "more_body": True,
+                }
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        if isinstance(headers, dict):
+            headers = [(k.encode(), v.encode()) for k, v in headers.items()]
+        scope = {
+            "type": "http",
+            "method": method,
+            "path": path,
+            "query_string": query,
+            "headers": list(headers),
+            "path_params": {},
+        }
+        if client is not None:
+            scope["client"] = (client, 1234)
+        return Request(scope, receive)
+
+    return factory
@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+from proxy.resp import read_reply
+
+
+class RespServer:
+    """A stand-in for a Redis server, with just the commands the proxy uses."""
+
+    def __init__(self, password: str | None = None):
+        self.password = password
+        self.data: dict[bytes, tuple] = {}
+        self.commands: list[list] = []
+        self.connections = 0
+        self.server = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.sockets[0].getsockname()[:2]
+        credentials = f":{self.password}@" if self.password else ""
+        return f"redis://{credentials}{host}:{port}/2"
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self.serve, "127.0.0.1", 0)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def serve(self, reader, writer):
+        self.connections += 1
+        authenticated = self.password is None
+        try:
+            while True:
+                command = await read_reply(reader)
+                self.commands.append(command)
+                name = command[0].upper()
+                if name == b"AUTH":
+                    authenticated = command[-1].decode() == self.password
+                    reply = b"+OK\r\n" if authenticated else b"-WRONGPASS\r\n"
+                elif not authenticated:
+                    reply = b"-NOAUTH Authentication required.\r\n"
+                else:
+                    reply = self.execute(name, command[1:])
+                writer.write(reply)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            writer.close()
+
+    def execute(self, name: bytes, args: list) -> bytes:
+        if name == b"SELECT":
+            return b"+OK\r\n"
+        if name == b"GET":
+            value = self.get(args[0])
+            if value is None:
+                return b"$-1\r\n"
+            return b"$%d\r\n%s\r\n" % (len(value), value)
+        if name == b"SET":
+            key, value, *options = args
+            options = [option.upper() for option in options]
+            if b"XX" in options and self.get(key) is None:
+                return b"$-1\r\n"
+            expires_at = None
+            if b"PX" in options:
+                expires_at = time.time() + int(options[options.index(b"PX") + 1]) / 1000
+            self.data[key] = (value, expires_at)
+            return b"+OK\r\n"
+        if name == b"DEL":
+            return b":%d\r\n" % (self.data.pop(args[0], None) is not None)
+        return b"-ERR unknown command\r\n"
+
+    def get(self, key: bytes) -> bytes | None:
+        value, expires_at = self.data.get(key, (None, None))
+        if expires_at is not None and expires_at <= time.time():
+            return None
+        return value
@@ -0,0 +1,83 @@
+import io
+import json
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from proxy.accesslog import AccessLog
+from proxy.metrics import RequestTimings
+from proxy.proxy import create_proxy_handler
+
+
+def read_records(stream: io.StringIO) -> list:
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_records_are_written_as_json_in_the_background(make_request):
+    stream = io.StringIO()
+    access_log = AccessLog(stream=stream, name="test.access.json")
+    timings = RequestTimings()
+    timings.upstream = 0.002
+
+    access_log.start()
+    access_log.record(
+        make_request(path="/pets/1", client="10.0.0.7"),
+        "GET:/pets/{petId}",
+        404,
+        None,
+        time.perf_counter(),
+        timings,
+    )
+    access_log.stop()
+
+    [record] = read_records(stream)
+    assert record["operation"] == "GET:/pets/{petId}"
+    assert record["path"] == "/pets/1"
+    assert record["status"] == 404
+    assert record["client"] == "10.0.0.7"
+    assert record["upstream_ms"] == 2.0
+    assert "sample_rate" not in record
+
+
+def test_only_successful_requests_are_sampled(make_request):
+    stream = io.StringIO()
+    access_log = AccessLog(sample_rate=0.0, stream=stream, name="test.access.sample")
+
+    access_log.start()
+    for status_code in (200, 204, 503):
+        access_log.record(
+            make_request(), "GET:/pets", status_code, None, time.perf_counter()
+        )
+    access_log.stop()
+
+    assert [record["status"] for record in read_records(stream)] == [503]
+
+
+@pytest.mark.parametrize("status_code", [200, 502])
+def test_proxy_handler_logs_each_request(status_code):
+    async def origin(request: httpx.Request):
+        return httpx.Response(status_code, stream=httpx.ByteStream(b'{"id": 1}'))
+
+    stream = io.StringIO()
+    access_log = AccessLog(stream=stream, name=f"test.access.{status_code}")
+    app = FastAPI()
+    app.add_api_route(
+        "/pets/{petId}",
+        create_proxy_handler(
+            "GET", "/pets/{petId}", "http://o.test", access_log=access_log
+        ),
+    )
+    app.state.upstream_client = httpx.AsyncClient(transport=httpx.MockTransport(origin))
+
+    access_log.start()
+    with TestClient(app) as client:
+        client.get("/pets/1")
+    access_log.stop()
+
+    [record] = read_records(stream)
+    assert record["status"] == status_code
+    assert record["bytes"] == 9
+    assert record["duration_ms"] >= record["upstream_ms"] >= 0
@@ -0,0 +1,114 @@
+import asyncio
+
+import httpx
+import pytest
+
+from proxy.admission import AdmissionLimiter, AdmissionPolicy
+from proxy.proxy import guarded_proxy
+
+
+def test_policy_reads_schema_extensions():
+    policy = AdmissionPolicy(limit=10, queue_size=5).for_operation(
+        {"x-proxy-concurrency-limit": 2}
+    )
+
+    assert (policy.limit, policy.queue_size) == (2, 5)
+
+
+@pytest.mark.asyncio
+async def test_limiter_queues_then_sheds():
+    limiter = AdmissionLimiter(AdmissionPolicy(limit=1, queue_size=1))
+
+    assert await limiter.acquire()
+    queued = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    assert not await limiter.acquire()
+
+    limiter.release()
+    assert await queued
+    assert (limiter.in_flight, limiter.shed) == (1, 1)
+
+
+@pytest.mark.asyncio
+async def test_queued_requests_time_out():
+    limiter = AdmissionLimiter(
+        AdmissionPolicy(limit=1, queue_size=1, queue_timeout=0.01)
+    )
+
+    assert await limiter.acquire()
+    assert not await limiter.acquire()
+    limiter.release()
+    assert limiter.in_flight == 0
+
+
+def test_adaptive_limit_follows_latency():
+    limiter = AdmissionLimiter(AdmissionPolicy(limit=10, adaptive=True))
+
+    limiter.in_flight = 20
+    limiter.release(0.1)
+    for _ in range(10):
+        limiter.release(1.0)
+    assert int(limiter.limit) == 3
+
+    for _ in range(30):
+        limiter.release(0.1)
+    assert int(limiter.limit) > 3
+
+
+@pytest.mark.asyncio
+async def test_requests_over_the_limit_get_503(make_request):
+    release = asyncio.Event()
+
+    async def origin(request: httpx.Request):
+        await release.wait()
+        return httpx.Response(200, stream=httpx.ByteStream(b"ok"))
+
+    limiter = AdmissionLimiter(AdmissionPolicy(limit=1))
+    async with httpx.AsyncClient(transport=httpx.MockTransport(origin)) as client:
+        kwargs = {
+            "method": "GET",
+            "path": "/pets",
+            "origin_base_url": "http://o.test",
+            "client": client,
+            "admission": limiter,
+        }
+        first = asyncio.ensure_future(guarded_proxy(make_request(), **kwargs))
+        await asyncio.sleep(0)
+        shed = await guarded_proxy(make_request(), **kwargs)
+        release.set()
+        response = await first
+
+    assert shed.status_code == 503
+    assert shed.headers["retry-after"] == "1"
+    assert response.status_code == 200
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_streamed_requests_hold_their_slot_until_relayed(make_request):
+    async def origin(request: httpx.Request):
+        return httpx.Response(200, stream=httpx.ByteStream(b"ok"))
+
+    request = make_request()
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    limiter = AdmissionLimiter(AdmissionPolicy(limit=1))
+    async with httpx.AsyncClient(transport=httpx.MockTransport(origin)) as client:
+        response = await guarded_proxy(
+            request,
+            method="GET",
+            path="/pets",
+            origin_base_url="http://o.test",
+            client=client,
+            streaming=True,
+            admission=limiter,
+        )
+        assert limiter.in_flight == 1
+        scope = {**request.scope, "asgi": {"spec_version": "2.4"}}
+        await response(scope, request.receive, send)
+
+    assert b"".join(message.get("body", b"") for message in sent) == b"ok"
+    assert limiter.in_flight == 0
@@ -0,0 +1,158 @@
+import asyncio
+
+import httpx
+import pytest
+
+from proxy.auth import TokenManager, TokenRefreshError
+
+
+def token_endpoint(calls, fail=False, delay=0.0, token=None):
+    async def handler(request: httpx.Request):
+        calls.append(request)
+        await asyncio.sleep(delay)
+        if fail:
+            return httpx.Response(500)
+        return httpx.Response(
+            200,
+            json=token
+            or {
+                "access_token": f"token-{len(calls)}",
+                "expires_in": 3600,
+                "refresh_token": "refresh",
+            },
+        )
+
+    return handler
+
+
+def make_manager(client):
+    manager = TokenManager(
+        "https://auth.example.com/o/token/", "client", "secret", scope="read"
+    )
+    manager._client = client
+    return manager
+
+
+@pytest.mark.asyncio
+async def test_concurrent_callers_share_one_refresh():
+    calls = []
+    transport = httpx.MockTransport(token_endpoint(calls, delay=0.01))
+    async with httpx.AsyncClient(transport=transport) as client:
+        manager = make_manager(client)
+        results = await asyncio.gather(
+            *(manager.get_authorization() for _ in range(20))
+        )
+
+    assert len(calls) == 1
+    assert set(results) == {b"Bearer token-1"}
+    assert calls[0].headers["authorization"].startswith("Basic ")
+    assert manager.current == b"Bearer token-1"
+
+
+@pytest.mark.asyncio
+async def test_refresh_uses_refresh_token_grant():
+    calls = []
+    transport = httpx.MockTransport(token_endpoint(calls))
+    async with httpx.AsyncClient(transport=transport) as client:
+        manager = make_manager(client)
+        await manager.refresh()
+        assert await manager.refresh() == b"Bearer token-2"
+
+    assert b"grant_type=refresh_token" in calls[1].content
+    assert manager.refresh_count == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_refresh_backs_off():
+    calls = []
+    transport = httpx.MockTransport(token_endpoint(calls, fail=True))
+    async with httpx.AsyncClient(transport=transport) as client:
+        manager = make_manager(client)
+        with pytest.raises(httpx.HTTPStatusError):
+            await manager.get_authorization()
+        # Within the backoff window callers fail fast without a new request.
+        with pytest.raises(TokenRefreshError) as first:
+            await manager.get_authorization()
+        with pytest.raises(TokenRefreshError) as second:
+            await manager.get_authorization()
+
+    assert len(calls) == 1
+    assert manager.current is None
+    assert first.value is not second.value
+    assert isinstance(second.value.__cause__, httpx.HTTPStatusError)
+
+
+@pytest.mark.asyncio
+async def test_malformed_token_reply_backs_off():
+    calls = []
+    transport = httpx.MockTransport(token_endpoint(calls, token={"token": "x"}))
+    async with httpx.AsyncClient(transport=transport) as client:
+        manager = make_manager(client)
+        manager.start(client)
+        await asyncio.sleep(0.05)
+        await manager.stop()
+        with pytest.raises(TokenRefreshError):
+            await manager.get_authorization()
+
+    assert len(calls) == 1
+    assert manager.current is None
+
+
+@pytest.mark.asyncio
+async def test_unusable_token_file_backs_off(tmp_path):
+    calls = []
+    transport = httpx.MockTransport(token_endpoint(calls))
+    async with httpx.AsyncClient(transport=transport) as client:
+        manager = TokenManager(
+            "https://auth.example.com/o/token/",
+            "client",
+            "secret",
+            token_file=str(tmp_path / "missing" / "token.json"),
+        )
+        manager.start(client)
+        await asyncio.sleep(0.05)
+        await manager.stop()
+        with pytest.raises(TokenRefreshError) as error:
+            await manager.get_authorization()
+
+    assert calls == []
+    assert isinstance(error.value.__cause__, OSError)
+
+
+@pytest.mark.asyncio
+async def test_background_refresh_starts_and_stops():
+    calls = []
+    transport = httpx.MockTransport(token_endpoint(calls))
+    async with httpx.AsyncClient(transport=transport) as client:
+        manager = TokenManager("https://auth.example.com/o/token/", "c", "s")
+        manager.start(client)
+        await asyncio.sleep(0.01)
+        assert manager.current == b"Bearer token-1"
+        await manager.stop()
+
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_workers_share_token_through_file(tmp_path):
+    calls = []
+    transport = httpx.MockTransport(token_endpoint(calls))
+    token_file = str(tmp_path / "token.json")
+    async with httpx.AsyncClient(transport=transport) as client:
+        managers = [
+            TokenManager(
+                "https://auth.example.com/o/token/",
+                "client",
+                "secret",
+                token_file=token_file,
+            )
+            for _ in range(3)
+        ]
+        for manager in managers:
+            manager._client = client
+            assert await manager.refresh() == b"Bearer token-1"
+
+    assert len(calls) == 1
+    assert {manager.expires_at for manager in managers} == {managers[0].expires_at}
+    assert managers[0].refresh_count == 1
+    assert managers[2].refresh_count == 0
@@ -0,0 +1,333 @@
+import asyncio
+import time
+from unittest.mock import MagicMock
+
+import httpx
+import pytest
+from fastapi import Request
+
+from proxy.cache import (
+    CachedResponse,
+    CacheStore,
+    MemoryStore,
+    ResponseCache,
+    StalePolicy,
+    freshness_lifetime,
+    stale_windows,
+)
+from proxy.middleware import HeaderInjectionMiddleware
+from proxy.proxy import proxy
+
+
+def response(body=b"[]", headers=()):
+    return CachedResponse(status_code=200, headers=list(headers), body=body)
+
+
+def test_freshness_honours_origin_headers():
+    assert freshness_lifetime(response(headers=[(b"cache-control", b"max-age=30")]))
+    assert (
+        freshness_lifetime(
+            response(headers=[(b"cache-control", b"max-age=30")]), ttl=10
+        )
+        == 10
+    )
+    assert freshness_lifetime(response(), ttl=10) == 10
+    assert freshness_lifetime(response()) is None
+    assert (
+        freshness_lifetime(response(headers=[(b"cache-control", b"no-store")]), 10)
+        is None
+    )
+    assert freshness_lifetime(response(headers=[(b"vary", b"*")]), ttl=10) is None
+    assert (
+        freshness_lifetime(
+            response(headers=[(b"expires", b"Thu, 01 Jan 1970 00:00:00 GMT")]), 10
+        )
+        < 0
+    )
+
+
+@pytest.mark.asyncio
+async def test_cache_evicts_least_recently_used_by_bytes():
+    entry_size = response(body=b"x" * 100).size
+    cache = ResponseCache(max_bytes=entry_size * 2)
+
+    await cache.set("a", response(body=b"x" * 100), {}, ttl=60)
+    await cache.set("b", response(body=b"x" * 100), {}, ttl=60)
+    assert await cache.get("a", {}) is not None
+    await cache.set("c", response(body=b"x" * 100), {}, ttl=60)
+
+    assert await cache.get("b", {}) is None
+    assert await cache.get("a", {}) is not None
+    assert cache.stats() == {
+        "entries": 2,
+        "size": entry_size * 2,
+        "max_size": entry_size * 2,
+        "hits": 2,
+        "misses": 1,
+        "evictions": 1,
+        "revalidations": 0,
+        "stale": 0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_cache_respects_vary():
+    cache = ResponseCache(max_bytes=10_000)
+    await cache.set(
+        "a", response(headers=[(b"vary", b"Accept")]), {"accept": "json"}, ttl=60
+    )
+
+    assert await cache.get("a", {"accept": "json"}) is not None
+    assert await cache.get("a", {"accept": "xml"}) is None
+
+
+def test_stores_implement_every_operation():
+    class ReadOnlyStore(CacheStore):
+        async def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        ReadOnlyStore()
+    assert MemoryStore(0).stats()["entries"] == 0
+
+
+@pytest.fixture
+def proxy_get(make_request):
+    async def get(client, cache, headers=(), cache_ttl=60, stale=None):
+        return await proxy(
+            request=make_request(query=b"limit=1", headers=headers),
+            method="GET",
+            path="/pets",
+            origin_base_url="http://example.com",
+            client=client,
+            cache=cache,
+            cache_ttl=cache_ttl,
+            stale=stale,
+        )
+
+    return get
+
+
+def expire(cache, seconds_ago=1.0):
+    for entry, _, _ in cache.store._entries.values():
+        entry.expires_at = time.time() - seconds_ago
+
+
+@pytest.mark.asyncio
+async def test_proxy_serves_repeated_gets_from_cache(proxy_get):
+    calls = []
+
+    async def origin(request: httpx.Request):
+        calls.append(request)
+        return httpx.Response(200, stream=httpx.ByteStream(b'[{"id":1}]'))
+
+    cache = ResponseCache(max_bytes=10_000)
+    async with httpx.AsyncClient(transport=httpx.MockTransport(origin)) as client:
+        for _ in range(3):
+            response = await proxy_get(client, cache)
+            assert response.body == b'[{"id":1}]'
+
+    assert len(calls) == 1
+    assert calls[0].url == "http://example.com/pets?limit=1"
+    assert (b"age", b"0") in response.raw_headers
+    assert cache.hits == 2
+
+
+@pytest.mark.asyncio
+async def test_proxy_revalidates_stale_entries_with_origin(proxy_get):
+    calls = []
+
+    async def origin(request: httpx.Request):
+        calls.append(request)
+        if request.headers.get("if-none-match") == '"v1"':
+            return httpx.Response(304, headers={"etag": '"v1"'})
+        return httpx.Response(
+            200,
+            headers={"etag": '"v1"', "cache-control": "no-cache"},
+            stream=httpx.ByteStream(b'[{"id":1}]'),
+        )
+
+    cache = ResponseCache(max_bytes=10_000)
+    async with httpx.AsyncClient(transport=httpx.MockTransport(origin)) as client:
+        first = await proxy_get(client, cache, cache_ttl=None)
+        second = await proxy_get(client, cache, cache_ttl=None)
+
+    assert "if-none-match" not in calls[0].headers
+    assert calls[1].headers["if-none-match"] == '"v1"'
+    assert first.body == second.body == b'[{"id":1}]'
+    assert second.status_code == 200
+    assert cache.revalidations == 1
+
+
+@pytest.mark.asyncio
+async def test_proxy_answers_client_conditional_requests(proxy_get):
+    calls = []
+
+    async def origin(request: httpx.Request):
+        calls.append(request)
+        return httpx.Response(
+            200,
+            headers={"etag": 'W/"v1"', "content-type": "application/json"},
+            stream=httpx.ByteStream(b'[{"id":1}]'),
+        )
+
+    cache = ResponseCache(max_bytes=10_000)
+    conditional = [(b"if-none-match", b'"v0", "v1"')]
+    async with httpx.AsyncClient(transport=httpx.MockTransport(origin)) as client:
+        first = await proxy_get(client, cache, headers=conditional)
+        second = await proxy_get(client, cache, headers=conditional)
+        changed = await proxy_get(client, cache, headers=[(b"if-none-match", b'"v2"')])
+
+    assert len(calls) == 1
+    assert "if-none-match" not in calls[0].headers
+    assert first.status_code == second.status_code == 304
+    assert second.body == b""
+    assert second.raw_headers == [(b"etag", b'W/"v1"')]
+    assert changed.status_code == 200
+
+
+def test_stale_windows_prefer_the_policy_to_origin_directives():
+    swr = response(headers=[(b"cache-control", b"max-age=1, stale-while-revalidate=5")])
+    assert stale_windows(swr) == (5.0, 0.0)
+    assert stale_windows(swr, StalePolicy(while_revalidate=30)) == (30.0, 0.0)
+    assert stale_windows(swr, StalePolicy(if_error=60)) == (5.0, 60.0)
+    must_revalidate = response(headers=[(b"cache-control", b"must-revalidate")])
+    assert stale_windows(must_revalidate, StalePolicy(30, 60)) == (0.0, 0.0)
+    assert StalePolicy(1, 2).for_operation(
+        {"x-proxy-stale-if-error": 600}
+    ) == StalePolicy(1, 600)
+
+
+@pytest.mark.asyncio
+async def test_proxy_serves_stale_while_revalidating_in_the_background(proxy_get):
+    calls = []
+
+    async def origin(request: httpx.Request):
+        calls.append(request)
+        await asyncio.sleep(0)
+        return httpx.Response(200, stream=httpx.ByteStream(b"v%d" % len(calls)))
+
+    cache = ResponseCache(max_bytes=10_000)
+    stale = StalePolicy(while_revalidate=30)
+    async with httpx.AsyncClient(transport=httpx.MockTransport(origin)) as client:
+        await proxy_get(client, cache, stale=stale)
+        expire(cache)
+        served = [await proxy_get(client, cache, stale=stale) for _ in range(3)]
+        await asyncio.gather(*cache._refreshes.values())
+        refreshed = await proxy_get(client, cache, stale=stale)
+
+    assert [response.body for response in served] == [b"v1"] * 3
+    assert len(calls) == 2
+    assert cache.stale == 3
+    assert refreshed.body == b"v2"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("failure", ["status", "exception"])
+async def test_proxy_serves_stale_if_the_origin_fails(failure, proxy_get):
+    calls = []
+
+    async def origin(request: httpx.Request):
+        calls.append(request)
+        if len(calls) == 1:
+            return httpx.Response(200, stream=httpx.ByteStream(b'[{"id":1}]'))
+        if failure == "exception":
+            raise httpx.ConnectError("Connection refused", request=request)
+        return httpx.Response(503, stream=httpx.ByteStream(b"unavailable"))
+
+    cache = ResponseCache(max_bytes=10_000)
+    stale = StalePolicy(if_error=60)
+    async with httpx.AsyncClient(transport=httpx.MockTransport(origin)) as client:
+        await proxy_get(client, cache, stale=stale)
+        expire(cache)
+        served = await proxy_get(client, cache, stale=stale)
+        expire(cache, seconds_ago=120)
+        if failure == "exception":
+            with pytest.raises(httpx.ConnectError):
+                await proxy_get(client, cache, stale=stale)
+        else:
+            assert (await proxy_get(client, cache, stale=stale)).status_code == 503
+
+    assert served.status_code == 200
+    assert served.body == b'[{"id":1}]'
+    assert cache.stale == 1
+
+
+@pytest.mark.asyncio
+async def test_proxy_keeps_responses_to_different_credentials_apart(proxy_get):
+    calls = []
+
+    async def origin(request: httpx.Request):
+        calls.append(request)
+        user = request.headers["authorization"].removeprefix("Bearer ")
+        return httpx.Response(
+            200,
+            headers={"cache-control": "max-age=60"},
+            stream=httpx.ByteStream(user.encode()),
+        )
+
+    cache = ResponseCache(max_bytes=10_000)
+    async with httpx.AsyncClient(transport=httpx.MockTransport(origin)) as client:
+        bodies = [
+            (await proxy_get(client, cache, [(b"authorization", token)])).body
+            for token in (b"Bearer alice", b"Bearer bob", b"Bearer alice")
+        ]
+
+    assert bodies == [b"alice", b"bob", b"alice"]
+    assert len(calls) == 2
+    assert cache.hits == 1
+    assert not any("alice" in key for key in cache.store._entries)
+
+
+@pytest.mark.asyncio
+async def test_proxy_keys_entries_by_the_client_not_the_injected_token(make_request):
+    async def origin(request: httpx.Request):
+        calls.append(request.headers["authorization"])
+        return httpx.Response(
+            200,
+            headers={"cache-control": "max-age=60"},
+            stream=httpx.ByteStream(b"[]"),
+        )
+
+    async def app(scope, receive, send):
+        requests.append(Request(scope, receive))
+
+    calls, requests = [], []
+    token_manager = MagicMock(current=None)
+    middleware = HeaderInjectionMiddleware(app, {}, token_manager)
+    for token in (b"Bearer token-1", b"Bearer token-2"):
+        token_manager.current = token
+        await middleware(make_request().scope, None, None)
+
+    cache = ResponseCache(max_bytes=10_000)
+    async with httpx.AsyncClient(transport=httpx.MockTransport(origin)) as client:
+        for request in requests:
+            await proxy(
+                request, "GET", "/pets", "http://example.com", client, cache=cache
+            )
+
+    assert calls == ["Bearer token-1"]
+    assert cache.hits == 1
+    assert len(cache.store._entries) == 1
+
+
+@pytest.mark.asyncio
+async def test_proxy_does_not_cache_responses_setting_cookies(proxy_get):
+    calls = []
+
+    async def origin(request: httpx.Request):
+        calls.append(request)
+        return httpx.Response(
+            200,
+            headers={"cache-control": "max-age=60", "set-cookie": "session=1"},
+            stream=httpx.ByteStream(b"[]"),
+        )
+
+    cache = ResponseCache(max_bytes=10_000)
+    async with httpx.AsyncClient(transport=httpx.MockTransport(origin)) as client:
+        first = await proxy_get(client, cache)
+        await proxy_get(client, cache)
+
+    assert len(calls) == 2
+    assert (b"set-cookie", b"session=1") in first.raw_headers
+    assert cache.hits == 0
@@ -0,0 +1,50 @@
+import asyncio
+
+import httpx
+import pytest
+
+from proxy.coalesce import RequestCoalescer, coalesce_key
+from proxy.proxy import proxy
+
+
+def test_coalesce_key_ignores_query_order():
+    assert coalesce_key("GET", "/pets", "b=2&a=1", {}) == coalesce_key(
+        "GET", "/pets", "a=1&b=2", {}
+    )
+    assert coalesce_key("GET", "/pets", "", {"authorization": "a"}) != coalesce_key(
+        "GET", "/pets", "", {"authorization": "b"}
+    )
+
+
+@pytest.mark.asyncio
+async def test_identical_concurrent_gets_share_one_upstream_request(make_request):
+    calls = []
+
+    async def origin(request: httpx.Request):
+        calls.append(request)
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, stream=httpx.ByteStream(b"[]"))
+
+    coalescer = RequestCoalescer()
+    async with httpx.AsyncClient(transport=httpx.MockTransport(origin)) as client:
+
+        async def call(method, query):
+            return await proxy(
+                request=make_request(method, query=query),
+                method=method,
+                path="/pets",
+                origin_base_url="http://example.com",
+                client=client,
+                coalescer=coalescer,
+            )
+
+        responses = await asyncio.gather(
+            *(call("GET", b"a=1&b=2") for _ in range(5)),
+            call("GET", b"b=2&a=1"),
+            call("POST", b""),
+            call("POST", b""),
+        )
+
+    assert [response.status_code for response in responses] == [200] * 8
+    assert sorted(request.method for request in calls) == ["GET", "POST", "POST"]
+    assert coalescer.coalesced == 5
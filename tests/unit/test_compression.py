@@ -0,0 +1,117 @@
+import gzip
+
+import brotli
+import httpx
+import pytest
+
+from proxy.cache import CachedResponse, ResponseCache
+from proxy.compression import Compressor, parse_accept_encoding
+from proxy.proxy import proxy
+
+BODY = b'{"pets": [' + b'{"name": "Rex", "tag": "dog"}, ' * 100 + b"]}"
+
+
+def json_response(body: bytes = BODY, **headers) -> CachedResponse:
+    return CachedResponse(
+        status_code=200,
+        headers=[
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            *(
+                (name.replace("_", "-").encode(), value)
+                for name, value in headers.items()
+            ),
+        ],
+        body=body,
+    )
+
+
+def test_parse_accept_encoding():
+    assert parse_accept_encoding("gzip, br;q=0.5, zstd;q=0, *;q=x") == {
+        "gzip": 1.0,
+        "br": 0.5,
+        "zstd": 0.0,
+        "*": 0.0,
+    }
+
+
+def test_negotiation_honours_weights_and_preference():
+    compressor = Compressor(min_size=100)
+
+    assert compressor.negotiate(json_response(), "gzip, br, zstd") == "zstd"
+    assert compressor.negotiate(json_response(), "gzip, br;q=0.5") == "gzip"
+    assert compressor.negotiate(json_response(), "identity") is None
+    assert compressor.negotiate(json_response(b"{}"), "gzip") is None
+    assert compressor.negotiate(json_response(content_encoding=b"gzip"), "gzip") is None
+    assert (
+        compressor.negotiate(json_response(cache_control=b"no-transform"), "gzip")
+        is None
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("thread_min_size", [0, 1_000_000])
+async def test_compress_rewrites_headers(thread_min_size):
+    compressor = Compressor(min_size=100, thread_min_size=thread_min_size)
+
+    variant = await compressor.compress(
+        json_response(etag=b'"v1"', vary=b"Accept"), "br"
+    )
+
+    assert brotli.decompress(variant.body) == BODY
+    headers = dict(variant.headers)
+    assert headers[b"content-encoding"] == b"br"
+    assert headers[b"content-length"] == str(len(variant.body)).encode()
+    assert headers[b"etag"] == b'W/"v1"'
+    assert headers[b"vary"] == b"Accept, Accept-Encoding"
+
+
+def test_uncompressed_responses_vary_by_encoding():
+    compressor = Compressor()
+    small = json_response(b"{}", vary=b"Accept")
+    varied = compressor.uncompressed(small)
+
+    assert dict(varied.headers)[b"vary"] == b"Accept, Accept-Encoding"
+    assert dict(small.headers)[b"vary"] == b"Accept"
+    assert compressor.uncompressed(varied) is varied
+
+
+@pytest.mark.asyncio
+async def test_cached_responses_are_compressed_once(make_request):
+    origin_requests = []
+
+    async def origin(request: httpx.Request):
+        origin_requests.append(request)
+        return httpx.Response(
+            200,
+            headers={"content-type": "application/json", "cache-control": "max-age=60"},
+            stream=httpx.ByteStream(BODY),
+        )
+
+    cache = ResponseCache(1_000_000)
+    compressor = Compressor()
+    async with httpx.AsyncClient(transport=httpx.MockTransport(origin)) as client:
+        responses = [
+            await proxy(
+                make_request(headers=[(b"accept-encoding", accept_encoding)]),
+                "GET",
+                "/pets",
+                "http://o.test",
+                client=client,
+                cache=cache,
+                compressor=compressor,
+            )
+            for accept_encoding in (b"gzip", b"gzip, deflate", b"identity")
+        ]
+
+    assert len(origin_requests) == 1
+    assert origin_requests[0].headers["accept-encoding"] == "identity"
+    assert [gzip.decompress(response.body) for response in responses[:2]] == [
+        BODY,
+        BODY,
+    ]
+    assert responses[2].body == BODY
+    assert [response.headers["vary"] for response in responses] == [
+        "Accept-Encoding"
+    ] * 3
+    assert compressor.compressed == 1
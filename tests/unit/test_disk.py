@@ -0,0 +1,124 @@
+import os
+import time
+
+import httpx
+import pytest
+
+from proxy.cache import CachedResponse, MemoryStore, ResponseCache
+from proxy.disk import DiskStore
+from proxy.proxy import proxy
+from proxy.store import TieredStore, dumps_entry
+
+
+def entry(body=b'{"id": 1}', **kwargs):
+    return CachedResponse(
+        status_code=200,
+        headers=[(b"content-type", b"application/json"), (b"etag", b'"v1"')],
+        body=body,
+        **kwargs,
+    )
+
+
+@pytest.mark.asyncio
+async def test_entries_are_mapped_back_and_survive_a_restart(tmp_path):
+    store = DiskStore(str(tmp_path), max_bytes=10_000)
+    original = entry(
+        stored_at=1.5,
+        expires_at=61.5,
+        variants={"gzip": entry(b"\x1f\x8b")},
+    )
+    await store.set("a", original, ttl=60)
+    store.close()
+
+    store = DiskStore(str(tmp_path), max_bytes=10_000)
+    stored = await store.get("a")
+
+    assert stored == original
+    assert isinstance(stored.body, memoryview)
+    assert isinstance(stored.variants["gzip"].body, memoryview)
+    assert store.stats()["disk_entries"] == 1
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_entries_are_evicted_by_bytes(tmp_path):
+    store = DiskStore(str(tmp_path), max_bytes=2_500)
+    await store.set("a", entry(b"a" * 1000), ttl=60)
+    await store.set("b", entry(b"b" * 1000), ttl=60)
+    store.index.execute("UPDATE entries SET used_at = 0 WHERE key = 'b'")
+    await store.get("a")
+    await store.set("c", entry(b"c" * 1000), ttl=60)
+    await store.set("huge", entry(b"h" * 3000), ttl=60)
+    await store.set("expired", entry(), ttl=-1)
+
+    assert await store.get("b") is None
+    assert await store.get("huge") is None
+    assert await store.get("expired") is None
+    assert (await store.get("c")).body == b"c" * 1000
+    stats = store.stats()
+    assert stats["disk_entries"] == 2
+    assert stats["disk_evictions"] == 1
+    assert stats["disk_size"] <= 2_500
+    assert (stats["disk_entries"], stats["disk_size"]) == store.index.execute(
+        "SELECT COUNT(*), SUM(size) FROM entries"
+    ).fetchone()
+    # Only the index and the files of the two entries are left.
+    assert len([name for name in os.listdir(tmp_path) if len(name) == 32]) == 2
+
+
+@pytest.mark.asyncio
+async def test_totals_are_counted_for_indexes_without_them(tmp_path):
+    store = DiskStore(str(tmp_path), max_bytes=10_000)
+    await store.set("a", entry(), ttl=60)
+    store.index.executescript(
+        "DROP TRIGGER entries_inserted; DROP TRIGGER entries_deleted;DROP TABLE totals;"
+    )
+    store.close()
+
+    store = DiskStore(str(tmp_path), max_bytes=10_000)
+    await store.set("b", entry(), ttl=60)
+
+    assert store.stats()["disk_entries"] == 2
+    assert store.stats()["disk_size"] == 2 * len(dumps_entry(entry()))
+
+
+@pytest.mark.asyncio
+async def test_update_does_not_restore_removed_entries(tmp_path):
+    store = DiskStore(str(tmp_path), max_bytes=10_000)
+    await store.update("a", entry(), ttl=60)
+    await store.set("b", entry(), ttl=60)
+    await store.delete("b")
+
+    assert await store.get("a") is None
+    assert await store.get("b") is None
+    assert store.stats()["disk_entries"] == 0
+    assert [name for name in os.listdir(tmp_path) if len(name) == 32] == []
+
+
+@pytest.mark.asyncio
+async def test_proxy_serves_hits_from_disk(tmp_path, make_request):
+    calls = []
+
+    async def origin(request: httpx.Request):
+        calls.append(request)
+        return httpx.Response(
+            200,
+            headers={"cache-control": "max-age=60"},
+            stream=httpx.ByteStream(b'[{"id":1}]'),
+        )
+
+    request = make_request()
+    store = DiskStore(str(tmp_path), max_bytes=10_000)
+    cache = ResponseCache(store=TieredStore(MemoryStore(0), store, near_ttl=0))
+    async with httpx.AsyncClient(transport=httpx.MockTransport(origin)) as client:
+        first, second = [
+            await proxy(request, "GET", "/pets", "http://o.test", client, cache=cache)
+            for _ in range(2)
+        ]
+
+    assert len(calls) == 1
+    assert first.body == second.body == b'[{"id":1}]'
+    assert isinstance(second.body, memoryview)
+    assert cache.hits == 1
+    assert store.stats()["store_errors"] == 0
+    [(expires_at,)] = store.index.execute("SELECT expires_at FROM entries")
+    assert expires_at > time.time() + 30
@@ -0,0 +1,99 @@
+import httpx
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from proxy.dispatch import RouteTrie
+from proxy.proxy import create_proxy_routes
+
+
+def test_trie_matches_static_before_templated_segments():
+    trie = RouteTrie()
+    trie.add("/pets", "GET", "list")
+    trie.add("/pets/{petId}", "GET", "get")
+    trie.add("/pets/mine", "GET", "mine")
+    trie.add("/pets/{petId}/photos/{name}.{ext}", "GET", "photo")
+
+    assert trie.match("/pets", "GET")[:2] == ("list", {})
+    assert trie.match("/pets/mine", "GET")[:2] == ("mine", {})
+    assert trie.match("/pets/42", "GET")[:2] == ("get", {"petId": "42"})
+    assert trie.match("/pets/42/photos/cat.png", "GET")[:2] == (
+        "photo",
+        {"petId": "42", "name": "cat", "ext": "png"},
+    )
+    assert trie.match("/pets/42/owners", "GET") is None
+    assert trie.match("/owners", "GET") is None
+
+
+def test_trie_binds_parameter_names_per_template():
+    trie = RouteTrie()
+    trie.add("/users/{id}", "GET", "user")
+    trie.add("/users/{userId}/posts", "GET", "posts")
+    trie.add("/users/{name}", "DELETE", "delete")
+
+    assert trie.match("/users/7", "GET")[:2] == ("user", {"id": "7"})
+    assert trie.match("/users/7/posts", "GET")[:2] == ("posts", {"userId": "7"})
+    assert trie.match("/users/7", "DELETE")[:2] == ("delete", {"name": "7"})
+
+
+def test_trie_falls_through_static_segments_without_the_method():
+    trie = RouteTrie()
+    trie.add("/pets/mine", "GET", "mine")
+    trie.add("/pets/{petId}", "DELETE", "delete")
+
+    assert trie.match("/pets/mine", "DELETE")[:2] == ("delete", {"petId": "mine"})
+    endpoint, _, allowed_methods = trie.match("/pets/mine", "POST")
+    assert endpoint is None
+    assert list(allowed_methods) == ["GET"]
+
+
+def test_trie_routing_dispatches_proxied_operations():
+    schema = {
+        "paths": {
+            "/pets": {"get": {}, "parameters": []},
+            "/pets/{petId}": {"get": {}},
+        }
+    }
+
+    def origin(request: httpx.Request):
+        return httpx.Response(200, stream=httpx.ByteStream(request.url.path.encode()))
+
+    app = FastAPI()
+    create_proxy_routes(app.router, schema, "http://example.com", trie_routing=True)
+    app.state.upstream_client = httpx.AsyncClient(transport=httpx.MockTransport(origin))
+    client = TestClient(app)
+
+    assert client.get("/pets/42").text == "/pets/42"
+    assert client.get("/pets").text == "/pets"
+    assert client.get("/owners").status_code == 404
+    response = client.post("/pets")
+    assert response.status_code == 405
+    assert response.headers["allow"] == "GET"
+
+
+def test_trie_routing_accepts_what_the_default_router_does():
+    schema = {
+        "paths": {
+            "/users/{id}": {"get": {}},
+            "/users/{userId}/posts": {"get": {}},
+            "/pets/mine": {"get": {}},
+            "/pets/{petId}": {"delete": {}},
+        }
+    }
+
+    def origin(request: httpx.Request):
+        return httpx.Response(200, stream=httpx.ByteStream(request.url.path.encode()))
+
+    for trie_routing in (False, True):
+        app = FastAPI()
+        create_proxy_routes(
+            app.router, schema, "http://example.com", trie_routing=trie_routing
+        )
+        app.state.upstream_client = httpx.AsyncClient(
+            transport=httpx.MockTransport(origin)
+        )
+        client = TestClient(app)
+
+        assert client.get("/users/7").text == "/users/7"
+        assert client.get("/users/7/posts").text == "/users/7/posts"
+        assert client.delete("/pets/mine").text == "/pets/mine"
+        assert client.get("/pets/mine").text == "/pets/mine"
@@ -1,8 +1,11 @@
+import gzip
 import os
-from unittest.mock import AsyncMock, MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock
 
+import httpx
 import pytest
 from fastapi import Request
+from fastapi.responses import StreamingResponse
 from fastapi.routing import APIRouter
 
 os.environ["OPENAPI_SCHEMA_URL"] = "http://example.com/openapi.yaml"
@@ -12,6 +15,7 @@ from proxy.proxy import (
     create_proxy_routes,
     proxy,
 )
+from proxy.upstream import create_upstream_client
 
 
 def test_create_proxy_routes():
@@ -26,35 +30,40 @@ def test_create_proxy_routes():
     assert "/pets/{petId}" in routes
 
 
+def mock_upstream_client():
+    mock_response = httpx.Response(
+        200,
+        headers={"content-type": "application/json"},
+        stream=httpx.ByteStream(b'{"result": "success"}'),
+    )
+
+    client = MagicMock()
+    client.send = AsyncMock(return_value=mock_response)
+    return client
+
+
 @pytest.mark.asyncio
 async def test_proxy_with_path_parameters():
     """Test that path parameters are correctly substituted in the proxy URL."""
     mock_request = MagicMock(spec=Request)
     mock_request.path_params = {"petId": "123", "ownerId": "456"}
     mock_request.query_params = {}
+    mock_request.scope = {"query_string": b""}
     mock_request.headers = {"content-type": "application/json"}
     mock_request.body = AsyncMock(return_value=b"")
+    client = mock_upstream_client()
 
-    with patch("proxy.proxy.AsyncClient") as mock_client:
-        mock_response = MagicMock()
-        mock_response.text = '{"result": "success"}'
-        mock_response.status_code = 200
-        mock_response.headers = {"content-type": "application/json"}
-
-        mock_client.return_value.__aenter__.return_value.request = AsyncMock(
-            return_value=mock_response
-        )
-
-        await proxy(
-            request=mock_request,
-            method="GET",
-            path="/pets/{petId}/owners/{ownerId}",
-            origin_base_url="http://example.com",
-        )
+    await proxy(
+        request=mock_request,
+        method="GET",
+        path="/pets/{petId}/owners/{ownerId}",
+        origin_base_url="http://example.com",
+        client=client,
+    )
 
-        mock_client.return_value.__aenter__.return_value.request.assert_called_once()
-        call_args = mock_client.return_value.__aenter__.return_value.request.call_args
-        assert call_args[1]["url"] == "http://example.com/pets/123/owners/456"
+    client.build_request.assert_called_once()
+    call_args = client.build_request.call_args
+    assert call_args[1]["url"] == "http://example.com/pets/123/owners/456"
 
 
 @pytest.mark.asyncio
@@ -63,26 +72,116 @@ async def test_proxy_without_path_parameters():
     mock_request = MagicMock(spec=Request)
     mock_request.path_params = {}
     mock_request.query_params = {}
+    mock_request.scope = {"query_string": b""}
     mock_request.headers = {"content-type": "application/json"}
     mock_request.body = AsyncMock(return_value=b"")
+    client = mock_upstream_client()
+
+    await proxy(
+        request=mock_request,
+        method="GET",
+        path="/pets",
+        origin_base_url="http://example.com",
+        client=client,
+    )
+
+    client.build_request.assert_called_once()
+    call_args = client.build_request.call_args
+    assert call_args[1]["url"] == "http://example.com/pets"
+
 
-    with patch("proxy.proxy.AsyncClient") as mock_client:
-        mock_response = MagicMock()
-        mock_response.text = '{"result": "success"}'
-        mock_response.status_code = 200
-        mock_response.headers = {"content-type": "application/json"}
+@pytest.mark.asyncio
+async def test_upstream_client_is_pooled():
+    """Test that the shared upstream client carries the configured pool."""
+    client = create_upstream_client(
+        max_connections=7,
+        max_keepalive_connections=3,
+        keepalive_expiry=12.5,
+        read_timeout=9.0,
+    )
+    async with client:
+        pool = client._transport._pool
+        assert pool._max_connections == 7
+        assert pool._max_keepalive_connections == 3
+        assert pool._keepalive_expiry == 12.5
+        assert client.timeout.read == 9.0
+
+
+@pytest.mark.asyncio
+async def test_proxy_streaming_relays_bodies_in_chunks(make_request):
+    """Test that streaming mode forwards the upload and relays raw chunks."""
+    received = {}
+
+    async def origin(request: httpx.Request):
+        received["body"] = b"".join([chunk async for chunk in request.stream])
+        received["headers"] = request.headers
+        return httpx.Response(
+            200,
+            headers={"content-type": "application/json"},
+            stream=httpx.ByteStream(b'[{"id": 1}]'),
+        )
+
+    request = make_request(
+        method="POST",
+        path="/pets",
+        headers={"content-length": "13", "content-type": "application/json"},
+        body_chunks=[b'{"name":', b' "a"}'],
+    )
+    async with httpx.AsyncClient(transport=httpx.MockTransport(origin)) as client:
+        response = await proxy(
+            request=request,
+            method="POST",
+            path="/pets",
+            origin_base_url="http://example.com",
+            client=client,
+            streaming=True,
+        )
+        assert isinstance(response, StreamingResponse)
+        body = b"".join([chunk async for chunk in response.body_iterator])
 
-        mock_client.return_value.__aenter__.return_value.request = AsyncMock(
-            return_value=mock_response
+    assert received["body"] == b'{"name": "a"}'
+    assert received["headers"]["content-length"] == "13"
+    assert "transfer-encoding" not in received["headers"]
+    assert response.status_code == 200
+    assert body == b'[{"id": 1}]'
+
+
+@pytest.mark.asyncio
+async def test_proxy_passes_through_raw_bytes_and_headers(make_request):
+    """Test that encoded bodies and repeated headers reach the client as-is."""
+    gzipped = gzip.compress(b'{"result": "success"}')
+    received = {}
+
+    async def origin(request: httpx.Request):
+        received["headers"] = request.headers
+        return httpx.Response(
+            200,
+            headers=[
+                ("content-type", "application/json"),
+                ("content-encoding", "gzip"),
+                ("set-cookie", "a=1"),
+                ("set-cookie", "b=2"),
+                ("connection", "keep-alive"),
+            ],
+            stream=httpx.ByteStream(gzipped),
         )
 
-        await proxy(
-            request=mock_request,
+    request = make_request(path="/pets")
+    async with httpx.AsyncClient(transport=httpx.MockTransport(origin)) as client:
+        response = await proxy(
+            request=request,
             method="GET",
             path="/pets",
             origin_base_url="http://example.com",
+            client=client,
         )
 
-        mock_client.return_value.__aenter__.return_value.request.assert_called_once()
-        call_args = mock_client.return_value.__aenter__.return_value.request.call_args
-        assert call_args[1]["url"] == "http://example.com/pets"
+    assert received["headers"]["accept-encoding"] == "identity"
+    assert response.body == gzipped
+    assert response.raw_headers == [
+        (b"content-type", b"application/json"),
+        (b"content-encoding", b"gzip"),
+        (b"set-cookie", b"a=1"),
+        (b"set-cookie", b"b=2"),
+        (b"content-length", str(len(gzipped)).encode()),
+    ]
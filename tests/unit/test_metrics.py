@@ -0,0 +1,86 @@
+import os
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from prometheus_client import generate_latest
+
+from proxy.metrics import (
+    DURATION_BUCKETS,
+    Histogram,
+    ProxyMetrics,
+    RequestTimings,
+    SharedMetrics,
+)
+from proxy.proxy import create_proxy_routes
+
+
+def test_histogram_counts_values_in_inclusive_buckets():
+    histogram = Histogram()
+    histogram.observe(DURATION_BUCKETS[0])
+    histogram.observe(0.3)
+    histogram.observe(60.0)
+
+    cumulative = dict(histogram.cumulative())
+    assert cumulative[str(DURATION_BUCKETS[0])] == 1
+    assert cumulative["0.25"] == 1
+    assert cumulative["0.5"] == 2
+    assert cumulative["+Inf"] == 3
+    assert histogram.sum == pytest.approx(DURATION_BUCKETS[0] + 60.3)
+
+
+def test_metrics_record_proxied_operations():
+    schema = {"paths": {"/pets/{petId}": {"get": {}}}}
+
+    def origin(request: httpx.Request):
+        status_code = 404 if request.url.path.endswith("/0") else 200
+        return httpx.Response(status_code, stream=httpx.ByteStream(b"pet"))
+
+    metrics = ProxyMetrics()
+    app = FastAPI()
+    create_proxy_routes(app.router, schema, "http://example.com", metrics=metrics)
+    app.state.upstream_client = httpx.AsyncClient(transport=httpx.MockTransport(origin))
+    metrics.upstream_client = app.state.upstream_client
+    client = TestClient(app)
+
+    client.get("/pets/1")
+    client.get("/pets/2")
+    client.get("/pets/0")
+
+    operation = metrics.operation("GET", "/pets/{petId}")
+    assert operation.responses == [0, 2, 0, 1, 0]
+    assert operation.in_flight == 0
+
+    exposition = generate_latest(metrics.registry).decode()
+    labels = 'method="GET",path="/pets/{petId}"'
+    assert f'proxy_requests_total{{{labels},status="2xx"}} 2.0' in exposition
+    assert f'proxy_requests_total{{{labels},status="4xx"}} 1.0' in exposition
+    assert f"proxy_request_duration_seconds_count{{{labels}}} 3.0" in exposition
+    assert f"proxy_upstream_duration_seconds_count{{{labels}}} 3.0" in exposition
+    assert f"proxy_overhead_duration_seconds_count{{{labels}}} 3.0" in exposition
+
+
+def test_shared_metrics_serve_every_worker_once(tmp_path):
+    workers = [ProxyMetrics(), ProxyMetrics()]
+    for count, metrics in enumerate(workers, 1):
+        operation = metrics.operation("GET", "/pets")
+        for _ in range(count):
+            operation.finish(200, 0.0, RequestTimings())
+    scraped = SharedMetrics(workers[0].registry, str(tmp_path))
+    sibling = SharedMetrics(workers[1].registry, str(tmp_path))
+    # Any running process will do for the sibling, but not an exited one.
+    sibling.worker = str(os.getppid())
+    sibling._write(generate_latest(sibling.registry))
+    (tmp_path / "4194305.prom").write_bytes(generate_latest(sibling.registry))
+
+    exposition = generate_latest(scraped).decode()
+
+    labels = 'method="GET",path="/pets",status="2xx"'
+    for worker, count in ((scraped.worker, 1), (sibling.worker, 2)):
+        assert f'proxy_requests_total{{{labels},worker="{worker}"}} {count}.0' in (
+            exposition
+        )
+    assert exposition.count("# TYPE proxy_requests_total counter") == 1
+    assert "4194305" not in exposition
+    assert sorted(os.listdir(tmp_path)) == [f"{sibling.worker}.prom"]
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from proxy.metrics import TIMINGS_SCOPE_KEY
+from proxy.middleware import HeaderInjectionMiddleware
+
+
+class StaticTokenManager:
+    current = b"Bearer token"
+
+
+class ExpiredTokenManager:
+    current = None
+
+    async def refresh(self):
+        await asyncio.sleep(0.01)
+        return b"Bearer fresh"
+
+
+async def headers_seen_by_app(path, **kwargs):
+    seen = {}
+
+    async def app(scope, receive, send):
+        seen["headers"] = scope["headers"]
+
+    middleware = HeaderInjectionMiddleware(
+        app, {"X-Test-Header": "TestValue"}, **kwargs
+    )
+    scope = {"type": "http", "path": path, "headers": [(b"accept", b"*/*")]}
+    await middleware(scope, None, None)
+    return seen["headers"]
+
+
+@pytest.mark.asyncio
+async def test_injects_fixed_headers_and_authorization():
+    headers = await headers_seen_by_app("/pets", token_manager=StaticTokenManager())
+
+    assert headers == [
+        (b"accept", b"*/*"),
+        (b"x-test-header", b"TestValue"),
+        (b"authorization", b"Bearer token"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_skips_local_paths():
+    headers = await headers_seen_by_app(
+        "/", token_manager=StaticTokenManager(), skip_paths={"/"}
+    )
+
+    assert headers == [(b"accept", b"*/*")]
+
+
+@pytest.mark.asyncio
+async def test_times_the_token_refresh():
+    seen = {}
+
+    async def app(scope, receive, send):
+        seen["timings"] = scope[TIMINGS_SCOPE_KEY]
+
+    middleware = HeaderInjectionMiddleware(
+        app, {}, token_manager=ExpiredTokenManager(), timed=True
+    )
+    await middleware({"type": "http", "path": "/pets", "headers": []}, None, None)
+
+    timings = seen["timings"]
+    assert timings.detailed
+    assert timings.middleware >= timings.token >= 0.01
+    assert timings.routed_at == timings.started_at + timings.middleware
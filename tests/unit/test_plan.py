@@ -0,0 +1,49 @@
+import httpx
+import pytest
+
+from proxy.plan import RequestPlan
+from proxy.proxy import proxy
+
+
+def test_plan_builds_percent_encoded_urls():
+    plan = RequestPlan("GET", "/pets/{petId}/photos/{name}.{ext}", "http://o.test")
+
+    assert plan.url({"petId": "42", "name": "cat", "ext": "png"}) == (
+        "http://o.test/pets/42/photos/cat.png"
+    )
+    assert plan.url({"petId": "a b?c#d/e", "name": "x%y", "ext": "png"}) == (
+        "http://o.test/pets/a%20b%3Fc%23d%2Fe/photos/x%25y.png"
+    )
+    assert RequestPlan("GET", "/pets", "http://o.test").url({}) == (
+        "http://o.test/pets"
+    )
+
+
+def test_plan_strips_hop_by_hop_headers():
+    headers = RequestPlan.headers(
+        {
+            "host": "proxy.test",
+            "connection": "keep-alive, x-hop",
+            "x-hop": "1",
+            "te": "trailers",
+            "transfer-encoding": "chunked",
+            "accept": "application/json",
+        }
+    )
+
+    assert headers == {"accept": "application/json"}
+
+
+@pytest.mark.asyncio
+async def test_proxy_forwards_repeated_query_keys(make_request):
+    requests = []
+
+    async def origin(request: httpx.Request):
+        requests.append(request)
+        return httpx.Response(200, stream=httpx.ByteStream(b"[]"))
+
+    request = make_request(query=b"tag=a&tag=b&name=caf%C3%A9")
+    async with httpx.AsyncClient(transport=httpx.MockTransport(origin)) as client:
+        await proxy(request, "GET", "/pets", "http://o.test", client=client)
+
+    assert requests[0].url.query == b"tag=a&tag=b&name=caf%C3%A9"
@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+from proxy.proxy import guarded_proxy
+from proxy.ratelimit import (
+    BucketStore,
+    RateLimiter,
+    RateLimitPolicy,
+    SharedBucketStore,
+)
+
+
+def test_bucket_store_refills_and_evicts_idle_buckets():
+    store = BucketStore(max_buckets=2)
+
+    assert store.take("a", rate=1.0, burst=2.0) == 1.0
+    assert store.take("a", rate=1.0, burst=2.0) == pytest.approx(0.0, abs=0.01)
+    assert store.take("a", rate=1.0, burst=2.0) < 0
+    store.take("b", rate=1.0, burst=2.0)
+    store.take("c", rate=1.0, burst=2.0)
+    assert list(store.buckets) == ["b", "c"]
+
+    # Buckets that are full again are no different from new ones.
+    store.take("d", rate=1000.0, burst=1.0)
+    time.sleep(0.01)
+    store.take("b", rate=1.0, burst=2.0)
+    assert list(store.buckets) == ["b"]
+
+
+def test_shared_store_is_seen_by_every_worker(tmp_path):
+    path = str(tmp_path / "buckets")
+    first = SharedBucketStore(path, slots=16)
+    second = SharedBucketStore(path, slots=16)
+
+    assert first.take("a", rate=0.01, burst=2.0) == pytest.approx(1.0)
+    assert second.take("a", rate=0.01, burst=2.0) == pytest.approx(0.0, abs=0.01)
+    assert first.take("a", rate=0.01, burst=2.0) < 0
+
+
+def test_limiter_keys_clients_by_header_or_address(make_request):
+    limiter = RateLimiter(
+        "GET:/pets",
+        RateLimitPolicy(rate=0.01, burst=1.0),
+        BucketStore(),
+        key_header="x-api-key",
+    )
+
+    assert limiter.check(make_request(client="10.0.0.1")) is None
+    assert limiter.check(make_request(client="10.0.0.2")) is None
+    headers = limiter.check(make_request(client="10.0.0.1"))
+    assert headers["ratelimit-remaining"] == "0"
+    assert int(headers["retry-after"]) > 1
+
+    api_key = [(b"x-api-key", b"k1")]
+    assert limiter.check(make_request(client="10.0.0.1", headers=api_key)) is None
+    assert limiter.check(make_request(client="10.0.0.2", headers=api_key)) is not None
+    assert limiter.limited == 2
+
+
+@pytest.mark.asyncio
+async def test_clients_over_the_limit_get_429(make_request):
+    limiter = RateLimiter(
+        "GET:/pets", RateLimitPolicy(rate=0.01, burst=1.0), BucketStore()
+    )
+    limiter.check(make_request(client="10.0.0.1"))
+
+    response = await guarded_proxy(
+        make_request(client="10.0.0.1"),
+        rate_limiter=limiter,
+        method="GET",
+        path="/pets",
+        origin_base_url="http://o.test",
+        client=None,
+    )
+
+    assert response.status_code == 429
+    assert response.headers["ratelimit-limit"] == "1"
@@ -0,0 +1,135 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import APIRouter
+
+from proxy.proxy import create_proxy_routes, guarded_proxy
+from proxy.resilience import (
+    CircuitBreaker,
+    OperationResilience,
+    ResiliencePolicy,
+    RetryBudget,
+)
+
+
+def test_policy_reads_schema_extensions():
+    policy = ResiliencePolicy(retries=1).for_operation(
+        {"x-proxy-retries": 3, "x-proxy-circuit-breaker-threshold": 5}
+    )
+
+    assert policy == ResiliencePolicy(retries=3, breaker_threshold=5)
+    assert not ResiliencePolicy().enabled
+    assert ResiliencePolicy().for_operation({"x-proxy-timeout": "2.5"}).timeout == 2.5
+
+
+@pytest.mark.parametrize("timeout", ["soon", -1, 0, None, float("nan")])
+def test_policy_rejects_invalid_timeouts(timeout):
+    with pytest.raises(ValueError, match="x-proxy-timeout"):
+        ResiliencePolicy().for_operation({"x-proxy-timeout": timeout})
+
+
+def test_invalid_timeouts_fail_when_the_schema_loads():
+    schema = {"paths": {"/pets": {"get": {"x-proxy-timeout": "soon"}}}}
+
+    with pytest.raises(ValueError, match="x-proxy-timeout"):
+        create_proxy_routes(APIRouter(), schema, "http://o.test")
+
+
+def test_retry_budget_limits_retries():
+    budget = RetryBudget(ratio=0.5, min_per_second=0.0, burst=2.0)
+
+    assert [budget.try_spend() for _ in range(3)] == [True, True, False]
+    budget.record_request()
+    budget.record_request()
+    assert budget.try_spend()
+
+
+def test_circuit_breaker_opens_and_lets_one_probe_through():
+    breaker = CircuitBreaker(failure_threshold=2, recovery_time=0.0)
+
+    breaker.record(False)
+    assert breaker.opened_at is None
+    breaker.record(False)
+    assert breaker.opened_at is not None
+
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record(True)
+    assert breaker.allow() and breaker.allow()
+
+
+@pytest.mark.asyncio
+async def test_idempotent_requests_are_retried():
+    statuses = [503, 502, 200]
+
+    async def origin(request: httpx.Request):
+        return httpx.Response(statuses.pop(0), stream=httpx.ByteStream(b"ok"))
+
+    get = OperationResilience("GET", ResiliencePolicy(retries=2), RetryBudget())
+    post = OperationResilience("POST", ResiliencePolicy(retries=2), RetryBudget())
+    async with httpx.AsyncClient(transport=httpx.MockTransport(origin)) as client:
+        response = await get.send(client, client.build_request("GET", "http://o.test"))
+        assert response.status_code == 200
+
+        statuses[:] = [503, 200]
+        response = await post.send(
+            client, client.build_request("POST", "http://o.test", content=b"{}")
+        )
+        assert response.status_code == 503
+
+
+@pytest.mark.asyncio
+async def test_open_circuit_fails_fast_with_503(make_request):
+    calls = []
+
+    async def origin(request: httpx.Request):
+        calls.append(request)
+        return httpx.Response(500, stream=httpx.ByteStream(b"down"))
+
+    resilience = OperationResilience(
+        "GET", ResiliencePolicy(breaker_threshold=2), RetryBudget()
+    )
+    request = make_request()
+    async with httpx.AsyncClient(transport=httpx.MockTransport(origin)) as client:
+        responses = [
+            await guarded_proxy(
+                request,
+                method="GET",
+                path="/pets",
+                origin_base_url="http://o.test",
+                client=client,
+                resilience=resilience,
+            )
+            for _ in range(3)
+        ]
+
+    assert [response.status_code for response in responses] == [500, 500, 503]
+    assert int(responses[2].headers["retry-after"]) == 30
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_slow_requests_are_hedged():
+    delays = [0.0] * 20 + [1.0, 0.0]
+    finished = []
+
+    async def origin(request: httpx.Request):
+        delay = delays.pop(0)
+        await asyncio.sleep(delay)
+        finished.append(delay)
+        return httpx.Response(200, stream=httpx.ByteStream(b"ok"))
+
+    resilience = OperationResilience(
+        "GET", ResiliencePolicy(hedge_percentile=0.9), RetryBudget()
+    )
+    async with httpx.AsyncClient(transport=httpx.MockTransport(origin)) as client:
+        for _ in range(20):
+            await resilience.send(client, client.build_request("GET", "http://o.test"))
+        response = await resilience.send(
+            client, client.build_request("GET", "http://o.test")
+        )
+
+    assert response.status_code == 200
+    # The hedge answered first and the slow attempt was abandoned.
+    assert finished[20:] == [0.0]
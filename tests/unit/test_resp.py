@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from proxy.resp import RespError, RespPool, encode_command
+
+from .resp_server import RespServer
+
+
+def test_encode_command():
+    assert encode_command(("SET", "k", b"v\r\n", 10)) == (
+        b"*4\r\n$3\r\nSET\r\n$1\r\nk\r\n$3\r\nv\r\n\r\n$2\r\n10\r\n"
+    )
+
+
+@pytest.mark.asyncio
+async def test_concurrent_commands_share_one_write():
+    async with RespServer(password="secret") as server:
+        pool = RespPool(server.url, size=1)
+        await pool.execute("SET", "a", b"1")
+        [connection] = [slot.result() for slot in pool._slots]
+        writes = []
+        write = connection.writer.write
+        connection.writer.write = lambda data: writes.append(data) or write(data)
+
+        replies = await asyncio.gather(
+            *(pool.execute("GET", key) for key in ("a", "b", "a"))
+        )
+        with pytest.raises(RespError):
+            await pool.execute("INCR", "a")
+        await pool.close()
+
+    assert replies == [b"1", None, b"1"]
+    assert len(writes) == 2
+    assert server.connections == 1
+    assert server.commands[:2] == [[b"AUTH", b"secret"], [b"SELECT", b"2"]]
+
+
+@pytest.mark.asyncio
+async def test_unreachable_servers_fail_fast():
+    async with RespServer() as server:
+        url = server.url
+    pool = RespPool(url, size=1)
+
+    with pytest.raises(OSError):
+        await pool.execute("GET", "a")
+    with pytest.raises(ConnectionError, match="unavailable"):
+        await pool.execute("GET", "a")
@@ -0,0 +1,131 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+import respx
+
+from proxy.schema import SchemaReloader, load_openapi_schema, parse_schema
+
+SCHEMA_URL = "http://schema.example.com/openapi.yaml"
+SCHEMA_YAML = """
+openapi: 3.0.0
+paths:
+  /pets:
+    get: {}
+    post: {}
+  /owners:
+    get: {}
+"""
+
+
+def test_parse_schema_accepts_json_and_yaml():
+    expected = {"paths": {"/pets": {"get": {}}}}
+
+    assert parse_schema(json.dumps(expected), "application/json") == expected
+    assert parse_schema(json.dumps(expected)) == expected
+    assert parse_schema("paths:\n  /pets:\n    get: {}\n") == expected
+
+
+def test_schema_snapshot_is_written_and_used_on_restart(tmp_path):
+    snapshot_path = str(tmp_path / "schema.json")
+
+    with respx.mock:
+        route = respx.get(SCHEMA_URL).mock(
+            return_value=httpx.Response(200, text=SCHEMA_YAML, headers={"ETag": '"v1"'})
+        )
+        schema, validators = load_openapi_schema(
+            SCHEMA_URL, ["GET:/pets"], snapshot_path=snapshot_path
+        )
+        assert route.call_count == 1
+
+    assert schema["paths"] == {"/pets": {"get": {}}}
+    assert validators == {"if-none-match": '"v1"'}
+    with open(snapshot_path) as snapshot_file:
+        snapshot = json.load(snapshot_file)
+    assert snapshot["etag"] == '"v1"'
+    assert snapshot["operations"] == [["GET", "/pets"]]
+
+    # The schema host is unreachable, but the snapshot is enough to start.
+    with respx.mock:
+        route = respx.get(SCHEMA_URL).mock(side_effect=httpx.ConnectError("down"))
+        assert load_openapi_schema(
+            SCHEMA_URL, ["GET:/pets"], snapshot_path=snapshot_path
+        ) == (schema, validators)
+        assert route.call_count == 0
+
+        # A snapshot made for another allow list is not used.
+        route.mock(return_value=httpx.Response(200, text=SCHEMA_YAML))
+        schema, _ = load_openapi_schema(SCHEMA_URL, [], snapshot_path=snapshot_path)
+        assert route.call_count == 1
+        assert schema["paths"].keys() == {"/pets", "/owners"}
+
+
+@pytest.mark.asyncio
+async def test_schema_reloader_fetches_conditionally_and_reports_changes():
+    changes = []
+    reloader = SchemaReloader(
+        SCHEMA_URL,
+        ["GET:/pets"],
+        {"openapi": "3.0.0", "paths": {"/pets": {"get": {}}}},
+        on_change=changes.append,
+        validators={"if-none-match": '"v1"'},
+    )
+
+    with respx.mock:
+        route = respx.get(SCHEMA_URL)
+        route.side_effect = [
+            httpx.Response(304),
+            httpx.Response(200, text=SCHEMA_YAML, headers={"ETag": '"v2"'}),
+            httpx.Response(
+                200,
+                text=SCHEMA_YAML.replace("get: {}", "get: {summary: List}", 1),
+                headers={"ETag": '"v3"'},
+            ),
+        ]
+
+        assert not await reloader.reload()
+        # Concurrent reloads share one fetch of the schema.
+        assert await asyncio.gather(reloader.reload(), reloader.reload()) == [
+            False,
+            False,
+        ]
+        assert await reloader.reload()
+
+        assert route.call_count == 3
+        assert route.calls[0].request.headers["if-none-match"] == '"v1"'
+        assert route.calls[2].request.headers["if-none-match"] == '"v2"'
+
+    assert [change["paths"] for change in changes] == [
+        {"/pets": {"get": {"summary": "List"}}}
+    ]
+    assert reloader.schema == changes[0]
+    assert reloader.reloads == 1
+
+
+@pytest.mark.asyncio
+async def test_schema_reloader_revalidates_the_snapshot_when_started(tmp_path):
+    changes = []
+    reloader = SchemaReloader(
+        SCHEMA_URL,
+        ["GET:/pets"],
+        {"openapi": "3.0.0", "paths": {"/owners": {"get": {}}}},
+        on_change=changes.append,
+        validators={"if-none-match": '"v1"'},
+        snapshot_path=str(tmp_path / "schema.json"),
+    )
+
+    with respx.mock:
+        route = respx.get(SCHEMA_URL).mock(
+            return_value=httpx.Response(200, text=SCHEMA_YAML, headers={"ETag": '"v2"'})
+        )
+        reloader.start()
+        await asyncio.sleep(0)
+        await reloader.stop()
+
+        assert route.call_count == 1
+        assert route.calls[0].request.headers["if-none-match"] == '"v1"'
+
+    assert [change["paths"] for change in changes] == [{"/pets": {"get": {}}}]
+    with open(tmp_path / "schema.json") as snapshot_file:
+        assert json.load(snapshot_file)["etag"] == '"v2"'
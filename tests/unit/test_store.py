@@ -0,0 +1,131 @@
+import pickle
+import time
+
+import httpx
+import pytest
+
+from proxy.cache import CachedResponse, MemoryStore, ResponseCache
+from proxy.disk import DiskStore
+from proxy.proxy import proxy
+from proxy.resp import RespPool
+from proxy.store import RedisStore, TieredStore, dumps_entry, loads_entry
+
+from .resp_server import RespServer
+
+
+def entry(body=b'{"id": 1}', **kwargs):
+    return CachedResponse(
+        status_code=200,
+        headers=[(b"content-type", b"application/json"), (b"etag", b'"v1"')],
+        body=body,
+        **kwargs,
+    )
+
+
+def test_entries_round_trip_with_their_variants():
+    original = entry(
+        stored_at=1.5,
+        expires_at=61.5,
+        vary={"accept": "application/json", "accept-language": None, "x-empty": ""},
+        variants={"gzip": entry(b"\x1f\x8b", vary={"accept": None})},
+    )
+
+    data = dumps_entry(original)
+
+    assert loads_entry(data) == original
+    assert len(data) < len(pickle.dumps(original))
+    with pytest.raises(ValueError):
+        loads_entry(data[:-1])
+
+
+@pytest.mark.asyncio
+async def test_near_store_serves_recent_entries_without_the_far_store():
+    class CountingStore(MemoryStore):
+        gets = 0
+
+        async def get(self, key):
+            self.gets += 1
+            return await super().get(key)
+
+    far = CountingStore(10_000)
+    await far.set("a", entry(), ttl=60)
+    store = TieredStore(MemoryStore(10_000), far, near_ttl=60)
+
+    assert await store.get("a") is await store.get("a") is not None
+    assert far.gets == 1
+
+    store.near_ttl = 0
+    await store.near.delete("a")
+    await store.get("a")
+    await store.get("a")
+    assert far.gets == 3
+
+
+@pytest.mark.asyncio
+async def test_updates_reach_the_far_store_when_the_near_one_is_empty(tmp_path):
+    far = DiskStore(str(tmp_path), max_bytes=10_000)
+    await far.set("a", entry(), ttl=60)
+    store = TieredStore(MemoryStore(0), far, near_ttl=60)
+
+    stored = await store.get("a")
+    stored.variants["gzip"] = entry(b"\x1f\x8b")
+    await store.update("a", stored, ttl=60)
+
+    assert (await far.get("a")).variants["gzip"].body == b"\x1f\x8b"
+    assert await store.near.get("a") is None
+
+
+@pytest.mark.asyncio
+async def test_proxies_share_responses_through_the_store(make_request):
+    calls = []
+
+    async def origin(request: httpx.Request):
+        calls.append(request)
+        return httpx.Response(
+            200,
+            headers={"cache-control": "max-age=60", "etag": '"v1"'},
+            stream=httpx.ByteStream(b'[{"id":1}]'),
+        )
+
+    request = make_request()
+    async with RespServer() as server:
+        pool = RespPool(server.url)
+        caches = [
+            ResponseCache(store=TieredStore(MemoryStore(10_000), RedisStore(pool)))
+            for _ in range(2)
+        ]
+        async with httpx.AsyncClient(transport=httpx.MockTransport(origin)) as client:
+            responses = [
+                await proxy(
+                    request, "GET", "/pets", "http://o.test", client, cache=cache
+                )
+                for cache in caches
+            ]
+        await pool.close()
+
+    assert len(calls) == 1
+    assert [response.body for response in responses] == [b'[{"id":1}]'] * 2
+    assert caches[1].hits == 1
+    [(key, (_, expires_at))] = server.data.items()
+    assert key == b"openapi-rest-proxy:GET http://o.test/pets"
+    # Entries with validators are kept past their expiry to be revalidated.
+    assert expires_at > time.time() + 3600
+
+
+@pytest.mark.asyncio
+async def test_unreachable_store_counts_as_a_miss():
+    async with RespServer() as server:
+        url = server.url
+    store = RedisStore(RespPool(url, timeout=0.1))
+    cache = ResponseCache(store=store)
+
+    await cache.set("a", entry(), {}, ttl=60)
+
+    assert await cache.get("a", {}) is None
+    assert cache.stats() == {
+        "store_errors": 2,
+        "hits": 0,
+        "misses": 1,
+        "revalidations": 0,
+        "stale": 0,
+    }
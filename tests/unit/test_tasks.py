@@ -0,0 +1,32 @@
+import asyncio
+import gc
+
+import pytest
+
+from proxy.tasks import consume_exception
+
+
+@pytest.mark.asyncio
+async def test_unawaited_failure_is_not_reported(caplog):
+    async def fail():
+        raise RuntimeError("origin down")
+
+    task = asyncio.ensure_future(fail())
+    task.add_done_callback(consume_exception)
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    assert task.done()
+    del task
+    gc.collect()
+
+    assert "never retrieved" not in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_cancelled_future_is_ignored():
+    future = asyncio.get_running_loop().create_future()
+    future.add_done_callback(consume_exception)
+    future.cancel()
+    await asyncio.sleep(0)
+
+    assert future.cancelled()
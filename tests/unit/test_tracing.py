@@ -0,0 +1,103 @@
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+    InMemorySpanExporter,
+)
+from opentelemetry.trace import SpanKind
+
+from proxy.metrics import RequestTimings
+from proxy.middleware import HeaderInjectionMiddleware
+from proxy.proxy import create_proxy_handler
+from proxy.tracing import Tracing, create_exporter
+
+TRACEPARENT = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+
+
+def proxy_app(origin, **kwargs) -> FastAPI:
+    app = FastAPI()
+    app.add_api_route(
+        "/pets/{petId}",
+        create_proxy_handler("GET", "/pets/{petId}", "http://o.test", **kwargs),
+    )
+    app.add_middleware(HeaderInjectionMiddleware, fixed_headers={}, timed=True)
+    app.state.upstream_client = httpx.AsyncClient(transport=httpx.MockTransport(origin))
+    return app
+
+
+@pytest.mark.asyncio
+async def test_trace_events_time_connection_phases():
+    timings = RequestTimings(detailed=True)
+
+    for event in (
+        "connection.connect_tcp.started",
+        "connection.connect_tcp.complete",
+        "connection.start_tls.started",
+        "connection.start_tls.complete",
+        "http11.send_request_headers.started",
+        "http11.send_request_headers.complete",
+        "http11.receive_response_headers.started",
+        "http11.receive_response_headers.complete",
+    ):
+        await timings.trace(event, {})
+
+    assert timings.connect > 0
+    assert timings.send > 0
+    assert timings.upstream == 0
+
+
+def test_server_timing_header_lists_the_phases():
+    async def origin(request: httpx.Request):
+        return httpx.Response(200, stream=httpx.ByteStream(b"{}"))
+
+    with TestClient(proxy_app(origin, server_timing=True)) as client:
+        response = client.get("/pets/1")
+
+    phases = dict(
+        entry.split(";dur=") for entry in response.headers["server-timing"].split(", ")
+    )
+    assert list(phases) == [
+        "middleware",
+        "token",
+        "routing",
+        "connect",
+        "send",
+        "upstream",
+        "total",
+    ]
+    assert float(phases["total"]) >= float(phases["upstream"]) > 0
+
+
+def test_spans_join_the_client_trace_and_propagate_to_the_origin():
+    origin_requests = []
+
+    async def origin(request: httpx.Request):
+        origin_requests.append(request)
+        return httpx.Response(503, stream=httpx.ByteStream(b""))
+
+    exporter = InMemorySpanExporter()
+    tracing = Tracing(exporter, batch=False)
+
+    with TestClient(proxy_app(origin, tracing=tracing)) as client:
+        response = client.get("/pets/1", headers={"traceparent": TRACEPARENT})
+
+    assert response.status_code == 503
+    assert "server-timing" not in response.headers
+    upstream, server = exporter.get_finished_spans()
+    assert server.name == "GET /pets/{petId}"
+    assert server.kind == SpanKind.SERVER
+    assert server.attributes["url.path"] == "/pets/1"
+    assert server.attributes["http.response.status_code"] == 503
+    assert not server.status.is_ok
+    assert server.parent.span_id == int(TRACEPARENT.split("-")[2], 16)
+    assert upstream.kind == SpanKind.CLIENT
+    assert upstream.parent.span_id == server.context.span_id
+    trace_id, span_id = origin_requests[0].headers["traceparent"].split("-")[1:3]
+    assert int(trace_id, 16) == server.context.trace_id
+    assert int(span_id, 16) == upstream.context.span_id
+
+
+def test_unknown_exporters_are_rejected():
+    with pytest.raises(ValueError, match="Unknown tracing exporter"):
+        create_exporter("jaeger")
@@ -0,0 +1,67 @@
+import time
+
+import httpx
+import pytest
+
+from proxy.upstream import BalancingTransport, OriginPool
+
+
+def test_pool_prefers_least_outstanding_weighted_origin():
+    pool = OriginPool(["http://a.test", "http://b.test"], weights=[3, 1])
+
+    chosen = [pool.acquire().url for _ in range(8)]
+
+    assert chosen.count("http://a.test") == 6
+    assert chosen.count("http://b.test") == 2
+
+
+def test_pool_ejects_failing_origins_and_fails_open():
+    pool = OriginPool(["http://a.test", "http://b.test"], failure_threshold=2)
+    a, b = pool.origins
+
+    for _ in range(2):
+        a.outstanding += 1
+        pool.release(a, failed=True)
+
+    assert not a.available(time.monotonic())
+    assert {pool.acquire().url for _ in range(4)} == {"http://b.test"}
+
+    b.healthy = False
+    assert pool.acquire() in (a, b)
+
+
+@pytest.mark.asyncio
+async def test_balancing_transport_spreads_requests_and_tracks_failures():
+    hosts = []
+
+    async def origin(request: httpx.Request):
+        hosts.append(request.headers["host"])
+        status_code = 503 if request.url.host == "b.test" else 200
+        return httpx.Response(status_code, stream=httpx.ByteStream(b"ok"))
+
+    pool = OriginPool(["http://a.test/api", "http://b.test/api"], failure_threshold=2)
+    transport = BalancingTransport(httpx.MockTransport(origin), pool)
+    async with httpx.AsyncClient(transport=transport) as client:
+        for _ in range(6):
+            await client.get("http://a.test/api/pets?limit=1")
+        # Other URLs, such as the token endpoint, are left alone.
+        await client.get("http://auth.test/token")
+
+    assert hosts[:4] == ["b.test", "a.test", "b.test", "a.test"]
+    assert hosts[4:] == ["a.test", "a.test", "auth.test"]
+    assert [origin.outstanding for origin in pool.origins] == [0, 0]
+    assert pool.origins[1].ejected_until > 0
+
+
+@pytest.mark.asyncio
+async def test_health_checks_mark_origins_unhealthy():
+    async def origin(request: httpx.Request):
+        assert request.url.path == "/healthz"
+        return httpx.Response(500 if request.url.host == "b.test" else 204)
+
+    pool = OriginPool(["http://a.test", "http://b.test"], health_check_path="/healthz")
+    transport = BalancingTransport(httpx.MockTransport(origin), pool)
+    async with httpx.AsyncClient(transport=transport) as client:
+        await pool.check(client)
+
+    assert [origin.healthy for origin in pool.origins] == [True, False]